@@ -11,7 +11,6 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model, login, logout
 from django.contrib.auth.models import Group
-from django.core.mail import send_mail
 from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
@@ -20,7 +19,9 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect, ensure_csrf_cookie
 from django.views.generic import FormView
 
-from content.models import StudentProfile
+from content.client_ip import client_ip
+from content.models import MessageTemplate, OutboxPriority, StudentProfile
+from content.services.comms_outbox import queue_email, system_template
 from .forms import StudentSignupForm, StaffSignupForm, SlimAuthForm, StudentRegisterForm
 from .models import SecurityLog
 
@@ -67,11 +68,6 @@ def _from_iso(s: str) -> datetime:
         dt = timezone.make_aware(dt)
     return dt
 
-def _client_ip(request):
-    """Best-effort client IP extraction."""
-    hdr = request.META.get("HTTP_X_FORWARDED_FOR", "")
-    return hdr.split(",")[0].strip() if hdr else request.META.get("REMOTE_ADDR")
-
 def too_many_requests(request, exception=None):
     """Basic 429 view (if you ever plug it to throttling)."""
     return HttpResponse("Too many attempts. Please try again later.", status=429)
@@ -81,7 +77,7 @@ def honeypot(request):
     (Security) Log and 404 any decoy endpoints such as /admin or fake teacher/admin login.
     """
     SecurityLog.objects.create(
-        ip=_client_ip(request),
+        ip=client_ip(request),
         path=request.path,
         action="HONEYPOT_HIT",
         user_agent=request.META.get("HTTP_USER_AGENT", ""),
@@ -154,24 +150,36 @@ def _issue_new_code() -> str:
     """Six-digit numeric code as string."""
     return f"{random.randint(0, 999_999):06d}"
 
-def _send_code_email(to_email: str, code: str):
+LOGIN_CODE_TEMPLATE = "login_code"
+
+def _send_code_email(to_email: str, code: str) -> bool:
     """
-    Email the verification code using your configured EMAIL_BACKEND.
+    Queue the verification code in the outbox's high lane and return at once:
+    dispatchers claim it before any bulk run (see process_outbox --lane high).
+    The "login_code" email template is created on first use; admins may reword it.
+    Returns False when nothing could be queued (no address, or the template
+    was deactivated / changed to SMS in the admin).
     """
     if not to_email:
-        return
-    subject = "Your verification code"
-    body = (
-        f"Your login verification code is: {code}\n"
-        f"This code expires in {CODE_TTL_MINUTES} minutes."
+        return False
+    tpl = system_template(
+        LOGIN_CODE_TEMPLATE,
+        kind=MessageTemplate.KIND_EMAIL,
+        subject_template="Your verification code",
+        body_text_template=(
+            "Your login verification code is: {{ code }}\n"
+            "This code expires in {{ ttl_minutes }} minutes."
+        ),
     )
-    send_mail(
-        subject,
-        body,
-        getattr(settings, "DEFAULT_FROM_EMAIL", None),
-        [to_email],
-        fail_silently=False,  # raise in dev to see errors; switch to True if desired
+    if tpl is None:
+        return False
+    queue_email(
+        to=to_email,
+        template_slug=tpl.slug,
+        context={"code": code, "ttl_minutes": CODE_TTL_MINUTES},
+        priority=OutboxPriority.HIGH,
     )
+    return True
 
 def _start_2fa(request, user: User, role_label: str):
     """
@@ -187,11 +195,12 @@ def _start_2fa(request, user: User, role_label: str):
     request.session[SESSION_2FA_LAST_SEND] = _now().isoformat()
 
     to_email = request.session[SESSION_2FA_EMAIL]
-    if to_email:
-        _send_code_email(to_email, code)
+    if not to_email:
+        messages.warning(request, "No email is set on your account; cannot send code.")
+    elif _send_code_email(to_email, code):
         messages.info(request, f"We sent a code to {to_email}.")
     else:
-        messages.warning(request, "No email is set on your account; cannot send code.")
+        messages.error(request, "We could not send a verification code right now. Please contact the office.")
 
     # Optional debug hint:
     if settings.DEBUG:
@@ -291,11 +300,14 @@ def resend_code(request):
     request.session[SESSION_2FA_RESENDS] = resends + 1
     request.session[SESSION_2FA_LAST_SEND] = _now().isoformat()
 
-    _send_code_email(email, new_code)
+    sent = _send_code_email(email, new_code)
     if settings.DEBUG:
         messages.info(request, f"[DEBUG] New code: {new_code}")
 
-    messages.success(request, f"A new code was sent to {email}.")
+    if sent:
+        messages.success(request, f"A new code was sent to {email}.")
+    else:
+        messages.error(request, "We could not send a verification code right now. Please contact the office.")
     return redirect("accounts:verify_code")
 
 
@@ -364,7 +376,7 @@ def _generic_login(request, role: str, require_2fa: bool = False):
         if not _user_has_role(user, role):
             messages.error(request, "This account doesn’t match this portal.")
             SecurityLog.objects.create(
-                ip=_client_ip(request),
+                ip=client_ip(request),
                 path=request.path,
                 action="WRONG_PORTAL_ROLE",
                 user_agent=request.META.get("HTTP_USER_AGENT", ""),
@@ -405,7 +417,7 @@ def _protected_staff_signup(request, desired_role: str, token: str):
 
         if not token or provided != token:
             SecurityLog.objects.create(
-                ip=_client_ip(request),
+                ip=client_ip(request),
                 path=request.path,
                 action="INVALID_INVITE_TOKEN",
                 user_agent=request.META.get("HTTP_USER_AGENT", ""),
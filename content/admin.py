@@ -11,8 +11,8 @@ from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import Sum, F, Max, Q, Value, DecimalField, ExpressionWrapper
 from django.db.models.functions import Coalesce
-from django.http import JsonResponse, HttpResponseForbidden
-from django.shortcuts import render
+from django.http import HttpResponse, JsonResponse, HttpResponseForbidden
+from django.shortcuts import redirect, render
 from django.template.response import TemplateResponse
 from django.urls import path, reverse
 from django.utils import timezone
@@ -33,8 +33,15 @@ from .models import (
     Expense, Income, TuitionInvoice, TuitionPayment,
     ExpenseCategory, IncomeCategory, StudentProfile,
     PaymentReceipt, EmailBounce, CommsLog, EmailOutbox, SmsOutbox, MessageTemplate,
+    CommsDailyStat, CommsSuppression,
 )
-from .services.comms_outbox import queue_sms
+from .services.booklet import BookletError, build_booklet
+from .services.comms_outbox import broadcast, queue_sms
+from .services.contacts import BROADCAST_AUDIENCES
+from .services.marks_import import MarksImportError, import_marks, read_rows
+from .services.results import aggregate_results, results_changed
+from .services.comms_metrics import dashboard as comms_dashboard
+from .services.sms_segments import segment_report, sms_segments
 from .views import finance_overview, build_finance_context
 
 
@@ -908,18 +915,47 @@ class StudentMarksheetAdmin(OwnableAdminMixin):
 
     list_display = (
         "student_full_name", "school_class", "term",
-        "percent_display", "total_grade", "is_pass",
+        "percent_display", "total_grade", "class_position", "section_position", "is_pass",
         "certificate_actions",           # ← buttons here
         "updated_at",
     )
-    list_filter = ("term", "school_class", "is_pass")
+    list_filter = ("term", "school_class", "is_pass", "is_published")
     search_fields = ("student_full_name", "roll_number", "section")
+    actions = ["publish_selected", "unpublish_selected", "print_booklet"]
 
     def get_inline_instances(self, request, obj=None):
         if obj is None:
             return []
         return super().get_inline_instances(request, obj)
 
+    def _set_published(self, request, queryset, value: bool):
+        pairs = set(queryset.values_list("school_class_id", "term_id").distinct())
+        with transaction.atomic():
+            n = queryset.update(is_published=value, updated_at=timezone.now())
+            for class_id, term_id in pairs:
+                results_changed(class_id, term_id)  # class summaries refresh on commit
+        self.message_user(request, f"{'Published' if value else 'Unpublished'} {n} marksheet(s); "
+                                   f"result summaries of {len(pairs)} class / term(s) refreshed.")
+
+    @admin.action(description="Publish selected marksheets (and refresh class results)")
+    def publish_selected(self, request, queryset):
+        self._set_published(request, queryset, True)
+
+    @admin.action(description="Unpublish selected marksheets (and refresh class results)")
+    def unpublish_selected(self, request, queryset):
+        self._set_published(request, queryset, False)
+
+    @admin.action(description="Print selected as one PDF booklet (ordered by roll)")
+    def print_booklet(self, request, queryset):
+        try:
+            pdf, stats = build_booklet(queryset, target="content", base_url=request.build_absolute_uri("/"))
+        except BookletError as e:
+            self.message_user(request, str(e), level=messages.ERROR)
+            return None
+        resp = HttpResponse(pdf, content_type="application/pdf")
+        resp["Content-Disposition"] = f'attachment; filename="marksheets_booklet_{stats["sheets"]}.pdf"'
+        return resp
+
     @admin.display(ordering="total_marks", description="Percent")
     def percent_display(self, obj):
         try:
@@ -947,7 +983,7 @@ class StudentMarksheetAdmin(OwnableAdminMixin):
                 order += 1
 
         obj.recalc_totals()
-        obj.save(update_fields=["total_marks", "total_grade", "updated_at"])
+        obj.save(update_fields=["total_marks", "total_pct", "total_grade", "updated_at"])
 
 
 
@@ -1002,7 +1038,7 @@ class StudentMarksheetAdmin(OwnableAdminMixin):
             return HttpResponseForbidden("Certificate not available.")
 
         obj.recalc_totals()
-        obj.save(update_fields=["total_marks", "total_grade", "is_pass", "updated_at"])
+        obj.save(update_fields=["total_marks", "total_pct", "total_grade", "is_pass", "updated_at"])
 
         branding = SiteBranding.objects.filter(is_active=True).first()
         auto_download_png = (request.GET.get("dl") == "png")
@@ -1032,6 +1068,40 @@ class StudentMarksheetItemAdmin(OwnableAdminMixin):
     raw_id_fields = ("marksheet",)
 
 
+class ClassResultSubjectAvgInline(admin.TabularInline):
+    model = ClassResultSubjectAvg
+    extra = 0
+    fields = ("subject", "avg_score", "out_of")
+    autocomplete_fields = ("subject",)
+
+
+class ClassTopperInline(admin.TabularInline):
+    model = ClassTopper
+    extra = 0
+    fields = ("rank", "name", "roll_no", "total_pct", "grade", "profile_image")
+
+
+@admin.register(ClassResultSummary)
+class ClassResultSummaryAdmin(OwnableAdminMixin):
+    inlines = [ClassResultSubjectAvgInline, ClassTopperInline]
+    list_display = ("klass", "term", "appeared", "passed", "pass_rate_pct", "overall_avg_pct",
+                    "highest_pct", "is_auto", "updated_at")
+    list_filter = ("term", "klass")
+    readonly_fields = ("auto_source",)
+    actions = ["recompute_selected"]
+
+    @admin.display(boolean=True, description="Computed")
+    def is_auto(self, obj):
+        return bool(obj.auto_source)
+
+    @admin.action(description="Recompute from published marksheets")
+    def recompute_selected(self, request, queryset):
+        pairs = set(queryset.values_list("klass_id", "term_id"))
+        stats = aggregate_results(pairs, force=True)
+        self.message_user(request, f"Recomputed {stats['stale']} summary(ies): {stats['subject_avgs']} subject "
+                                   f"average(s), {stats['toppers']} topper(s).")
+
+
 
 
 def _month_bounds_local():
@@ -1357,6 +1427,12 @@ class StudentProfileAdmin(admin.ModelAdmin):
     list_display = ("__str__", "school_class", "section", "roll_number", "user")
     search_fields = ("user__username", "section")
     list_filter = ("school_class", "section")
+    actions = ["broadcast_to_selected"]
+
+    @admin.action(description="Broadcast a message to the selected students / guardians")
+    def broadcast_to_selected(self, request, queryset):
+        request.session["comms_broadcast_ids"] = list(queryset.values_list("pk", flat=True))
+        return redirect("admin:comms-broadcast")
 
 
 
@@ -1443,6 +1519,124 @@ def student_ledger_admin(request):
 
 
 
+@staff_member_required
+def comms_metrics_admin(request):
+    try:
+        minutes = min(12 * 60, max(5, int(request.GET.get("minutes") or 60)))
+    except ValueError:
+        minutes = 60
+    channel = request.GET.get("channel") if request.GET.get("channel") in ("sms", "email") else None
+
+    ctx = admin.site.each_context(request)
+    ctx.update(comms_dashboard(minutes=minutes, channel=channel))
+    ctx.update({"title": "Comms Metrics", "channel": channel or "", "windows": [15, 60, 180, 720]})
+    return render(request, "site_admin/comms/metrics.html", ctx)
+
+
+@staff_member_required
+def sms_segment_report_admin(request):
+    ctx = admin.site.each_context(request)
+    rows = segment_report()
+    ctx.update({
+        "title": "SMS Segment Cost",
+        "rows": rows,
+        "currency_price": getattr(settings, "SMS_SEGMENT_PRICE", None),
+        "total_queued": sum(r["queued"] for r in rows),
+        "total_segments": sum(r["projected_segments"] for r in rows),
+        "total_saved": sum(r["saved_segments"] for r in rows),
+    })
+    return render(request, "site_admin/comms/sms_segments.html", ctx)
+
+
+class BroadcastForm(forms.Form):
+    template = forms.ModelChoiceField(
+        queryset=MessageTemplate.objects.filter(is_active=True).order_by("kind", "slug"),
+        help_text="SMS templates go to phones, email templates to the students' account email.",
+    )
+    school_class = forms.ModelChoiceField(queryset=AcademicClass.objects.order_by("-year", "name"), required=False)
+    section = forms.CharField(max_length=20, required=False)
+    audience = forms.ChoiceField(choices=[(a, a.title()) for a in BROADCAST_AUDIENCES], initial="guardians",
+                                 help_text="SMS only: guardians fall back to the student's own number.")
+    message = forms.CharField(widget=forms.Textarea(attrs={"rows": 4}), required=False,
+                              help_text="Available to the template as {{ message }}.")
+    scheduled_at = forms.DateTimeField(required=False, help_text="Leave empty to send now.")
+
+
+@staff_member_required
+def comms_broadcast_admin(request):
+    # set by StudentProfileAdmin.broadcast_to_selected; otherwise filter by class/section
+    ids = request.session.get("comms_broadcast_ids")
+    if request.GET.get("clear"):
+        request.session.pop("comms_broadcast_ids", None)
+        ids = None
+    students = StudentProfile.objects.filter(pk__in=ids) if ids else None
+
+    form = BroadcastForm(request.POST or None)
+    if request.method == "POST" and form.is_valid():
+        data = form.cleaned_data
+        if students is None and data["school_class"] is None:
+            form.add_error("school_class", "Pick a class (or select students from the Student Profiles list).")
+        else:
+            context = {"message": data["message"]} if data["message"] else {}
+            try:
+                stats = broadcast(
+                    data["template"], school_class=data["school_class"], section=data["section"],
+                    audience=data["audience"], students=students, context=context,
+                    created_by=request.user, scheduled_at=data["scheduled_at"],
+                )
+            except Exception as e:  # template syntax errors surface here, before anything is queued
+                messages.error(request, f"Nothing queued: {e}")
+            else:
+                request.session.pop("comms_broadcast_ids", None)
+                msg = (f"Queued {stats['queued']} message(s) for {stats['recipients']} recipient(s) "
+                       f"covering {stats['students']} student(s)")
+                if stats["suppressed"]:
+                    msg += f"; {stats['suppressed']} suppressed"
+                if data["template"].kind == MessageTemplate.KIND_SMS:
+                    msg += f"; {stats['segments']} SMS segments"
+                messages.success(request, msg + ".")
+                return redirect("admin:comms-broadcast")
+
+    ctx = admin.site.each_context(request)
+    ctx.update({"title": "Broadcast", "form": form, "selected_count": len(ids) if ids else 0})
+    return render(request, "site_admin/comms/broadcast.html", ctx)
+
+
+class MarksImportForm(forms.Form):
+    school_class = forms.ModelChoiceField(queryset=AcademicClass.objects.order_by("-year", "name", "section"))
+    term = forms.ModelChoiceField(queryset=ExamTerm.objects.order_by("-year", "name"))
+    file = forms.FileField(help_text="CSV or XLSX. First row is the header.")
+    dry_run = forms.BooleanField(required=False, help_text="Only validate; nothing is saved.")
+
+
+@staff_member_required
+def marks_import_admin(request):
+    form = MarksImportForm(request.POST or None, request.FILES or None)
+    stats = None
+    if request.method == "POST" and form.is_valid():
+        data = form.cleaned_data
+        upload = data["file"]
+        try:
+            stats = import_marks(
+                read_rows(upload.file, upload.name), school_class=data["school_class"], term=data["term"],
+                dry_run=data["dry_run"], created_by=request.user, max_errors=500,
+            )
+        except MarksImportError as e:
+            messages.error(request, f"Nothing imported: {e}")
+        else:
+            verb = "Checked" if data["dry_run"] else "Imported"
+            msg = (f"{verb} {stats['rows']} row(s): {stats['updated']} mark(s) updated, {stats['created']} added, "
+                   f"{stats['new_marksheets']} new marksheet(s), {stats['marksheets']} marksheet(s) recalculated.")
+            if stats["error_count"]:
+                messages.warning(request, f"{msg} {stats['error_count']} row error(s) skipped, listed below.")
+            else:
+                messages.success(request, msg)
+
+    ctx = admin.site.each_context(request)
+    ctx.update({"title": "Import marks", "form": form, "stats": stats})
+    return render(request, "site_admin/content/marks_import.html", ctx)
+
+
 # hook the URL into the admin
 class FinanceAdminSite(admin.AdminSite):  # if you already have one, just add to get_urls
     def get_urls(self):
@@ -1458,6 +1652,10 @@ def _extra_admin_urls():
     return [
         path("finance/student-ledger/", admin.site.admin_view(student_ledger_admin), name="finance_student_ledger"),
         path("finance/overview/", admin.site.admin_view(finance_overview_admin), name="finance-overview"),
+        path("comms/metrics/", admin.site.admin_view(comms_metrics_admin), name="comms-metrics"),
+        path("comms/sms-segments/", admin.site.admin_view(sms_segment_report_admin), name="comms-sms-segments"),
+        path("comms/broadcast/", admin.site.admin_view(comms_broadcast_admin), name="comms-broadcast"),
+        path("marks/import/", admin.site.admin_view(marks_import_admin), name="marks-import"),
     ]
 
 _original_get_urls = admin.site.get_urls
@@ -1555,21 +1753,34 @@ def send_dues_sms(modeladmin, request, queryset):
 
 @admin.register(MessageTemplate)
 class MessageTemplateAdmin(admin.ModelAdmin):
-    list_display = ("slug", "kind", "is_active", "updated_at")
+    list_display = ("slug", "kind", "is_active", "sms_segments_info", "updated_at")
     list_filter = ("kind", "is_active")
     search_fields = ("slug", "subject_template", "body_text_template")
+    readonly_fields = ("sms_segments_info",)
+
+    def sms_segments_info(self, obj):
+        # of the raw template text (placeholders unexpanded); see admin/comms/sms-segments/ for real renders
+        if obj.kind != MessageTemplate.KIND_SMS:
+            return "—"
+        encoding, segments = sms_segments(obj.body_text_template or "")
+        info = f"{segments} × {encoding}"
+        if obj.body_text_compact_template:
+            c_encoding, c_segments = sms_segments(obj.body_text_compact_template)
+            info += f" (compact: {c_segments} × {c_encoding})"
+        return info
+    sms_segments_info.short_description = "SMS segments"
 
 @admin.register(SmsOutbox)
 class SmsOutboxAdmin(admin.ModelAdmin):
-    list_display = ("id", "to", "template", "status", "attempts", "scheduled_at", "sent_at", "provider_ref")
-    list_filter = ("status", "provider")
+    list_display = ("id", "to", "template", "status", "priority", "segments", "encoding", "attempts", "scheduled_at", "sent_at", "provider_ref")
+    list_filter = ("status", "priority", "provider")
     search_fields = ("to", "provider_ref")
     autocomplete_fields = ("template", "created_by")
 
 @admin.register(EmailOutbox)
 class EmailOutboxAdmin(admin.ModelAdmin):
-    list_display = ("id", "to", "template", "status", "attempts", "scheduled_at", "sent_at", "provider_ref")
-    list_filter = ("status", "provider")
+    list_display = ("id", "to", "template", "status", "priority", "attempts", "scheduled_at", "sent_at", "provider_ref")
+    list_filter = ("status", "priority", "provider")
     search_fields = ("to", "provider_ref")
     autocomplete_fields = ("template", "created_by")
 
@@ -1585,6 +1796,19 @@ class EmailBounceAdmin(admin.ModelAdmin):
     list_filter = ("event",)
     search_fields = ("email", "reason")
 
+@admin.register(CommsSuppression)
+class CommsSuppressionAdmin(admin.ModelAdmin):
+    list_display = ("address", "channel", "reason", "created_at")
+    list_filter = ("channel", "reason")
+    search_fields = ("address",)
+
+@admin.register(CommsDailyStat)
+class CommsDailyStatAdmin(admin.ModelAdmin):
+    list_display = ("day", "channel", "template_slug", "status", "count")
+    list_filter = ("channel", "status")
+    search_fields = ("template_slug",)
+    date_hierarchy = "day"
+
 
 """
 python manage.py queue_dues_notices --send-sms --send-email
@@ -0,0 +1,39 @@
+# content/client_ip.py
+"""
+The address of the client behind a request, for throttles and security logs.
+
+X-Forwarded-For is client-controlled: anyone can send "X-Forwarded-For: 1.2.3.4"
+and, if the first value were trusted, get a fresh throttle bucket per request.
+So it is only read when settings.TRUSTED_PROXY_COUNT says how many reverse
+proxies of ours sit in front of Django (e.g. 1 for nginx). Each of them appends
+the address it received the request from, so the client is the entry that
+many hops from the right; anything further left was written by the client.
+Without it (default 0) the answer is REMOTE_ADDR.
+"""
+import ipaddress
+
+from django.conf import settings
+
+
+def trusted_proxy_count() -> int:
+    return max(0, int(getattr(settings, "TRUSTED_PROXY_COUNT", 0) or 0))
+
+
+def _valid(value) -> str | None:
+    try:
+        return str(ipaddress.ip_address((value or "").strip()))
+    except ValueError:
+        return None
+
+
+def client_ip(request) -> str | None:
+    """The client's IP address, or None if it cannot be told."""
+    remote = _valid(request.META.get("REMOTE_ADDR"))
+    proxies = trusted_proxy_count()
+    if not proxies:
+        return remote
+    hops = [h.strip() for h in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if h.strip()]
+    if not hops:
+        return remote
+    # fewer hops than proxies: the whole header came from our own proxies
+    return _valid(hops[-proxies] if len(hops) >= proxies else hops[0]) or remote
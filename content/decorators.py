@@ -1,5 +1,5 @@
 from functools import wraps
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, JsonResponse
 from .roles import is_admin, is_teacher
 
 def teacher_or_admin_required(viewfunc):
@@ -9,3 +9,26 @@ def teacher_or_admin_required(viewfunc):
             return viewfunc(request, *args, **kwargs)
         return HttpResponseForbidden("Not allowed.")
     return _wrapped
+
+
+def signed_webhook(channel):
+    """
+    Reject provider webhooks that are not signed with the channel's secret
+    (X-Webhook-Signature: HMAC-SHA256 of the body) and do not carry it
+    (X-Webhook-Token header or ?token=). See content.services.comms_events.
+    """
+    def decorator(viewfunc):
+        @wraps(viewfunc)
+        def _wrapped(request, *args, **kwargs):
+            from .services.comms_events import verify_webhook
+
+            ok = verify_webhook(
+                channel, request.body,
+                signature=request.headers.get("X-Webhook-Signature", ""),
+                token=request.headers.get("X-Webhook-Token") or request.GET.get("token", ""),
+            )
+            if not ok:
+                return JsonResponse({"ok": False, "error": "invalid signature"}, status=403)
+            return viewfunc(request, *args, **kwargs)
+        return _wrapped
+    return decorator
@@ -0,0 +1,37 @@
+# content/management/commands/aggregate_results.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from content.models import AcademicClass, ExamTerm
+from content.services.results import aggregate_results, top_n_default
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute ClassResultSummary / ClassResultSubjectAvg / ClassTopper from the published marksheets. "
+        "Only classes whose marksheets changed since the last run are recomputed (see --force)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--class", dest="class_id", type=int, help="Only this AcademicClass id.")
+        parser.add_argument("--term", dest="term_id", type=int, help="Only this ExamTerm id.")
+        parser.add_argument("--top", type=int, default=None,
+                            help=f"Toppers per class (default RESULTS_TOP_N = {top_n_default()}).")
+        parser.add_argument("--force", action="store_true", help="Recompute even unchanged classes.")
+
+    def handle(self, *args, **opts):
+        try:
+            klass = AcademicClass.objects.get(pk=opts["class_id"]) if opts["class_id"] else None
+            term = ExamTerm.objects.get(pk=opts["term_id"]) if opts["term_id"] else None
+        except (AcademicClass.DoesNotExist, ExamTerm.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        t0 = time.perf_counter()
+        stats = aggregate_results(school_class=klass, term=term, force=opts["force"], top_n=opts["top"])
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['pairs']} class / term(s) with published marksheets; recomputed {stats['stale']} "
+            f"({stats['summaries_created']} new summaries, {stats['subject_avgs']} subject averages, "
+            f"{stats['toppers']} toppers) in {elapsed:.2f}s."
+        ))
@@ -0,0 +1,68 @@
+# content/management/commands/backfill_student_phones.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from content.models import AdmissionApplication, StudentProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill StudentProfile phone / guardian_phone from the matching admission application "
+        "(class + section + roll) where blank, and (re)compute the E.164 columns. Works in pk chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        chunk = max(1, opts["chunk"])
+        fields = ["phone", "guardian_phone", "phone_e164", "guardian_phone_e164"]
+        last_pk = 0
+        scanned = updated = copied = 0
+
+        while True:
+            profiles = list(
+                StudentProfile.objects.filter(pk__gt=last_pk).order_by("pk")
+                .only("pk", "school_class_id", "section", "roll_number", *fields)[:chunk]
+            )
+            if not profiles:
+                break
+            last_pk = profiles[-1].pk
+            scanned += len(profiles)
+
+            # one query for the admission applications behind this chunk's blanks
+            missing = [p for p in profiles if not (p.phone and p.guardian_phone)]
+            apps = {}
+            if missing:
+                for app in (
+                    AdmissionApplication.objects
+                    .filter(enroll_class_id__in={p.school_class_id for p in missing},
+                            generated_roll__in={p.roll_number for p in missing})
+                    .order_by("created_at")
+                    .values("enroll_class_id", "enroll_section", "generated_roll", "phone", "guardian_phone")
+                ):
+                    apps[(app["enroll_class_id"], app["enroll_section"] or "", app["generated_roll"])] = app
+
+            changed = []
+            for p in profiles:
+                app = apps.get((p.school_class_id, p.section or "", p.roll_number))
+                touched = False
+                if app:
+                    if not p.phone and app["phone"]:
+                        p.phone = app["phone"]; touched = True
+                    if not p.guardian_phone and app["guardian_phone"]:
+                        p.guardian_phone = app["guardian_phone"]; touched = True
+                    copied += touched
+                if p.normalize_phones() or touched:
+                    changed.append(p)
+
+            updated += len(changed)
+            if changed and not opts["dry_run"]:
+                with transaction.atomic():
+                    StudentProfile.objects.bulk_update(changed, fields, batch_size=chunk)
+
+        verb = "Would update" if opts["dry_run"] else "Updated"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {scanned} profiles. {verb} {updated} ({copied} filled from admission applications)."
+        ))
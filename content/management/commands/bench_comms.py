@@ -0,0 +1,436 @@
+# content/management/commands/bench_comms.py
+import json
+import multiprocessing
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connections, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from content.models import (
+    AcademicClass, CommsLog, EmailOutbox, MessageTemplate, OutboxPriority, SmsOutbox, StudentProfile,
+)
+from content.services.comms_outbox import broadcast, bulk_queue_email, process_email_batch, queue_email
+from content.services.comms_templating import django_engine, render_many
+from content.services import rate_limit
+from content.services.emailing import build_email_message, send_email_batch, send_email_smtp
+from content.services.circuit_breaker import CLOSED, OPEN
+from content.services.sms import provider_breaker, send_sms_batch
+
+
+# ---------------------------------------------------------------------------
+# Local debugging SMTP sink (accepts everything, stores nothing)
+# ---------------------------------------------------------------------------
+class _SmtpSinkHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # simulate TCP/TLS handshake + AUTH cost of a real relay
+        time.sleep(self.server.connect_latency)
+        self.wfile.write(b"220 bench-sink ESMTP\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.strip().upper()
+            if cmd.startswith((b"EHLO", b"HELO")):
+                self.wfile.write(b"250 bench-sink\r\n")
+            elif cmd == b"DATA":
+                self.wfile.write(b"354 end with <CRLF>.<CRLF>\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.received += 1
+                self.wfile.write(b"250 queued\r\n")
+            elif cmd == b"QUIT":
+                self.wfile.write(b"221 bye\r\n")
+                return
+            else:  # MAIL FROM / RCPT TO / RSET / NOOP
+                self.wfile.write(b"250 ok\r\n")
+
+
+class _SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_latency: float):
+        super().__init__(("127.0.0.1", 0), _SmtpSinkHandler)
+        self.connect_latency = connect_latency
+        self.received = 0
+
+
+# ---------------------------------------------------------------------------
+# Local stub SMS gateway (speaks the "generic" provider protocol)
+# ---------------------------------------------------------------------------
+class _SmsGatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled sessions reuse sockets
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.received += 1
+            ref = f"stub-{self.server.received}"
+        if self.server.failing:
+            body = json.dumps({"error": "unavailable"}).encode()
+            self.send_response(503)
+        else:
+            body = json.dumps({"message_id": ref}).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _SmsGateway(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float, failing: bool = False):
+        super().__init__(("127.0.0.1", 0), _SmsGatewayHandler)
+        self.latency = latency
+        self.failing = failing
+        self.received = 0
+        self.lock = threading.Lock()
+
+
+def _rate_limit_worker(provider: str, seconds: float, out) -> None:
+    """Take tokens as fast as the limiter allows until the deadline; report the count."""
+    deadline = time.monotonic() + seconds
+    granted = 0
+    while time.monotonic() < deadline:
+        rate_limit.acquire(provider)
+        if time.monotonic() <= deadline:
+            granted += 1
+    out.put(granted)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmarks for the comms pipeline against local stubs (no external services)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["smtp", "sms", "render", "ratelimit", "failover", "broadcast", "lanes"])
+        parser.add_argument("--messages", type=int, default=200, help="Messages (recipients for broadcast).")
+        parser.add_argument("--latency-ms", type=int, default=50,
+                            help="Simulated latency of the stub server (per connection for SMTP, per request for SMS).")
+        parser.add_argument("--concurrency", type=int, default=8, help="SMS_CONCURRENCY for the sms benchmark.")
+        parser.add_argument("--workers", type=int, default=4, help="Competing workers for the ratelimit benchmark.")
+        parser.add_argument("--rate", type=float, default=20, help="per_second limit for the ratelimit benchmark.")
+        parser.add_argument("--burst", type=float, default=None, help="Bucket size for the ratelimit benchmark.")
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--redis-url", default="", help="Run the ratelimit benchmark against this Redis cache.")
+        parser.add_argument("--bulk", type=int, default=10000, help="Bulk-lane backlog for the lanes benchmark.")
+        parser.add_argument("--breaker-failures", type=int, default=5, help="SMS_BREAKER_FAILURES for failover.")
+        parser.add_argument("--breaker-cooldown", type=float, default=1.0, help="SMS_BREAKER_COOLDOWN for failover.")
+
+    def handle(self, *args, **opts):
+        getattr(self, f"_bench_{opts['target']}")(opts)
+
+    # ------------------------------ SMTP ------------------------------
+    def _bench_smtp(self, opts):
+        n = opts["messages"]
+        sink = _SmtpSink(connect_latency=opts["latency_ms"] / 1000.0)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        host, port = sink.server_address
+
+        def conn():
+            return get_connection("django.core.mail.backends.smtp.EmailBackend",
+                                  host=host, port=port, use_tls=False, use_ssl=False,
+                                  username="", password="", fail_silently=False)
+
+        kwargs = [dict(to=f"guardian{i}@example.com", subject=f"Dues notice {i}",
+                       body_text="Your tuition is due.", from_email="school@example.com")
+                  for i in range(n)]
+
+        try:
+            t0 = time.perf_counter()
+            for kw in kwargs:
+                send_email_smtp(connection=conn(), **kw)
+            per_message = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            results = send_email_batch([build_email_message(**kw) for kw in kwargs], connection=conn())
+            batched = time.perf_counter() - t0
+        finally:
+            sink.shutdown()
+            sink.server_close()
+
+        failed = sum(1 for r in results if r is not None)
+        self.stdout.write(f"SMTP sink received: {sink.received} messages")
+        self.stdout.write(f"connection per message: {per_message:.2f}s ({n / per_message:.0f} msg/s)")
+        self.stdout.write(f"one connection per batch: {batched:.2f}s ({n / batched:.0f} msg/s), failed={failed}")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {per_message / batched:.1f}x"))
+
+    # ------------------------------ SMS -------------------------------
+    def _bench_sms(self, opts):
+        n = opts["messages"]
+        gateway = _SmsGateway(latency=opts["latency_ms"] / 1000.0)
+        threading.Thread(target=gateway.serve_forever, daemon=True).start()
+        url = "http://%s:%s/send" % gateway.server_address
+        payloads = [{"to": f"+8801700{i:06d}", "sender_id": "SCHOOL", "body": "Tuition due."} for i in range(n)]
+
+        try:
+            with override_settings(SMS_PROVIDER="generic", SMS_GENERIC_BASE_URL=url,
+                                   SMS_GENERIC_API_KEY="bench", SMS_CONCURRENCY=opts["concurrency"]):
+                t0 = time.perf_counter()
+                sequential = send_sms_batch(payloads, concurrency=1)
+                seq_time = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                concurrent = send_sms_batch(payloads)
+                conc_time = time.perf_counter() - t0
+        finally:
+            gateway.shutdown()
+            gateway.server_close()
+
+        failed = sum(1 for r in sequential + concurrent if isinstance(r, Exception))
+        self.stdout.write(f"Stub gateway received: {gateway.received} requests, failed={failed}")
+        self.stdout.write(f"sequential: {seq_time:.2f}s ({n / seq_time:.0f} sms/s)")
+        self.stdout.write(f"concurrency={opts['concurrency']}: {conc_time:.2f}s ({n / conc_time:.0f} sms/s)")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {seq_time / conc_time:.1f}x"))
+
+    # ----------------------------- render -----------------------------
+    def _bench_render(self, opts):
+        n = opts["messages"]
+        # unsaved row with a fake pk: exercises the cache without touching the DB
+        tpl = MessageTemplate(
+            pk=-1, kind=MessageTemplate.KIND_EMAIL, updated_at=timezone.now(),
+            body_html_template=(
+                "<p>Dear {{ student_name }},</p>"
+                "{% for item in items %}<p>{{ item.period }}: {{ item.amount_due }}</p>{% endfor %}"
+                "<p>Total due: <b>{{ amount_due }}</b> by {{ due_date|default:'-' }}.</p>"
+            ) * 5,
+        )
+        contexts = [{"student_name": f"Student {i}", "amount_due": f"{i}.00", "due_date": "2025-10-20",
+                     "items": [{"period": "2025-09", "amount_due": "1000.00"}]} for i in range(n)]
+
+        t0 = time.perf_counter()
+        for ctx in contexts:
+            django_engine.from_string(tpl.body_html_template).render(ctx)
+        parse_each = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        render_many(tpl, "body_html_template", contexts)
+        cached = time.perf_counter() - t0
+
+        self.stdout.write(f"from_string per message: {parse_each * 1000:.1f} ms for {n} renders")
+        self.stdout.write(f"compiled cache (render_many): {cached * 1000:.1f} ms for {n} renders")
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {parse_each / cached:.1f}x"))
+
+    # --------------------------- rate limit ---------------------------
+    def _bench_ratelimit(self, opts):
+        """
+        Several workers hammer one provider bucket; the aggregate must stay
+        within per_second * seconds + burst (one bucket's worth of slack).
+        Workers are processes when the cache is shared, threads otherwise.
+        """
+        provider, rate, seconds = "bench", opts["rate"], opts["seconds"]
+        burst = opts["burst"] or rate
+        overrides = {"COMMS_RATE_LIMITS": {provider: {"per_second": rate, "burst": burst}}}
+        if opts["redis_url"]:
+            overrides["CACHES"] = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                                               "LOCATION": opts["redis_url"]}}
+
+        with override_settings(**overrides):
+            backend = rate_limit._backend()
+            if backend == "local":
+                ctx, make = multiprocessing, threading.Thread
+                out = __import__("queue").Queue()
+            else:
+                ctx = multiprocessing.get_context("fork")
+                make, out = ctx.Process, ctx.Queue()
+
+            workers = [make(target=_rate_limit_worker, args=(provider, seconds, out)) for _ in range(opts["workers"])]
+            t0 = time.perf_counter()
+            for w in workers:
+                w.start()
+            granted = [out.get() for _ in workers]
+            for w in workers:
+                w.join()
+            elapsed = time.perf_counter() - t0
+
+        total = sum(granted)
+        allowed = rate * seconds + (2 * burst if backend == "cache" else burst)
+        kind = "threads" if backend == "local" else "processes"
+        self.stdout.write(f"backend={backend}, {opts['workers']} {kind}, limit {rate:g}/s burst {burst:g}")
+        self.stdout.write(f"per worker: {granted}")
+        self.stdout.write(f"aggregate: {total} in {elapsed:.2f}s ({total / seconds:.1f}/s); ceiling {allowed:.0f}")
+        if total <= allowed:
+            self.stdout.write(self.style.SUCCESS("Within limit"))
+        else:
+            self.stdout.write(self.style.ERROR("LIMIT EXCEEDED"))
+            raise SystemExit(1)
+
+    # ---------------------------- failover ----------------------------
+    def _bench_failover(self, opts):
+        """
+        Chain ["primary", "backup"] of two stub gateways; primary answers 503.
+        Every message must still go out via backup, and once primary's breaker
+        opens it must stop receiving traffic until the cool-down lets one probe
+        through. Then primary recovers and the probe closes its circuit.
+        """
+        n = opts["messages"]
+        latency = opts["latency_ms"] / 1000.0
+        primary, backup = _SmsGateway(latency, failing=True), _SmsGateway(latency)
+        for gw in (primary, backup):
+            threading.Thread(target=gw.serve_forever, daemon=True).start()
+        gateways = {
+            name: {"type": "generic", "base_url": "http://%s:%s/send" % gw.server_address, "api_key": "bench"}
+            for name, gw in (("primary", primary), ("backup", backup))
+        }
+        payloads = [{"to": f"+8801700{i:06d}", "sender_id": "SCHOOL", "body": "Tuition due."} for i in range(n)]
+        threshold, cooldown = opts["breaker_failures"], opts["breaker_cooldown"]
+
+        try:
+            with override_settings(SMS_PROVIDERS=["primary", "backup"], SMS_GATEWAYS=gateways,
+                                   SMS_BREAKER_FAILURES=threshold, SMS_BREAKER_COOLDOWN=cooldown,
+                                   SMS_CONCURRENCY=opts["concurrency"]):
+                breaker = provider_breaker("primary")
+                breaker.record_success()  # start closed
+
+                t0 = time.perf_counter()
+                results = send_sms_batch(payloads)
+                elapsed = time.perf_counter() - t0
+                state_after = breaker.state()
+                primary_hits = primary.received
+
+                time.sleep(cooldown)
+                primary.failing = False
+                probe = send_sms_batch(payloads[:1], concurrency=1)
+                state_recovered = breaker.state()
+        finally:
+            for gw in (primary, backup):
+                gw.shutdown()
+                gw.server_close()
+
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        via = {}
+        for r in results:
+            if not isinstance(r, Exception):
+                via[r[0]] = via.get(r[0], 0) + 1
+        self.stdout.write(f"{n} messages in {elapsed:.2f}s, failed={failed}, sent via {via}")
+        self.stdout.write(f"primary (503) received {primary_hits} requests; breaker threshold {threshold}, "
+                          f"state after batch: {state_after}")
+        self.stdout.write(f"after {cooldown:g}s cool-down, primary recovered: probe sent via "
+                          f"{probe[0][0] if not isinstance(probe[0], Exception) else probe[0]}, state {state_recovered}")
+        # concurrent in-flight requests may each count one failure before the circuit opens
+        ok = (failed == 0 and state_after == OPEN and state_recovered == CLOSED
+              and primary_hits <= threshold + opts["concurrency"])
+        if ok:
+            self.stdout.write(self.style.SUCCESS("Failover OK"))
+        else:
+            self.stdout.write(self.style.ERROR("FAILOVER CHECK FAILED"))
+            raise SystemExit(1)
+
+    # ---------------------------- broadcast ---------------------------
+    def _bench_broadcast(self, opts):
+        """
+        Enqueue one SMS template for a whole class section (--messages students)
+        and time it. Runs inside a transaction that is rolled back.
+        """
+        n = opts["messages"]
+        with transaction.atomic():
+            klass = AcademicClass.objects.create(name="Bench Class", section="B", year=1900)
+            StudentProfile.objects.bulk_create(
+                [StudentProfile(school_class=klass, section="B", roll_number=i + 1,
+                                guardian_phone_e164=f"+8801700{i:06d}") for i in range(n)],
+                batch_size=1000,
+            )
+            tpl = MessageTemplate.objects.create(
+                slug="bench-broadcast", kind=MessageTemplate.KIND_SMS,
+                body_text_template="Dear guardian of {{ student_name }} (roll {{ roll }}): {{ message }}",
+            )
+
+            t0 = time.perf_counter()
+            stats = broadcast(tpl, school_class=klass, section="B",
+                              context={"message": "School closed tomorrow for the exam schedule change."})
+            elapsed = time.perf_counter() - t0
+            rows = SmsOutbox.objects.filter(template=tpl).count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"broadcast to {stats['recipients']} recipients: {elapsed * 1000:.0f} ms, "
+                          f"{rows} outbox rows, {stats['segments']} segments")
+        if elapsed < 1.0 and rows == n:
+            self.stdout.write(self.style.SUCCESS("Under 1s"))
+        else:
+            self.stdout.write(self.style.ERROR("SLOWER THAN 1s" if rows == n else "ROW COUNT MISMATCH"))
+            raise SystemExit(1)
+
+    # ------------------------------ lanes -----------------------------
+    def _bench_lanes(self, opts):
+        """
+        Saturate the bulk lane (--bulk queued emails, SMTP paced at 200/s) while a login code is queued in the high lane every 0.5s for
+        --seconds. One dispatcher drains the high lane before every bulk batch,
+        like `process_outbox --loop`. Every code's enqueue-to-send latency must
+        stay under COMMS_HIGH_LANE_TARGET_SECONDS (default 5).
+        """
+        target = float(getattr(settings, "COMMS_HIGH_LANE_TARGET_SECONDS", 5))
+        sink = _SmtpSink(connect_latency=opts["latency_ms"] / 1000.0)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        host, port = sink.server_address
+        overrides = {
+            "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend", "EMAIL_HOST": host, "EMAIL_PORT": port,
+            "EMAIL_USE_TLS": False, "EMAIL_USE_SSL": False, "EMAIL_HOST_USER": "", "EMAIL_HOST_PASSWORD": "",
+            "COMMS_AUTOSEND_EMAIL": False, "COMMS_RATE_LIMITS": {"smtp": {"per_second": 200}},
+        }
+        bulk_tpl = MessageTemplate.objects.create(slug="bench-lanes-bulk", kind=MessageTemplate.KIND_EMAIL,
+                                                  subject_template="Dues", body_text_template="Tuition is due.")
+        code_tpl = MessageTemplate.objects.create(slug="bench-lanes-code", kind=MessageTemplate.KIND_EMAIL,
+                                                  subject_template="Code", body_text_template="{{ code }}")
+        stop = threading.Event()
+
+        def dispatcher():
+            try:
+                while not stop.is_set():
+                    process_email_batch(limit=100, lane="high")
+                    if not process_email_batch(limit=100):
+                        time.sleep(0.05)
+            finally:
+                connections.close_all()
+
+        try:
+            with override_settings(**overrides):
+                bulk_queue_email(template_slug=bulk_tpl.slug,
+                                 rows=((f"guardian{i}@example.com", {}) for i in range(opts["bulk"])))
+                worker = threading.Thread(target=dispatcher, daemon=True)
+                worker.start()
+                codes = []
+                deadline = time.monotonic() + opts["seconds"]
+                while time.monotonic() < deadline:
+                    codes.append(queue_email(to="staff@example.com", template_slug=code_tpl.slug,
+                                             context={"code": "123456"}, priority=OutboxPriority.HIGH).pk)
+                    time.sleep(0.5)
+                wait_until = time.monotonic() + target * 2
+                while time.monotonic() < wait_until and EmailOutbox.objects.filter(
+                        pk__in=codes, sent_at__isnull=True).exists():
+                    time.sleep(0.1)
+                stop.set()
+                worker.join()
+
+                latencies = sorted(
+                    (sent - created).total_seconds() if sent else float("inf")
+                    for created, sent in EmailOutbox.objects.filter(pk__in=codes).values_list("created_at", "sent_at")
+                )
+                bulk_left = EmailOutbox.objects.filter(template=bulk_tpl, sent_at__isnull=True).count()
+        finally:
+            sink.shutdown()
+            sink.server_close()
+            EmailOutbox.objects.filter(template__in=[bulk_tpl, code_tpl]).delete()
+            CommsLog.objects.filter(template_slug__in=[bulk_tpl.slug, code_tpl.slug]).delete()
+            MessageTemplate.objects.filter(pk__in=[bulk_tpl.pk, code_tpl.pk]).delete()
+
+        worst = latencies[-1]
+        p50 = latencies[len(latencies) // 2]
+        self.stdout.write(f"bulk lane: {opts['bulk']} queued, {bulk_left} still unsent at the end (saturated)")
+        self.stdout.write(f"high lane: {len(latencies)} codes, p50 {p50:.2f}s, max {worst:.2f}s, target {target:g}s")
+        if worst <= target:
+            self.stdout.write(self.style.SUCCESS("High-lane target held"))
+        else:
+            self.stdout.write(self.style.ERROR("HIGH-LANE TARGET MISSED"))
+            raise SystemExit(1)
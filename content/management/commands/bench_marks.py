@@ -0,0 +1,130 @@
+# content/management/commands/bench_marks.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from content.models import (
+    AcademicClass, ClassResultSummary, ExamTerm, StudentMarksheet, StudentMarksheetItem, StudentProfile, Subject,
+)
+from content.services.marks import recalc_marksheets
+from content.services.results import aggregate_results
+
+
+class Command(BaseCommand):
+    help = "Marks benchmarks / sanity checks. Creates its own throw-away class, term and marksheets."
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["recalc", "results"])
+        parser.add_argument("--subjects", type=int, default=12, help="Subject rows per marksheet.")
+        parser.add_argument("--classes", type=int, default=40, help="Classes for the results benchmark.")
+        parser.add_argument("--students", type=int, default=60, help="Students per class.")
+
+    def handle(self, *args, **opts):
+        getattr(self, f"_bench_{opts['target']}")(opts)
+
+    # ------------------------------ recalc ----------------------------
+    def _bench_recalc(self, opts):
+        """
+        Save --subjects item rows of one marksheet in one transaction (create,
+        then edit) and count the totals recomputes: exactly one grouped SUM and
+        one UPDATE of the marksheet per transaction, run on commit.
+        """
+        n = opts["subjects"]
+        klass = AcademicClass.objects.create(name="Bench Class", section="M", year=1900)
+        term = ExamTerm.objects.create(name="Bench Final", year=1900)
+        try:
+            subjects = Subject.objects.bulk_create(
+                [Subject(school_class=klass, name=f"Subject {i + 1}", order=i + 1) for i in range(n)]
+            )
+            ms = StudentMarksheet.objects.create(school_class=klass, term=term, student_full_name="Bench Student")
+            table = StudentMarksheet._meta.db_table
+
+            results = []
+            for label in ("create", "edit"):
+                t0 = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    with transaction.atomic():
+                        if label == "create":
+                            for i, s in enumerate(subjects):
+                                StudentMarksheetItem.objects.create(
+                                    marksheet=ms, subject=s, marks_obtained=40 + i, order=i + 1
+                                )
+                        else:
+                            for item in ms.items.all():
+                                item.marks_obtained += 5
+                                item.save()
+                elapsed = time.perf_counter() - t0
+                sql = [q["sql"] for q in ctx.captured_queries]
+                sums = sum(1 for q in sql if "SUM(" in q.upper())
+                updates = sum(1 for q in sql if q.upper().startswith("UPDATE") and f'"{table}"' in q)
+                results.append((label, sums, updates))
+                self.stdout.write(f"{label}: {n} rows, {len(sql)} queries, {sums} aggregate(s), "
+                                  f"{updates} marksheet update(s), {elapsed * 1000:.0f} ms")
+
+            ms.refresh_from_db()
+            expected = sum(40 + i + 5 for i in range(n))
+            self.stdout.write(f"total_marks {ms.total_marks} (expected {expected}), grade {ms.total_grade}")
+        finally:
+            StudentMarksheetItem.objects.filter(marksheet__school_class=klass).delete()
+            StudentMarksheet.objects.filter(school_class=klass).delete()
+            Subject.objects.filter(school_class=klass).delete()
+            term.delete()
+            klass.delete()
+
+        if all(sums == 1 and updates == 1 for _, sums, updates in results) and ms.total_marks == expected:
+            self.stdout.write(self.style.SUCCESS("One recompute per transaction"))
+        else:
+            self.stdout.write(self.style.ERROR("RECOMPUTE NOT COALESCED"))
+            raise SystemExit(1)
+
+    # ------------------------------ results ---------------------------
+    def _bench_results(self, opts):
+        """
+        A school-wide aggregate_results() over --classes x --students published
+        marksheets (--subjects items each), then a rerun with nothing changed.
+        Runs inside a transaction that is rolled back.
+        """
+        n_classes, n_students, n_subjects = opts["classes"], opts["students"], opts["subjects"]
+        rnd = random.Random(7)
+        with transaction.atomic():
+            term = ExamTerm.objects.create(name="Bench Final", year=1900)
+            for c in range(n_classes):
+                klass = AcademicClass.objects.create(name=f"Bench Class {c + 1}", section="R", year=1900)
+                subjects = Subject.objects.bulk_create(
+                    [Subject(school_class=klass, name=f"Subject {i + 1}", order=i + 1) for i in range(n_subjects)]
+                )
+                StudentProfile.objects.bulk_create(
+                    [StudentProfile(school_class=klass, section="R", roll_number=i + 1) for i in range(n_students)]
+                )
+                sheets = StudentMarksheet.objects.bulk_create([
+                    StudentMarksheet(school_class=klass, term=term, section="R", roll_number=str(i + 1),
+                                     student_full_name=f"Student {i + 1}") for i in range(n_students)
+                ])
+                StudentMarksheetItem.objects.bulk_create(
+                    [StudentMarksheetItem(marksheet=ms, subject=s, marks_obtained=rnd.randint(15, 100))
+                     for ms in sheets for s in subjects],
+                    batch_size=1000,
+                )
+            recalc_marksheets(StudentMarksheet.objects.filter(term=term).values_list("pk", flat=True))
+
+            t0 = time.perf_counter()
+            with CaptureQueriesContext(connection) as ctx:
+                stats = aggregate_results(term=term, force=True)
+            elapsed = time.perf_counter() - t0
+            t1 = time.perf_counter()
+            rerun = aggregate_results(term=term)
+            rerun_elapsed = time.perf_counter() - t1
+            summaries = ClassResultSummary.objects.filter(term=term).count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"full run: {stats['stale']} classes, {n_classes * n_students} marksheets, "
+                          f"{len(ctx.captured_queries)} queries, {elapsed * 1000:.0f} ms")
+        self.stdout.write(f"rerun (nothing changed): {rerun['stale']} recomputed, {rerun_elapsed * 1000:.0f} ms")
+        if summaries == n_classes and rerun["stale"] == 0 and elapsed < 5:
+            self.stdout.write(self.style.SUCCESS("School-wide aggregation under 5s, rerun incremental"))
+        else:
+            self.stdout.write(self.style.ERROR("AGGREGATION TOO SLOW OR NOT INCREMENTAL"))
+            raise SystemExit(1)
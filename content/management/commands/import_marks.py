@@ -0,0 +1,69 @@
+# content/management/commands/import_marks.py
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from content.services.marks_import import MarksImportError, TARGETS, import_marks, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import exam marks from a CSV / XLSX file into one class + exam term. "
+        "Layouts: 'roll,section,name,subject,marks,max' (one row per mark) or "
+        "'roll,section,name,<subject>,<subject>...' (one row per student). Bad rows are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--class", dest="class_id", type=int, required=True,
+                            help="AcademicClass id (reportcards: Grade id).")
+        parser.add_argument("--term", dest="term_id", type=int, required=True,
+                            help="ExamTerm id (reportcards: Term id).")
+        parser.add_argument("--target", choices=sorted(TARGETS), default="content")
+        parser.add_argument("--chunk", type=int, default=1000, help="Marks written per bulk batch.")
+        parser.add_argument("--report", default="", help="Write every row error to this CSV file.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate and roll back.")
+
+    def handle(self, *args, **opts):
+        spec = TARGETS[opts["target"]]()
+        class_model = spec.sheet_model._meta.get_field(spec.class_field).related_model
+        term_model = spec.sheet_model._meta.get_field("term").related_model
+        try:
+            klass = class_model.objects.get(pk=opts["class_id"])
+            term = term_model.objects.get(pk=opts["term_id"])
+        except (class_model.DoesNotExist, term_model.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        report_file = open(opts["report"], "w", newline="", encoding="utf-8") if opts["report"] else None
+        writer = None
+        if report_file:
+            writer = csv.DictWriter(report_file, fieldnames=["line", "roll", "subject", "error"])
+            writer.writeheader()
+
+        t0 = time.perf_counter()
+        try:
+            with open(opts["path"], "rb") as fh:
+                stats = import_marks(
+                    read_rows(fh, opts["path"]), school_class=klass, term=term, target=opts["target"],
+                    chunk_size=opts["chunk"], dry_run=opts["dry_run"], on_error=writer and writer.writerow,
+                )
+        except (OSError, MarksImportError) as e:
+            raise CommandError(str(e))
+        finally:
+            if report_file:
+                report_file.close()
+        elapsed = time.perf_counter() - t0
+
+        if not report_file:
+            for err in stats["errors"][:50]:
+                self.stderr.write(f"line {err['line']} roll {err['roll'] or '-'} {err['subject'] or ''}: {err['error']}")
+            if stats["error_count"] > 50:
+                self.stderr.write(f"... {stats['error_count'] - 50} more (use --report FILE for all)")
+
+        verb = "Would import" if opts["dry_run"] else "Imported"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['rows']} rows in {elapsed:.1f}s ({stats['rows'] / max(elapsed, 1e-6):.0f} rows/s): "
+            f"{stats['updated']} marks updated, {stats['created']} added, {stats['new_marksheets']} new marksheets, "
+            f"{stats['marksheets']} marksheets recalculated; {stats['error_count']} error(s)."
+        ))
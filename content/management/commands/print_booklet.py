@@ -0,0 +1,55 @@
+# content/management/commands/print_booklet.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from content.models import AcademicClass, ExamTerm, StudentMarksheet
+from content.services.booklet import BookletError, booklet_workers, build_booklet
+from reportcards.models import Grade, Marksheet, Term
+
+
+class Command(BaseCommand):
+    help = (
+        "Print every marksheet of one class / term into a single PDF booklet, ordered by roll. "
+        "Pages are rendered in a bounded process pool (--workers, default BOOKLET_WORKERS)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--class", dest="class_id", type=int, required=True,
+                            help="AcademicClass id (reportcards: Grade id).")
+        parser.add_argument("--term", dest="term_id", type=int, required=True,
+                            help="ExamTerm id (reportcards: Term id).")
+        parser.add_argument("--target", choices=["content", "reportcards"], default="content")
+        parser.add_argument("--workers", type=int, default=None, help=f"Default {booklet_workers()}.")
+        parser.add_argument("--published-only", action="store_true", help="Skip unpublished marksheets.")
+        parser.add_argument("--out", help="Output file (default booklet_<class>_<term>.pdf).")
+
+    def handle(self, *args, **opts):
+        if opts["target"] == "content":
+            class_model, term_model, sheets, class_field = AcademicClass, ExamTerm, StudentMarksheet, "school_class"
+        else:
+            class_model, term_model, sheets, class_field = Grade, Term, Marksheet, "grade"
+        try:
+            klass = class_model.objects.get(pk=opts["class_id"])
+            term = term_model.objects.get(pk=opts["term_id"])
+        except (class_model.DoesNotExist, term_model.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        qs = sheets.objects.filter(**{class_field: klass}, term=term)
+        if opts["published_only"]:
+            qs = qs.filter(is_published=True)
+        try:
+            # a management command is single-threaded, so the faster "fork" start is safe here
+            pdf, stats = build_booklet(qs, target=opts["target"], workers=opts["workers"],
+                                       base_url=getattr(settings, "MARKSHEET_PDF_BASE_URL", None), method="fork")
+        except BookletError as e:
+            raise CommandError(str(e))
+
+        out = opts["out"] or f"booklet_{klass.pk}_{term.pk}.pdf"
+        with open(out, "wb") as fh:
+            fh.write(pdf)
+        secs = stats["seconds"]
+        self.stdout.write(self.style.SUCCESS(
+            f"{klass} / {term}: {stats['sheets']} marksheet(s), {stats['pages']} page(s) "
+            f"({stats['rendered']} rendered on {stats['workers']} worker(s), {stats['cached']} from cache) "
+            f"in {secs:.1f}s, {stats['pages'] / secs if secs else 0:.1f} pages/s -> {out}"
+        ))
@@ -1,24 +1,51 @@
+import time
+
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from content.services.comms_outbox import process_sms_batch, process_email_batch
 
 class Command(BaseCommand):
-    help = "Send queued SMS and Email from Outbox."
+    help = (
+        "Send queued SMS and Email from Outbox. Rows are claimed highest priority first; "
+        "--lane high only touches the high lane (run one with --loop as dedicated capacity for login codes)."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("--limit", type=int, default=100)
         parser.add_argument("--only", choices=["sms","email","both"], default="both")
+        parser.add_argument("--lane", choices=["all", "high"], default="all")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of running one batch.")
+        parser.add_argument("--interval", type=float, default=None,
+                            help="Seconds between polls with --loop (default: settings.COMMS_DISPATCH_INTERVAL or 1).")
 
     def handle(self, *args, **opts):
-        limit = opts["limit"]
-        only = opts["only"]
+        if not opts["loop"]:
+            total = self._tick(opts, verbose=True)
+            self.stdout.write(self.style.SUCCESS(f"Total processed: {total}"))
+            return
+
+        interval = opts["interval"] if opts["interval"] is not None else float(getattr(settings, "COMMS_DISPATCH_INTERVAL", 1))
+        self.stdout.write(f"Dispatching ({opts['lane']} lane) every {interval:g}s; Ctrl+C to stop.")
+        try:
+            while True:
+                if not self._tick(opts):
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+    def _tick(self, opts, verbose=False) -> int:
+        limit, only, lane = opts["limit"], opts["only"], opts["lane"]
         total = 0
-        if only in ("sms", "both"):
-            sent = process_sms_batch(limit=limit)
-            self.stdout.write(self.style.SUCCESS(f"SMS sent: {sent}"))
-            total += sent
-        if only in ("email", "both"):
-            sent = process_email_batch(limit=limit)
-            self.stdout.write(self.style.SUCCESS(f"Email sent: {sent}"))
+        for channel, process in (("sms", process_sms_batch), ("email", process_email_batch)):
+            if only not in (channel, "both"):
+                continue
+            sent = 0
+            if lane == "all":
+                # drain the high lane before each bulk batch, so a login code waits
+                # for at most one in-flight batch
+                sent += process(limit=limit, lane="high")
+            sent += process(limit=limit, lane="high" if lane == "high" else None)
+            if verbose:
+                self.stdout.write(self.style.SUCCESS(f"{'SMS' if channel == 'sms' else 'Email'} sent: {sent}"))
             total += sent
-        self.stdout.write(self.style.SUCCESS(f"Total processed: {total}"))
+        return total
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from content.services.comms_metrics import recount_queue_depth
+from content.services.comms_retention import archive_dir, run_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll up old CommsLog rows into daily counts, archive finished outbox / bounce rows "
+        "to JSONL.gz before deleting them, and drop old metrics rollups and webhook dedupe keys, "
+        "all in small chunks; then recount the queue-depth counters. Schedule it daily (cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log-days", type=int, default=getattr(settings, "COMMS_LOG_RETENTION_DAYS", 90))
+        parser.add_argument("--outbox-days", type=int, default=getattr(settings, "COMMS_OUTBOX_RETENTION_DAYS", 30))
+        parser.add_argument("--bounce-days", type=int, default=getattr(settings, "COMMS_BOUNCE_RETENTION_DAYS", 365))
+        parser.add_argument("--minute-stat-days", type=int,
+                            default=getattr(settings, "COMMS_MINUTE_STAT_RETENTION_DAYS", 30))
+        parser.add_argument("--gateway-event-days", type=int,
+                            default=getattr(settings, "COMMS_GATEWAY_EVENT_RETENTION_DAYS", 90),
+                            help="Webhook dedupe keys; keep longer than any provider's retry window")
+        parser.add_argument("--chunk", type=int, default=1000, help="Rows per delete transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+
+    def handle(self, *args, **opts):
+        result = run_retention(
+            log_days=opts["log_days"],
+            outbox_days=opts["outbox_days"],
+            bounce_days=opts["bounce_days"],
+            minute_stat_days=opts["minute_stat_days"],
+            gateway_event_days=opts["gateway_event_days"],
+            chunk_size=max(1, opts["chunk"]),
+            dry_run=opts["dry_run"],
+        )
+        verb = "Would remove" if opts["dry_run"] else "Removed"
+        for label, n in result.items():
+            self.stdout.write(f"{verb} {n} {label} row(s)")
+        if not opts["dry_run"]:
+            depth = recount_queue_depth()
+            self.stdout.write("Queue depth recounted: " + ", ".join(
+                f"{ch} {sum(statuses.values())}" for ch, statuses in depth.items()))
+            self.stdout.write(self.style.SUCCESS(f"Archives in: {archive_dir()}"))
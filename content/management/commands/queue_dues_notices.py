@@ -1,57 +1,13 @@
 # content/management/commands/queue_dues_notices.py
 
-from decimal import Decimal
-from django.core.management.base import BaseCommand
-from django.db.models import F
-from django.utils import timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
-from content.models import TuitionInvoice
-from content.services.comms_outbox import queue_sms, queue_email
-
-
-def _resolve_phone(user):
-    """
-    Try common fields to find a student's reachable phone number.
-    Adjust the list if your project uses different names.
-    """
-    def pick(*paths):
-        for path in paths:
-            obj = user
-            for part in path.split("."):
-                obj = getattr(obj, part, None)
-                if obj is None:
-                    break
-            if obj:
-                s = str(obj).strip()
-                if s:
-                    return s
-        return None
-
-    raw = pick(
-        "phone", "mobile", "contact_number",
-        "studentprofile.phone",
-        "studentprofile.guardian_phone",
-        "studentprofile.father_phone",
-        "studentprofile.mother_phone",
-        "studentprofile.emergency_phone",
-    )
-    if not raw:
-        return None
-
-    # very light normalization → +88 for BD-style numbers
-    import re
-    digits = re.sub(r"[^\d+]", "", raw)
-    if digits.startswith("00"):
-        digits = "+" + digits[2:]
-    if digits.startswith("0") and not digits.startswith("+"):
-        digits = "+88" + digits
-    if not digits.startswith("+"):
-        # last resort: assume BD
-        if 10 <= len(digits) <= 13:
-            digits = "+88" + digits
-        else:
-            return None
-    return digits
+from content.services.comms_outbox import bulk_queue_sms, bulk_queue_email
+from content.services.contacts import student_sms_phones
+from content.services.dues_autoqueue import (
+    overdue_invoice_rows, dues_notices, family_notices, first_families, merge_siblings_default,
+)
 
 
 class Command(BaseCommand):
@@ -60,58 +16,77 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--send-sms", action="store_true", help="Queue SMS notices")
         parser.add_argument("--send-email", action="store_true", help="Queue Email notices")
-        parser.add_argument("--only-overdue", action="store_true", help="Only invoices with balance > 0")
-        parser.add_argument("--limit", type=int, default=1000)
+        parser.add_argument("--only-overdue", action="store_true", help="Only invoices with balance > 0 (always on)")
+        parser.add_argument("--limit", type=int, default=1000,
+                            help="Max invoices, or max guardian contacts when merging siblings")
+        parser.add_argument("--digest", action="store_true",
+                            help="With --per-student: one notice per student listing all overdue invoices "
+                                 "(default: settings.DUES_DIGEST)")
+        parser.add_argument("--per-student", action="store_true",
+                            help="Do not merge siblings sharing a guardian contact into one notice "
+                                 "(default: merge unless settings.COMMS_MERGE_SIBLINGS is False)")
 
     def handle(self, *args, **options):
-        # base queryset: invoices (latest first)
-        qs = TuitionInvoice.objects.select_related("student").order_by("-period_year", "-period_month", "-id")
-
-        if options.get("only_overdue"):
-            qs = qs.filter(tuition_amount__gt=F("paid_amount"))
-
-        if options.get("limit"):
-            qs = qs[: options["limit"]]
+        digest = options.get("digest") or getattr(settings, "DUES_DIGEST", False)
+        merge = merge_siblings_default() and not options.get("per_student")
+        limit = options.get("limit")
 
         sms_q = 0
         email_q = 0
-
-        for inv in qs:
-            student = inv.student
-            amount = inv.tuition_amount or Decimal("0.00")
-            paid = inv.paid_amount or Decimal("0.00")
-            due = amount - paid
-            if due <= 0:
-                continue
-
-            ctx = {
-                "student_name": (getattr(student, "get_full_name", lambda: "")() or student.username),
-                "amount_due": f"{due:.2f}",
-                "due_date": (inv.due_date.isoformat() if inv.due_date else "—"),
-                "period": (
-                    f"{inv.period_year}-{int(inv.period_month):02d}"
-                    if inv.kind == "monthly" and inv.period_year and inv.period_month else (inv.title or "Invoice")
-                ),
-            }
-
-            # EMAIL
+        saved = 0
+
+        if merge:
+            # a merged notice already lists every overdue invoice of every child, so
+            # DUES_DIGEST is satisfied; only an explicit --digest asks for something else
+            if options.get("digest"):
+                raise CommandError(
+                    "--digest needs --per-student; merged notices already list every overdue "
+                    "invoice of every child."
+                )
+            # one query per channel, sorted by the guardian contact so each family
+            # is one consecutive run -> one notice listing every child; --limit
+            # counts families, never cutting one short
             if options.get("send_email"):
-                to_email = (getattr(student, "email", "") or "").strip()
-                if to_email:
-
-                    # AFTER
-                    queue_email(
-                        to=to_email,
-                        template_slug="dues_notice_email",  # <-- matches your admin template
-                        context=ctx,
-                    )
-                    email_q += 1
-
-            # SMS
+                rows = first_families(overdue_invoice_rows(recipient="email").iterator(), limit)
+                email_q = bulk_queue_email(template_slug="dues_notice_email", rows=family_notices(rows))
+                saved += len(rows) - email_q
             if options.get("send_sms"):
-                phone = _resolve_phone(student)
-                if phone:
-                    queue_sms(to=phone, template_slug="dues_notice", context=ctx, created_by=None)
-                    sms_q += 1
+                rows = first_families(overdue_invoice_rows(recipient="sms").iterator(), limit)
+                sms_q = bulk_queue_sms(template_slug="dues_notice", rows=family_notices(rows))
+                saved += len(rows) - sms_q
+            self.stdout.write(self.style.SUCCESS(f"Queued SMS: {sms_q}  |  Queued Email: {email_q}"))
+            self.stdout.write(f"Merging by guardian contact saved {saved} message(s) compared with one per invoice.")
+            return
+
+        # one query: outstanding invoices (latest first) with amount due computed in SQL
+        # (invoices with nothing due were always skipped, so --only-overdue is implied)
+        rows = list(overdue_invoice_rows(limit=limit))
+
+        # EMAIL
+        if options.get("send_email"):
+            def email_of(row):
+                return (row["student__email"] or "").strip()
+
+            email_q = bulk_queue_email(
+                template_slug="dues_notice_email",  # <-- matches your admin template
+                rows=dues_notices(rows, email_of, digest=digest),
+            )
+            saved += sum(1 for row in rows if email_of(row)) - email_q
+
+        # SMS
+        if options.get("send_sms"):
+            # one indexed query over the stored E.164 columns
+            phones = student_sms_phones(user_ids={row["student_id"] for row in rows})
+
+            def phone_of(row):
+                return phones.get(row["student_id"])
+
+            sms_q = bulk_queue_sms(
+                template_slug="dues_notice",
+                rows=dues_notices(rows, phone_of, digest=digest),
+            )
+            saved += sum(1 for row in rows if phone_of(row)) - sms_q
 
         self.stdout.write(self.style.SUCCESS(f"Queued SMS: {sms_q}  |  Queued Email: {email_q}"))
+        if digest:
+            self.stdout.write(f"Digest mode saved {saved} message(s) compared with one per invoice.")
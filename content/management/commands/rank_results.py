@@ -0,0 +1,36 @@
+# content/management/commands/rank_results.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from content.models import ExamTerm
+from content.services.ranking import rank_marksheets, rank_method, rank_order
+from reportcards.models import Term
+
+
+class Command(BaseCommand):
+    help = (
+        "Store class / section merit positions (SQL RANK / DENSE_RANK windows) on the published marksheets "
+        "of one exam term, or of every term. Order and tie-breaks: RESULTS_RANK_ORDER / RESULTS_RANK_METHOD."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--term", dest="term_id", type=int, help="ExamTerm id (reportcards: Term id).")
+        parser.add_argument("--target", choices=["content", "reportcards"], default="content")
+
+    def handle(self, *args, **opts):
+        term = None
+        if opts["term_id"]:
+            term_model = ExamTerm if opts["target"] == "content" else Term
+            try:
+                term = term_model.objects.get(pk=opts["term_id"])
+            except term_model.DoesNotExist as e:
+                raise CommandError(str(e))
+
+        t0 = time.perf_counter()
+        changed = rank_marksheets(term=term, target=opts["target"])
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranked by {', '.join(rank_order(opts['target']))} ({rank_method()}): "
+            f"{changed} marksheet position(s) changed in {elapsed:.2f}s."
+        ))
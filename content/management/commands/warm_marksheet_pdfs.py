@@ -0,0 +1,60 @@
+# content/management/commands/warm_marksheet_pdfs.py
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from content.services import marksheet_pdf
+from content.services.ranking import positions
+from reportcards.models import Grade, Term
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the marksheet PDFs of a reportcards term into the PDF cache ahead of time, so the first "
+        "requests on results day are served from disk. Unpublished marksheets are rendered with the merit "
+        "positions they will get once the whole term is published."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--term", dest="term_id", type=int, required=True, help="reportcards Term id.")
+        parser.add_argument("--grade", dest="grade_id", type=int, help="Only this Grade id.")
+        parser.add_argument("--published-only", action="store_true", help="Skip unpublished marksheets.")
+
+    def handle(self, *args, **opts):
+        try:
+            term = Term.objects.get(pk=opts["term_id"])
+            grade = Grade.objects.get(pk=opts["grade_id"]) if opts["grade_id"] else None
+        except (Term.DoesNotExist, Grade.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        sheets = marksheet_pdf.marksheets(published_only=opts["published_only"]).filter(term=term)
+        if grade is not None:
+            sheets = sheets.filter(grade=grade)
+        # positions as if every marksheet of the term were published (what publishing will store)
+        expected = positions(sheets.model.objects.filter(term=term), target="reportcards")
+        base_url = getattr(settings, "MARKSHEET_PDF_BASE_URL", None)
+
+        rendered = cached = 0
+        t0 = time.perf_counter()
+        for ms in sheets.order_by("grade_id", "roll_number", "pk"):
+            if not ms.is_published:
+                ms.class_position, ms.section_position = expected.get(ms.pk, (None, None))
+            rows = list(ms.rows.all())
+            key = marksheet_pdf.cache_key(ms, rows)
+            if os.path.exists(marksheet_pdf.cache_path(ms.pk, key)):
+                cached += 1
+                continue
+            try:
+                marksheet_pdf.cached_pdf(ms, rows, key=key, base_url=base_url)
+            except ImportError:
+                raise CommandError("WeasyPrint is not installed.")
+            rendered += 1
+        elapsed = time.perf_counter() - t0
+
+        rate = f", {rendered / elapsed:.1f}/s" if rendered and elapsed else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{term}: rendered {rendered} PDF(s), {cached} already cached, in {elapsed:.1f}s{rate} "
+            f"-> {marksheet_pdf.cache_dir()}"
+        ))
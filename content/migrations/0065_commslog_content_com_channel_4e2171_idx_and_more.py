@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0064_academicclass_created_at_academicclass_updated_at_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="commslog",
+            index=models.Index(
+                fields=["channel", "template_slug", "status", "when"],
+                name="content_com_channel_4e2171_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emailoutbox",
+            index=models.Index(
+                fields=["status", "template", "sent_at"],
+                name="content_ema_status_5918ca_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="smsoutbox",
+            index=models.Index(
+                fields=["status", "template", "sent_at"],
+                name="content_sms_status_d9f2f1_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:28
+
+import content.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0065_commslog_content_com_channel_4e2171_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommsDailyStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("day", models.DateField()),
+                ("channel", models.CharField(max_length=10)),
+                ("template_slug", models.CharField(max_length=80)),
+                ("status", models.CharField(max_length=12)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ("-day", "channel", "template_slug", "status"),
+                "unique_together": {("day", "channel", "template_slug", "status")},
+            },
+            bases=(models.Model, content.models.ImageUrlMixin),
+        ),
+    ]
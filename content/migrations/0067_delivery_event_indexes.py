@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0066_commsdailystat"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="smsoutbox",
+            name="provider_ref",
+            field=models.CharField(blank=True, db_index=True, max_length=120),
+        ),
+        migrations.AddIndex(
+            model_name="emailoutbox",
+            index=models.Index(fields=["to", "-id"], name="content_ema_to_7ac477_idx"),
+        ),
+    ]
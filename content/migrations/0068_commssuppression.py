@@ -0,0 +1,80 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:33
+
+import content.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0067_delivery_event_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="emailoutbox",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("sending", "Sending"),
+                    ("sent", "Sent"),
+                    ("failed", "Failed"),
+                    ("bounced", "Bounced"),
+                    ("suppressed", "Suppressed"),
+                ],
+                default="queued",
+                max_length=12,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="smsoutbox",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("sending", "Sending"),
+                    ("sent", "Sent"),
+                    ("failed", "Failed"),
+                    ("bounced", "Bounced"),
+                    ("suppressed", "Suppressed"),
+                ],
+                default="queued",
+                max_length=12,
+            ),
+        ),
+        migrations.CreateModel(
+            name="CommsSuppression",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "channel",
+                    models.CharField(
+                        choices=[("email", "Email"), ("sms", "SMS")], max_length=10
+                    ),
+                ),
+                ("address", models.CharField(max_length=254)),
+                ("reason", models.CharField(blank=True, max_length=120)),
+            ],
+            options={
+                "unique_together": {("channel", "address")},
+            },
+            bases=(models.Model, content.models.ImageUrlMixin),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:34
+
+import content.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0068_commssuppression"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommsMinuteStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("minute", models.DateTimeField()),
+                ("channel", models.CharField(max_length=10)),
+                ("provider", models.CharField(blank=True, max_length=32)),
+                ("template_slug", models.CharField(max_length=80)),
+                ("event", models.CharField(max_length=32)),
+                ("latency_bucket", models.PositiveSmallIntegerField(default=0)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {
+                    (
+                        "minute",
+                        "channel",
+                        "provider",
+                        "template_slug",
+                        "event",
+                        "latency_bucket",
+                    )
+                },
+            },
+            bases=(models.Model, content.models.ImageUrlMixin),
+        ),
+    ]
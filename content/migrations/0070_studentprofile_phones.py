@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0069_commsminutestat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studentprofile",
+            name="guardian_phone",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="studentprofile",
+            name="guardian_phone_e164",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=16
+            ),
+        ),
+        migrations.AddField(
+            model_name="studentprofile",
+            name="phone",
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name="studentprofile",
+            name="phone_e164",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=16
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0070_studentprofile_phones"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="messagetemplate",
+            name="body_text_compact_template",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="smsoutbox",
+            name="encoding",
+            field=models.CharField(blank=True, max_length=8),
+        ),
+        migrations.AddField(
+            model_name="smsoutbox",
+            name="segments",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0071_sms_segments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailoutbox",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "Bulk"), (5, "Normal"), (10, "High")], default=5
+            ),
+        ),
+        migrations.AddField(
+            model_name="smsoutbox",
+            name="priority",
+            field=models.PositiveSmallIntegerField(
+                choices=[(0, "Bulk"), (5, "Normal"), (10, "High")], default=5
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="emailoutbox",
+            index=models.Index(
+                fields=["status", "-priority", "scheduled_at"],
+                name="content_ema_status_759540_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="smsoutbox",
+            index=models.Index(
+                fields=["status", "-priority", "scheduled_at"],
+                name="content_sms_status_4ef47b_idx",
+            ),
+        ),
+    ]
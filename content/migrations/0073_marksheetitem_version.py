@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 22:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0072_outbox_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studentmarksheetitem",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
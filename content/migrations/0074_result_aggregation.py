@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:03
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_total_pct(apps, schema_editor):
+    StudentMarksheet = apps.get_model("content", "StudentMarksheet")
+    StudentMarksheetItem = apps.get_model("content", "StudentMarksheetItem")
+    sheets = []
+    for row in (
+        StudentMarksheetItem.objects.values("marksheet_id")
+        .annotate(total=Sum("marks_obtained"), max_total=Sum("max_marks"))
+        .order_by()
+        .iterator()
+    ):
+        if row["max_total"]:
+            pct = round(float(row["total"] or 0) * 100.0 / float(row["max_total"]), 2)
+            sheets.append(StudentMarksheet(pk=row["marksheet_id"], total_pct=pct))
+    StudentMarksheet.objects.bulk_update(sheets, ["total_pct"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0073_marksheetitem_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="classresultsummary",
+            name="auto_source",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Fingerprint of the published marksheets these figures were computed from (blank = entered by hand). Set by the result aggregation.",
+                max_length=64,
+            ),
+        ),
+        migrations.AddField(
+            model_name="classresultsummary",
+            name="passed",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Number of students at or above the pass percentage.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="studentmarksheet",
+            name="total_pct",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=5
+            ),
+        ),
+        migrations.RunPython(backfill_total_pct, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0074_result_aggregation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="studentmarksheet",
+            name="class_position",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="studentmarksheet",
+            name="section_position",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="studentmarksheet",
+            index=models.Index(
+                fields=["term", "school_class", "class_position"],
+                name="content_stu_term_id_383485_idx",
+            ),
+        ),
+    ]
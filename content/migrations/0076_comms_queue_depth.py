@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:24
+
+import content.models
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_queue_depth(apps, schema_editor):
+    CommsQueueDepth = apps.get_model("content", "CommsQueueDepth")
+    rows = []
+    for channel, model in (("sms", "SmsOutbox"), ("email", "EmailOutbox")):
+        counts = dict(
+            apps.get_model("content", model).objects.filter(status__in=["queued", "sending", "failed"])
+            .values_list("status").annotate(n=Count("id")).order_by()
+        )
+        rows += [CommsQueueDepth(channel=channel, status=s, count=counts.get(s, 0))
+                 for s in ("queued", "sending", "failed")]
+    CommsQueueDepth.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("content", "0075_marksheet_positions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommsQueueDepth",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now, editable=False
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("channel", models.CharField(max_length=10)),
+                ("status", models.CharField(max_length=12)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("channel", "status")},
+            },
+            bases=(models.Model, content.models.ImageUrlMixin),
+        ),
+        migrations.RunPython(seed_queue_depth, migrations.RunPython.noop),
+    ]
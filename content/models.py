@@ -11,17 +11,19 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.mail import send_mail
-from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
+from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator, validate_email
 from django.db import models, transaction
 from django.db.models import F, Q
 from django.urls import reverse
 from django.utils import timezone
 import re
-from django.db.models.signals import post_save, post_delete, post_migrate
+from django.db.models.signals import post_save, post_migrate
 from django.dispatch import receiver
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
+from .phones import to_e164
+
 User = settings.AUTH_USER_MODEL
 
 # For relations (FK/O2O) — string label is safest across apps/migrations
@@ -944,9 +946,15 @@ class AdmissionApplication(TimeStampedModel, ImageUrlMixin):
                 "section": self.enroll_section or "",
                 "roll_number": self._next_roll() or 1,
                 "joined_on": timezone.now().date(),
+                "phone": self.phone or "",
+                "guardian_phone": self.guardian_phone or "",
             },
         )
         changed = False
+        if not sp.phone and self.phone:
+            sp.phone = self.phone; changed = True
+        if not sp.guardian_phone and self.guardian_phone:
+            sp.guardian_phone = self.guardian_phone; changed = True
         if self.enroll_class and sp.school_class_id != self.enroll_class_id:
             sp.school_class = self.enroll_class; changed = True
         if self.enroll_section and (sp.section or "") != (self.enroll_section or ""):
@@ -1786,6 +1794,15 @@ class ClassResultSummary(TimeStampedModel, ImageUrlMixin):
         blank=True,
         help_text="Optional notes or remarks shown on the class result page."
     )
+    passed = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of students at or above the pass percentage."
+    )
+    auto_source = models.CharField(
+        max_length=64, blank=True, editable=False,
+        help_text="Fingerprint of the published marksheets these figures were computed from "
+                  "(blank = entered by hand). Set by the result aggregation."
+    )
 
     created_at = models.DateTimeField(
         auto_now_add=True,
@@ -2133,10 +2150,15 @@ class StudentMarksheet(TimeStampedModel, ImageUrlMixin):
 
     total_marks  = models.DecimalField(max_digits=7, decimal_places=2, default=0)  # sum of subject marks
     total_grade  = models.CharField(max_length=10, blank=True, default="")         # A+/A/...
+    total_pct    = models.DecimalField(max_digits=5, decimal_places=2, default=0, editable=False)  # of all items' max
 
     is_pass      = models.BooleanField(default=False, editable=False, db_index=True)
     is_published = models.BooleanField(default=True)
 
+    # merit positions among the published marksheets of the class + term (services.ranking)
+    class_position   = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    section_position = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     created_by   = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     created_at   = models.DateTimeField(auto_now_add=True)
     updated_at   = models.DateTimeField(auto_now=True)
@@ -2144,11 +2166,21 @@ class StudentMarksheet(TimeStampedModel, ImageUrlMixin):
     class Meta:
         unique_together = [("school_class", "term", "student_full_name", "roll_number")]
         ordering = ("-updated_at", "student_full_name")
+        indexes = [models.Index(fields=["term", "school_class", "class_position"])]
 
     def __str__(self):
         base = self.student_full_name or "Student"
         return f"{base} — {self.school_class} — {self.term}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the (class, term) it was loaded with: moving a marksheet also refreshes
+        # the results of the pair it left (signals.refresh_class_results)
+        loaded = dict(zip(field_names, values))
+        instance._loaded_results_key = (loaded.get("school_class_id"), loaded.get("term_id"))
+        return instance
+
     # ---------- calculations ----------
 
     def is_final_term(self) -> bool:
@@ -2167,12 +2199,17 @@ class StudentMarksheet(TimeStampedModel, ImageUrlMixin):
     def recalc_totals(self):
         items = list(self.items.all())
         total = sum(float(i.marks_obtained or 0) for i in items)
-        self.total_marks = total
+        max_total = sum(float(i.max_marks or 0) for i in items)
+        self.apply_totals(total, max_total, items)
+        return total
 
-        pct = self.percent()  # based on max of items
+    def apply_totals(self, total, max_total, items=None) -> None:
+        """Set total / grade / pass from already-summed marks (see services.marks.recalc_marksheets)."""
+        self.total_marks = total
+        pct = round((float(total) * 100.0) / float(max_total), 2) if max_total else 0.0
+        self.total_pct = pct
         self.total_grade = _grade_from_percent(pct)
         self.is_pass = self._compute_pass(pct, items)
-        return total
 
     def _compute_pass(self, pct, items) -> bool:
         # pass only depends on final term + overall percentage
@@ -2248,6 +2285,9 @@ class StudentMarksheetItem(TimeStampedModel, ImageUrlMixin):
 
     order          = models.PositiveIntegerField(default=0)
 
+    # bumped on every write; the marks grid API uses it for optimistic concurrency
+    version        = models.PositiveIntegerField(default=1, editable=False)
+
     class Meta:
         unique_together = [("marksheet", "subject")]
         ordering = ("order", "id")
@@ -2264,17 +2304,14 @@ class StudentMarksheetItem(TimeStampedModel, ImageUrlMixin):
     def save(self, *args, **kwargs):
         # auto-calc per-subject letter grade
         self.grade_letter = _subject_grade_from_marks(self.marks_obtained, self.max_marks)
+        if not self._state.adding:
+            self.version = (self.version or 0) + 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {"version"}
         super().save(*args, **kwargs)
 
 
-# ---------- signals: keep parent totals in sync when items change ----------
-
-@receiver(post_save, sender=StudentMarksheetItem)
-@receiver(post_delete, sender=StudentMarksheetItem)
-def _recalc_sheet_totals(sender, instance, **kwargs):
-    ms = instance.marksheet
-    ms.recalc_totals()
-    ms.save(update_fields=["total_marks", "total_grade", "is_pass", "updated_at"])
+# parent totals are kept in sync by content.signals.recalc_marksheet_totals
 
 # content/models.py  (BOTTOM of file)
 
@@ -2740,9 +2777,15 @@ def create_invoices_when_paid(sender, instance: AdmissionApplication, created, *
                 "section": instance.enroll_section or "",
                 "roll_number": instance._next_roll() or 1,
                 "joined_on": timezone.localdate(),
+                "phone": instance.phone or "",
+                "guardian_phone": instance.guardian_phone or "",
             },
         )
         changed = False
+        if not sp.phone and instance.phone:
+            sp.phone = instance.phone
+        if not sp.guardian_phone and instance.guardian_phone:
+            sp.guardian_phone = instance.guardian_phone
         if sp.school_class_id != instance.enroll_class_id:
             sp.school_class = instance.enroll_class; changed = True
         if (sp.section or "") != (instance.enroll_section or ""):
@@ -2820,6 +2863,13 @@ class StudentProfile(TimeStampedModel, ImageUrlMixin):
 
     bus_monthly_fee = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     hostel_monthly_fee = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    # contact numbers as typed + canonical E.164 copies (filled in save(); used for SMS)
+    phone = models.CharField(max_length=40, blank=True)
+    guardian_phone = models.CharField(max_length=40, blank=True)
+    phone_e164 = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
+    guardian_phone_e164 = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
+
     class Meta:
         unique_together = ("school_class", "section", "roll_number")
         ordering = ("school_class", "section", "roll_number")
@@ -2830,6 +2880,25 @@ class StudentProfile(TimeStampedModel, ImageUrlMixin):
         sec = f" – {self.section}" if self.section else ""
         return f"{self.user} — {self.school_class}{sec} — Roll {self.roll_number}"
 
+    def normalize_phones(self) -> bool:
+        """Refresh the E.164 columns from the raw ones; True if anything changed."""
+        before = (self.phone_e164, self.guardian_phone_e164)
+        self.phone_e164 = to_e164(self.phone)
+        self.guardian_phone_e164 = to_e164(self.guardian_phone)
+        return before != (self.phone_e164, self.guardian_phone_e164)
+
+    @property
+    def sms_phone(self) -> str:
+        """Where SMS for this student go: guardian first, then the student's own number."""
+        return self.guardian_phone_e164 or self.phone_e164
+
+    def save(self, *args, **kwargs):
+        self.normalize_phones()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"phone", "guardian_phone"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"phone_e164", "guardian_phone_e164"}
+        super().save(*args, **kwargs)
+
     @classmethod
     def next_roll(cls, klass, section=""):
         qs = cls.objects.filter(school_class=klass, section=section).order_by("-roll_number")
@@ -3048,6 +3117,8 @@ class MessageTemplate(TimeStampedModel, ImageUrlMixin):
     subject_template = models.CharField(max_length=200, blank=True)  # email only
     body_text_template = models.TextField(blank=True)                # email or sms
     body_html_template = models.TextField(blank=True)                # email only
+    # sms only: shorter wording, used automatically when it bills fewer segments
+    body_text_compact_template = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -3063,6 +3134,14 @@ class OutboxStatus(models.TextChoices):
     SENT = "sent", "Sent"
     FAILED = "failed", "Failed"
     BOUNCED = "bounced", "Bounced"
+    SUPPRESSED = "suppressed", "Suppressed"
+
+
+class OutboxPriority(models.IntegerChoices):
+    """Dispatchers claim higher values first; HIGH also has its own lane (process_outbox --lane high)."""
+    BULK = 0, "Bulk"
+    NORMAL = 5, "Normal"
+    HIGH = 10, "High"
 
 
 phone_validator = RegexValidator(r"^\+?\d{8,15}$", "Enter a valid international phone number.")
@@ -3076,15 +3155,21 @@ class SmsOutbox(TimeStampedModel, ImageUrlMixin):
     context = models.JSONField(default=dict, blank=True)
 
     status = models.CharField(max_length=12, choices=OutboxStatus.choices, default=OutboxStatus.QUEUED)
+    priority = models.PositiveSmallIntegerField(choices=OutboxPriority.choices, default=OutboxPriority.NORMAL)
     attempts = models.IntegerField(default=0)
     last_error = models.TextField(blank=True)
 
     provider = models.CharField(max_length=32, blank=True)     # "generic", "twilio", etc
-    provider_ref = models.CharField(max_length=120, blank=True)
+    provider_ref = models.CharField(max_length=120, blank=True, db_index=True)  # DLR lookups
+
+    # of the rendered body actually sent (see services.sms_segments)
+    encoding = models.CharField(max_length=8, blank=True)   # "GSM-7" | "UCS-2"
+    segments = models.PositiveSmallIntegerField(default=0)
 
     scheduled_at = models.DateTimeField(default=timezone.now)
     sent_at = models.DateTimeField(null=True, blank=True)
     next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # SENDING lease start (reclaimed when stale)
 
     created_by = models.ForeignKey(UserModel, null=True, blank=True, on_delete=models.SET_NULL, related_name="sms_created")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -3092,7 +3177,9 @@ class SmsOutbox(TimeStampedModel, ImageUrlMixin):
     class Meta:
         indexes = [
             models.Index(fields=["status", "scheduled_at"]),
+            models.Index(fields=["status", "-priority", "scheduled_at"]),  # claim order: lanes first
             models.Index(fields=["to", "template", "status"]),
+            models.Index(fields=["status", "template", "sent_at"]),  # batched throttle lookups
         ]
 
 
@@ -3106,6 +3193,7 @@ class EmailOutbox(TimeStampedModel, ImageUrlMixin):
     reply_to = models.CharField(max_length=200, blank=True)    # fallback EMAIL_REPLY_TO
 
     status = models.CharField(max_length=12, choices=OutboxStatus.choices, default=OutboxStatus.QUEUED)
+    priority = models.PositiveSmallIntegerField(choices=OutboxPriority.choices, default=OutboxPriority.NORMAL)
     attempts = models.IntegerField(default=0)
     last_error = models.TextField(blank=True)
 
@@ -3115,6 +3203,7 @@ class EmailOutbox(TimeStampedModel, ImageUrlMixin):
     scheduled_at = models.DateTimeField(default=timezone.now)
     sent_at = models.DateTimeField(null=True, blank=True)
     next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)  # SENDING lease start (reclaimed when stale)
 
     created_by = models.ForeignKey(UserModel, null=True, blank=True, on_delete=models.SET_NULL, related_name="emails_created")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -3122,7 +3211,10 @@ class EmailOutbox(TimeStampedModel, ImageUrlMixin):
     class Meta:
         indexes = [
             models.Index(fields=["status", "scheduled_at"]),
+            models.Index(fields=["status", "-priority", "scheduled_at"]),  # claim order: lanes first
             models.Index(fields=["to", "template", "status"]),
+            models.Index(fields=["status", "template", "sent_at"]),  # batched throttle lookups
+            models.Index(fields=["to", "-id"]),  # latest row per address (bounce webhook)
         ]
 
 
@@ -3135,10 +3227,117 @@ class CommsLog(TimeStampedModel, ImageUrlMixin):
     status = models.CharField(max_length=12)
     detail = models.TextField(blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["channel", "template_slug", "status", "when"]),
+        ]
+
     def __str__(self):
         return f"[{self.channel}] {self.template_slug} -> {self.recipient} ({self.status})"
 
 
+class CommsDailyStat(TimeStampedModel, ImageUrlMixin):
+    """
+    Daily per-channel/per-template/per-status counts rolled up from CommsLog
+    rows before the retention job deletes them (see services.comms_retention).
+    """
+    objects = ActiveManager()
+    day = models.DateField()
+    channel = models.CharField(max_length=10)
+    template_slug = models.CharField(max_length=80)
+    status = models.CharField(max_length=12)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("day", "channel", "template_slug", "status")
+        ordering = ("-day", "channel", "template_slug", "status")
+
+    def __str__(self):
+        return f"{self.day} [{self.channel}] {self.template_slug} {self.status}: {self.count}"
+
+
+class CommsMinuteStat(TimeStampedModel, ImageUrlMixin):
+    """
+    Per-minute delivery counters maintained by the dispatcher and the DLR /
+    bounce ingestion (see services.comms_metrics). The admin metrics page
+    reads only these rows, never the outbox tables.
+    """
+    objects = ActiveManager()
+    minute = models.DateTimeField()
+    channel = models.CharField(max_length=10)
+    provider = models.CharField(max_length=32, blank=True)
+    template_slug = models.CharField(max_length=80)
+    event = models.CharField(max_length=32)  # "sent", "failed", "suppressed", "dlr_delivered", "bounce", ...
+    latency_bucket = models.PositiveSmallIntegerField(default=0)  # enqueue->send bucket, "sent" rows only
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("minute", "channel", "provider", "template_slug", "event", "latency_bucket")
+
+    def __str__(self):
+        return f"{self.minute:%Y-%m-%d %H:%M} [{self.channel}] {self.template_slug} {self.event}: {self.count}"
+
+
+class CommsQueueDepth(TimeStampedModel, ImageUrlMixin):
+    """
+    Live in-flight outbox counts (queued / sending / failed-awaiting-retry)
+    per channel, moved by the dispatcher and the enqueue paths as rows change
+    status (see services.comms_metrics). prune_comms recounts them from the
+    outbox daily to absorb drift from code paths that bypass the services.
+    """
+    objects = ActiveManager()
+    channel = models.CharField(max_length=10)
+    status = models.CharField(max_length=12)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("channel", "status")
+
+    def __str__(self):
+        return f"[{self.channel}] {self.status}: {self.count}"
+
+
+class CommsSuppression(TimeStampedModel, ImageUrlMixin):
+    """
+    Recipients we no longer send to (hard bounces, complaints, numbers whose
+    DLRs keep failing). Loaded into an in-process set by services.comms_suppression.
+    """
+    objects = ActiveManager()
+    CHANNEL_CHOICES = [("email", "Email"), ("sms", "SMS")]
+
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    address = models.CharField(max_length=254)  # lower-cased email / E.164 phone (normalized on save)
+    reason = models.CharField(max_length=120, blank=True)  # "bounce", "complaint", "dlr_failures", "manual"
+
+    class Meta:
+        unique_together = ("channel", "address")
+
+    def __str__(self):
+        return f"[{self.channel}] {self.address} ({self.reason})"
+
+    def clean(self):
+        """Hand-entered addresses are stored the way sends look them up (E.164 / lower-cased email)."""
+        from .phones import to_e164
+        from .services.comms_suppression import normalize
+
+        super().clean()
+        if self.channel == "sms" and not to_e164(self.address):
+            raise ValidationError({"address": "Enter a valid phone number."})
+        address = normalize(self.channel, self.address)
+        if self.channel == "email":
+            try:
+                validate_email(address)
+            except ValidationError:
+                raise ValidationError({"address": "Enter a valid email address."})
+        self.address = address
+
+    def save(self, *args, **kwargs):
+        from .services.comms_suppression import normalize
+
+        self.address = normalize(self.channel, self.address)
+        super().save(*args, **kwargs)
+
+
 class EmailBounce(TimeStampedModel, ImageUrlMixin):
     objects = ActiveManager()
     # Marked via webhook or manual import
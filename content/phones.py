@@ -0,0 +1,53 @@
+# content/phones.py
+"""
+Phone number canonicalisation (E.164: "+" country code + subscriber number).
+
+Stored canonically on StudentProfile (phone_e164 / guardian_phone_e164) and
+applied to every SMS `to`, so throttling, suppression and DLR matching see
+one spelling per number.
+"""
+import re
+
+from django.conf import settings
+
+_E164_RE = re.compile(r"^\+[1-9]\d{7,14}$")
+_JUNK_RE = re.compile(r"[^\d+]")
+
+
+def default_country_code() -> str:
+    return str(getattr(settings, "SMS_DEFAULT_COUNTRY_CODE", "880")).lstrip("+")
+
+
+def to_e164(raw, country_code: str | None = None) -> str:
+    """
+    Best-effort E.164 for a user-typed number, or "" if it cannot be one.
+      "01712-345678"     -> "+8801712345678"   (national, trunk 0)
+      "8801712345678"    -> "+8801712345678"   (country code, no +)
+      "00 880 1712345678"-> "+8801712345678"
+      "+1 (415) 555-0100"-> "+14155550100"
+    Only the first number of a comma/slash separated list is used.
+    """
+    s = str(raw or "").strip()
+    if not s:
+        return ""
+    s = re.split(r"[,/;]", s, maxsplit=1)[0]
+    digits = _JUNK_RE.sub("", s)
+    if digits.startswith("00"):
+        digits = "+" + digits[2:]
+    if not digits.startswith("+"):
+        cc = country_code or default_country_code()
+        if digits.startswith(cc) and len(digits) > 11:
+            digits = "+" + digits
+        elif digits.startswith("0"):  # national format: drop the trunk prefix
+            digits = "+" + cc + digits[1:]
+        elif 9 <= len(digits) <= 10:
+            digits = "+" + cc + digits
+        else:
+            return ""
+    digits = "+" + digits[1:].replace("+", "")
+    return digits if _E164_RE.match(digits) else ""
+
+
+def canonical_sms_to(raw) -> str:
+    """SMS recipient as stored in the outbox: E.164 when possible, else the trimmed input."""
+    return to_e164(raw) or str(raw or "").strip()
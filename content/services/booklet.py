@@ -0,0 +1,146 @@
+# content/services/booklet.py
+"""
+Class booklet: every marksheet of a class / term in one PDF, ordered by roll.
+
+The data is read up front in two queries (marksheets with class + term,
+then their rows with subjects) and each student's HTML is rendered here.
+Only the HTML -> PDF step, which is where the time goes, runs in a bounded
+process pool (content.services.pdf_worker). The workers never open a
+database connection. The per-student PDFs are merged with pypdf.
+
+Targets:
+  content      StudentMarksheet, template results/student_marksheet_pdf.html
+  reportcards  Marksheet, the public marksheet_pdf template. Versions already
+               in its PDF cache are reused, and new renders are stored there.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+
+from content.models import StudentMarksheet, StudentMarksheetItem
+
+from . import marksheet_pdf, pdf_worker
+
+CONTENT_TEMPLATE = "results/student_marksheet_pdf.html"
+
+logger = logging.getLogger(__name__)
+
+
+class BookletError(Exception):
+    pass
+
+
+def booklet_workers() -> int:
+    return max(1, int(getattr(settings, "BOOKLET_WORKERS", 0) or min(4, os.cpu_count() or 1)))
+
+
+def start_method(preferred: str | None = None) -> str:
+    """
+    BOOKLET_START_METHOD, else `preferred`, else "spawn". Forking a threaded
+    web worker can copy locks held by other threads into the children, so only
+    single-threaded callers (print_booklet) ask for "fork", which starts faster.
+    """
+    method = getattr(settings, "BOOKLET_START_METHOD", None) or preferred or "spawn"
+    return method if method in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def roll_key(roll: str):
+    """Numeric rolls in number order ("2" before "10"), then anything else."""
+    m = re.match(r"\s*(\d+)", roll or "")
+    return (0, int(m.group(1)), roll) if m else (1, 0, roll or "")
+
+
+def content_marksheets():
+    return StudentMarksheet.objects.select_related("school_class", "term").prefetch_related(
+        Prefetch("items", queryset=StudentMarksheetItem.objects.select_related("subject").order_by("order", "id"))
+    )
+
+
+def _pages(target: str, queryset):
+    """[(sheet, rows, html, cache key or None)] in booklet order."""
+    if target == "content":
+        sheets = list(content_marksheets().filter(pk__in=queryset.values("pk")))
+        sheets.sort(key=lambda ms: (ms.school_class_id, ms.term_id, roll_key(ms.roll_number), ms.student_full_name, ms.pk))
+        out = []
+        for ms in sheets:
+            rows = list(ms.items.all())
+            out.append((ms, rows, render_to_string(CONTENT_TEMPLATE, {"ms": ms, "rows": rows}), None))
+        return out
+    if target == "reportcards":
+        sheets = list(marksheet_pdf.marksheets(published_only=False).filter(pk__in=queryset.values("pk")))
+        sheets.sort(key=lambda ms: (ms.grade_id, ms.term_id, roll_key(ms.roll_number), ms.student_name, ms.pk))
+        out = []
+        for ms in sheets:
+            rows = list(ms.rows.all())
+            out.append((ms, rows, marksheet_pdf.render_html(ms, rows), marksheet_pdf.cache_key(ms, rows)))
+        return out
+    raise BookletError(f"Unknown target {target!r}.")
+
+
+def build_booklet(queryset, *, target: str = "content", workers: int | None = None,
+                  base_url: str | None = None, method: str | None = None) -> tuple[bytes, dict]:
+    """
+    Render the marksheets of `queryset` and merge them into one PDF.
+    Returns (pdf bytes, {"sheets", "rendered", "cached", "pages", "workers", "seconds"}).
+    Every failure (WeasyPrint missing or crashing, a worker dying, a full disk)
+    is raised as BookletError. `method`: pool start method, see start_method().
+    """
+    try:
+        return _build(queryset, target=target, workers=workers, base_url=base_url, method=method)
+    except BookletError:
+        raise
+    except ImportError as e:
+        raise BookletError(f"{e.name or 'WeasyPrint'} is not installed.")
+    except Exception as e:
+        logger.exception("Booklet rendering failed")
+        raise BookletError(f"Could not print the booklet: {e}") from e
+
+
+def _build(queryset, *, target, workers, base_url, method) -> tuple[bytes, dict]:
+    from pypdf import PdfReader, PdfWriter  # lazy import
+
+    t0 = time.perf_counter()
+    pages = _pages(target, queryset)
+    if not pages:
+        raise BookletError("No marksheets to print.")
+
+    pdfs, jobs = [None] * len(pages), []
+    for i, (ms, _rows, html, key) in enumerate(pages):
+        pdfs[i] = marksheet_pdf.read_cached(ms.pk, key) if key else None
+        if pdfs[i] is None:
+            jobs.append((i, html, marksheet_pdf.PDF_CSS, base_url))
+
+    workers = min(workers or booklet_workers(), len(jobs))
+    if workers <= 1:
+        for i, pdf in map(pdf_worker.render, jobs):
+            pdfs[i] = pdf
+    else:
+        ctx = multiprocessing.get_context(start_method(method))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            for i, pdf in pool.map(pdf_worker.render, jobs):
+                pdfs[i] = pdf
+
+    for i, _html, _css, _base in jobs:
+        ms, _rows, _html, key = pages[i]
+        if key:
+            marksheet_pdf.store(ms.pk, key, pdfs[i])
+
+    writer = PdfWriter()
+    for pdf in pdfs:
+        for page in PdfReader(BytesIO(pdf)).pages:
+            writer.add_page(page)
+    out = BytesIO()
+    writer.write(out)
+    stats = {
+        "sheets": len(pages), "rendered": len(jobs), "cached": len(pages) - len(jobs),
+        "pages": len(writer.pages), "workers": workers, "seconds": time.perf_counter() - t0,
+    }
+    return out.getvalue(), stats
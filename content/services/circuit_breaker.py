@@ -0,0 +1,60 @@
+# content/services/circuit_breaker.py
+"""
+Circuit breaker with its state in the Django cache, so all workers share it.
+
+closed     -> calls go through; consecutive failures are counted
+open       -> after `failure_threshold` consecutive failures: calls are refused
+              for `cooldown` seconds
+half-open  -> after the cool-down exactly one worker may send a probe call;
+              success closes the circuit, failure re-opens it
+"""
+import time
+
+from django.core.cache import cache
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, *, failure_threshold: int = 5, cooldown: float = 60):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = float(cooldown)
+        self._failures_key = f"comms:cb:{name}:failures"
+        self._opened_key = f"comms:cb:{name}:opened_at"
+        self._probe_key = f"comms:cb:{name}:probe"
+
+    def state(self) -> str:
+        opened_at = cache.get(self._opened_key)
+        if opened_at is None:
+            return CLOSED
+        return OPEN if time.time() - opened_at < self.cooldown else HALF_OPEN
+
+    def allow(self) -> bool:
+        """May we call the provider now? In half-open state only one caller wins the probe."""
+        state = self.state()
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        return cache.add(self._probe_key, 1, timeout=max(1, int(self.cooldown)))
+
+    def record_success(self) -> None:
+        cache.delete_many([self._failures_key, self._opened_key, self._probe_key])
+
+    def record_failure(self) -> None:
+        if self.state() != CLOSED:  # the half-open probe failed: open again for a full cool-down
+            cache.set(self._opened_key, time.time(), timeout=None)
+            cache.delete(self._probe_key)
+            return
+        cache.add(self._failures_key, 0, timeout=None)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:  # evicted between add() and incr()
+            cache.set(self._failures_key, 1, timeout=None)
+            failures = 1
+        if failures >= self.failure_threshold:
+            cache.set(self._opened_key, time.time(), timeout=None)
+            cache.delete(self._failures_key)
@@ -0,0 +1,256 @@
+# content/services/comms_events.py
+"""
+Ingestion of provider delivery events: SMS delivery reports (DLRs) and email
+bounces / complaints.
+
+Both webhooks (single event) and the batch endpoints (arrays of events) go
+through here. A batch costs one lookup of the keys already seen, one claim
+INSERT per new event (see _claim_new_events), one indexed lookup for the
+affected outbox rows, then grouped UPDATEs + bulk_create for the log.
+
+Idempotent: every event is keyed by the provider's event id (or a hash of the
+payload when the provider sends none), so redelivered bursts are no-ops.
+
+The webhooks only reach this module after verify_webhook() accepted the
+request: an HMAC-SHA256 signature of the body, or the shared secret itself
+for gateways that can only call a fixed URL. No secret configured means
+every request is rejected.
+"""
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+from content.models import CommsLog, EmailBounce, EmailOutbox, OutboxStatus, ProcessedGatewayEvent, SmsOutbox
+from content.services.comms_metrics import record, track_depth
+from content.services.comms_suppression import suppress, suppress_failing_numbers
+
+DLR_STATUSES = {"delivered", "undelivered", "failed"}
+# CommsLog status per DLR status; a failed DLR is logged apart from a failed send attempt
+DLR_LOG_STATUS = {"delivered": "delivered", "undelivered": "undelivered", "failed": "dlr_failed"}
+# bounce-webhook events that put the address on the suppression list
+SUPPRESS_EMAIL_EVENTS = {"bounce", "complaint", "spamreport", "dropped"}
+_CHUNK = 500
+
+
+def webhook_secret(channel: str) -> str:
+    """COMMS_<CHANNEL>_WEBHOOK_SECRET, else COMMS_WEBHOOK_SECRET; "" when unset."""
+    return (getattr(settings, f"COMMS_{channel.upper()}_WEBHOOK_SECRET", "")
+            or getattr(settings, "COMMS_WEBHOOK_SECRET", "") or "")
+
+
+def verify_webhook(channel: str, body: bytes, *, signature: str = "", token: str = "") -> bool:
+    """
+    True if `signature` is the hex HMAC-SHA256 of `body` ("sha256=" prefix
+    optional) under the channel's secret, or `token` equals the secret.
+    """
+    secret = webhook_secret(channel)
+    if not secret:
+        return False
+    if signature:
+        expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        given = signature.strip().lower().removeprefix("sha256=")
+        return hmac.compare_digest(given, expected)
+    return bool(token) and hmac.compare_digest(token.encode(), secret.encode())
+
+
+def _chunked(seq, size=_CHUNK):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def _apply_status(model, rows) -> None:
+    """
+    Write status/last_error for `rows`, grouped into one UPDATE ... WHERE pk IN
+    per distinct (status, last_error); DLR/bounce bursts share a few values,
+    so this beats a per-row CASE bulk_update by a wide margin.
+    """
+    groups: dict[tuple, list[int]] = {}
+    for row in rows:
+        groups.setdefault((row.status, row.last_error), []).append(row.pk)
+    for (status, last_error), pks in groups.items():
+        for ids in _chunked(pks):
+            model.objects.filter(pk__in=ids).update(status=status, last_error=last_error)
+
+
+def _event_key(prefix: str, payload: dict, explicit_id) -> str:
+    if explicit_id:
+        return f"{prefix}:{explicit_id}"[:128]
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{prefix}:sha1:{digest}"
+
+
+def _claim_new_events(provider: str, keyed: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+    """
+    Drop events already processed (or repeated within this batch) and record
+    the rest in ProcessedGatewayEvent. Call inside a transaction.
+
+    Each new key is inserted on its own savepoint: when two deliveries of the
+    same batch race, the second insert waits for the first transaction and
+    then hits the unique index, so only the delivery that inserted a key
+    applies its event.
+    """
+    unique: dict[str, dict] = {}
+    for key, event in keyed:
+        unique.setdefault(key, event)
+    seen = set()
+    for keys in _chunked(list(unique)):
+        seen.update(ProcessedGatewayEvent.objects.filter(event_id__in=keys).values_list("event_id", flat=True))
+    fresh = []
+    for key, event in unique.items():
+        if key in seen:
+            continue
+        try:
+            with transaction.atomic():
+                ProcessedGatewayEvent.objects.create(provider=provider, event_id=key)
+        except IntegrityError:
+            continue  # a concurrent delivery claimed it first
+        fresh.append((key, event))
+    return fresh
+
+
+def _text(value) -> str:
+    """Payload values as text: providers send numbers or nulls where strings are expected."""
+    return "" if value is None else str(value)
+
+
+def _as_events(payload) -> list[dict]:
+    """Accept a bare array, {"events": [...]}, or a single event object."""
+    if isinstance(payload, dict) and isinstance(payload.get("events"), list):
+        payload = payload["events"]
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list):
+        return []
+    return [e for e in payload if isinstance(e, dict)]
+
+
+# ------------------------------- SMS DLRs -------------------------------
+def ingest_sms_dlrs(payload) -> dict:
+    """
+    Apply delivery reports. Field names follow the generic gateway
+    (message_id|id, status, error, event_id); adjust for your provider.
+    Returns {"received", "duplicates", "applied"}.
+    """
+    events = _as_events(payload)
+    keyed = []
+    for e in events:
+        ref = str(e.get("message_id") or e.get("id") or "")
+        status = _text(e.get("status")).lower()
+        keyed.append((_event_key("sms-dlr", e, e.get("event_id") or (ref and f"{ref}:{status}")), e))
+
+    applied = 0
+    with transaction.atomic():
+        fresh = _claim_new_events("sms-dlr", keyed)
+        updates = []
+        for _, e in fresh:
+            ref = str(e.get("message_id") or e.get("id") or "")
+            status = _text(e.get("status")).lower()
+            if ref and status in DLR_STATUSES:
+                updates.append((ref, status, e))
+
+        # latest outbox row per provider_ref (indexed)
+        by_ref: dict[str, SmsOutbox] = {}
+        for refs in _chunked(sorted({ref for ref, _, _ in updates})):
+            for ob in SmsOutbox.objects.filter(provider_ref__in=refs).select_related("template").order_by("id"):
+                by_ref[ob.provider_ref] = ob
+
+        changed: dict[int, SmsOutbox] = {}
+        before: dict[int, str] = {}
+        logs = []
+        for ref, status, e in updates:
+            ob = by_ref.get(ref)
+            if ob is None:
+                continue
+            before.setdefault(ob.pk, ob.status)
+            if status == "delivered":
+                ob.status = OutboxStatus.SENT
+            else:
+                ob.status = OutboxStatus.FAILED
+                ob.last_error = _text(e.get("error") or status)[:1000]
+            changed[ob.pk] = ob
+            logs.append(CommsLog(channel="sms", recipient=ob.to, template_slug=ob.template.slug,
+                                 status=DLR_LOG_STATUS[status], detail=str(e)[:300]))
+            applied += 1
+
+        _apply_status(SmsOutbox, changed.values())
+        track_depth("sms", before=before.values(), after=[changed[pk].status for pk in before])
+        CommsLog.objects.bulk_create(logs, batch_size=_CHUNK)
+        record(("sms", by_ref[ref].provider, by_ref[ref].template.slug, f"dlr_{status}", None)
+               for ref, status, _ in updates if ref in by_ref)
+        suppress_failing_numbers({log.recipient for log in logs if log.status != "delivered"})
+
+    return {"received": len(events), "duplicates": len(events) - len(fresh), "applied": applied}
+
+
+# ---------------------------- email bounces -----------------------------
+def ingest_email_bounces(payload) -> dict:
+    """
+    Record bounces / complaints and mark the latest outbox row per address as
+    BOUNCED. Accepts SendGrid/SES-style fields (email|recipient, event,
+    reason|error, sg_event_id|event_id). Returns {"received", "duplicates", "applied"}.
+    """
+    events = _as_events(payload)
+    keyed = [(_event_key("email-bounce", e, e.get("sg_event_id") or e.get("event_id")), e) for e in events]
+
+    applied = 0
+    with transaction.atomic():
+        fresh = _claim_new_events("email-bounce", keyed)
+        bounces = []
+        for _, e in fresh:
+            email = _text(e.get("email") or e.get("recipient")).strip()
+            reason = _text(e.get("reason") or e.get("error"))
+            bounces.append((email, _text(e.get("event") or "bounce"), reason, e))
+
+        EmailBounce.objects.bulk_create(
+            [EmailBounce(email=email, event=event[:32], reason=reason[:120], raw=e)
+             for email, event, reason, e in bounces],
+            batch_size=_CHUNK,
+        )
+
+        # latest outbox row per address: MAX(id) GROUP BY to, served by the (to, -id) index
+        latest_ids = []
+        for emails in _chunked(sorted({email for email, *_ in bounces if email})):
+            latest_ids += (
+                EmailOutbox.objects.filter(to__in=emails)
+                .values("to").annotate(last=Max("id")).order_by()
+                .values_list("last", flat=True)
+            )
+        by_email = {
+            eo.to: eo
+            for ids in _chunked(latest_ids)
+            for eo in EmailOutbox.objects.filter(pk__in=ids).select_related("template")
+        }
+
+        changed: dict[int, EmailOutbox] = {}
+        before: dict[int, str] = {}
+        logs = []
+        for email, _event, reason, _e in bounces:
+            eo = by_email.get(email)
+            if eo is None:
+                continue
+            before.setdefault(eo.pk, eo.status)
+            eo.status = OutboxStatus.BOUNCED
+            eo.last_error = reason[:1000]
+            changed[eo.pk] = eo
+            logs.append(CommsLog(channel="email", recipient=email, template_slug=eo.template.slug,
+                                 status="bounced", detail=reason[:200]))
+            applied += 1
+
+        _apply_status(EmailOutbox, changed.values())
+        track_depth("email", before=before.values(), after=[changed[pk].status for pk in before])
+        CommsLog.objects.bulk_create(logs, batch_size=_CHUNK)
+        record(("email", by_email[email].provider, by_email[email].template.slug, event.lower(), None)
+               for email, event, *_ in bounces if email in by_email)
+        hard = set(getattr(settings, "COMMS_SUPPRESS_EMAIL_EVENTS", SUPPRESS_EMAIL_EVENTS))
+        by_event: dict[str, set] = {}
+        for email, event, *_ in bounces:
+            if email and event.lower() in hard:
+                by_event.setdefault(event.lower(), set()).add(email)
+        for event, emails in by_event.items():
+            suppress("email", emails, reason=event)
+
+    return {"received": len(events), "duplicates": len(events) - len(fresh), "applied": applied}
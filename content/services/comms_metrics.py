@@ -0,0 +1,230 @@
+# content/services/comms_metrics.py
+"""
+Per-minute comms rollups (CommsMinuteStat) and the numbers the admin
+metrics page shows.
+
+Writers (the batch dispatcher, DLR / bounce ingestion) call `record()` with
+the outcomes of a batch. Each batch adds a few upserts keyed by
+(minute, channel, provider, template, event, latency bucket). Enqueue-to-send
+latency is kept as a bucket histogram, so p50/p95 come from a handful of
+grouped rollup rows. The outbox tables are never scanned: queue depth comes
+from CommsQueueDepth, a handful of counters moved by track_depth() whenever
+the services change a row's status (applied on commit, so rolled-back work
+never counts) and recounted daily by prune_comms (recount_queue_depth).
+"""
+import logging
+from bisect import bisect_left
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from content.models import CommsMinuteStat, CommsQueueDepth, EmailOutbox, OutboxStatus, SmsOutbox
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the enqueue->send latency buckets; the last bucket is open-ended
+LATENCY_BOUNDS = [1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600]
+IN_FLIGHT = [OutboxStatus.QUEUED, OutboxStatus.SENDING, OutboxStatus.FAILED]
+SEND_EVENTS = {OutboxStatus.SENT, OutboxStatus.FAILED, OutboxStatus.SUPPRESSED}
+
+
+def latency_bucket(seconds: float | None) -> int:
+    """1-based bucket index; 0 means "no latency" (non-sent events)."""
+    if seconds is None:
+        return 0
+    return bisect_left(LATENCY_BOUNDS, max(0.0, seconds)) + 1
+
+
+def bucket_label(bucket: int) -> str:
+    if bucket <= 0:
+        return "—"
+    if bucket > len(LATENCY_BOUNDS):
+        return f"> {_fmt_seconds(LATENCY_BOUNDS[-1])}"
+    return f"≤ {_fmt_seconds(LATENCY_BOUNDS[bucket - 1])}"
+
+
+def _fmt_seconds(s: int) -> str:
+    if s < 60:
+        return f"{s}s"
+    if s < 3600:
+        return f"{s // 60}m"
+    return f"{s // 3600}h"
+
+
+def record(events, *, when=None) -> None:
+    """
+    `events` yields (channel, provider, template_slug, event, latency_seconds|None).
+    Never raises: metrics must not break delivery.
+    """
+    counts = Counter()
+    minute = (when or timezone.now()).replace(second=0, microsecond=0)
+    for channel, provider, template_slug, event, latency in events:
+        counts[(channel, provider or "", template_slug, event, latency_bucket(latency))] += 1
+    if not counts:
+        return
+    try:
+        for (channel, provider, template_slug, event, bucket), n in counts.items():
+            key = dict(minute=minute, channel=channel, provider=provider,
+                       template_slug=template_slug, event=event, latency_bucket=bucket)
+            if CommsMinuteStat.objects.filter(**key).update(count=F("count") + n):
+                continue
+            try:
+                with transaction.atomic():
+                    CommsMinuteStat.objects.create(count=n, **key)
+            except IntegrityError:  # another worker created it first
+                CommsMinuteStat.objects.filter(**key).update(count=F("count") + n)
+    except Exception:
+        logger.exception("comms metrics rollup failed")
+
+
+def record_outbox(channel: str, rows, *, default_provider: str = "") -> None:
+    """Rollup helper for finished outbox rows (sent / failed / suppressed)."""
+    now = timezone.now()
+    record(
+        (
+            channel,
+            ob.provider or default_provider,
+            ob.template.slug,
+            ob.status,
+            (now - ob.created_at).total_seconds() if ob.status == OutboxStatus.SENT and ob.created_at else None,
+        )
+        for ob in rows
+    )
+
+
+# --------------------------- queue depth ------------------------------
+def track_depth(channel: str, before=(), after=()) -> None:
+    """
+    Rows of `channel` moved from the `before` statuses to the `after` ones
+    (one entry per row; new rows have no before, deleted rows no after).
+    Only in-flight statuses count. Applied on commit.
+    """
+    delta = Counter(s for s in after if s in IN_FLIGHT)
+    delta.subtract(s for s in before if s in IN_FLIGHT)
+    delta = {s: n for s, n in delta.items() if n}
+    if delta:
+        transaction.on_commit(lambda: _apply_depth(channel, delta))
+
+
+def _apply_depth(channel: str, delta: dict) -> None:
+    try:
+        for status, n in delta.items():
+            key = dict(channel=channel, status=status)
+            if CommsQueueDepth.objects.filter(**key).update(count=F("count") + n):
+                continue
+            try:
+                with transaction.atomic():
+                    CommsQueueDepth.objects.create(count=n, **key)
+            except IntegrityError:
+                CommsQueueDepth.objects.filter(**key).update(count=F("count") + n)
+    except Exception:
+        logger.exception("comms queue depth update failed")
+
+
+def recount_queue_depth() -> dict:
+    """Reset the counters from the outbox tables (one grouped count each); returns the new depth."""
+    depth = {}
+    with transaction.atomic():
+        for channel, model in (("sms", SmsOutbox), ("email", EmailOutbox)):
+            counts = dict(
+                model.objects.filter(status__in=IN_FLIGHT)
+                .values_list("status").annotate(n=Count("*")).order_by()
+            )
+            depth[channel] = {s: counts.get(s, 0) for s in IN_FLIGHT}
+            for status, n in depth[channel].items():
+                CommsQueueDepth.objects.update_or_create(channel=channel, status=status, defaults={"count": n})
+    return depth
+
+
+# ----------------------------- read side ------------------------------
+def queue_depth() -> dict:
+    """{"sms": {status: n}, "email": {status: n}} for in-flight statuses, from the counters."""
+    depth = {ch: {s: 0 for s in IN_FLIGHT} for ch in ("sms", "email")}
+    for channel, status, n in CommsQueueDepth.objects.values_list("channel", "status", "count"):
+        if channel in depth and status in depth[channel]:
+            depth[channel][status] = max(0, n)
+    return depth
+
+
+def _percentile(hist: dict[int, int], q: float) -> int:
+    total = sum(hist.values())
+    if not total:
+        return 0
+    target = q * total
+    running = 0
+    for bucket in sorted(hist):
+        running += hist[bucket]
+        if running >= target:
+            return bucket
+    return max(hist)
+
+
+def dashboard(*, minutes: int = 60, channel: str | None = None, max_bars: int = 120) -> dict:
+    """
+    Everything the metrics page shows, from the rollups of the last `minutes`:
+    four small GROUP BY queries over the window, aggregated in the database.
+    """
+    now = timezone.now().replace(second=0, microsecond=0)
+    since = now - timedelta(minutes=minutes - 1)
+    qs = CommsMinuteStat.objects.filter(minute__gte=since)
+    if channel:
+        qs = qs.filter(channel=channel)
+    sent = qs.filter(event=OutboxStatus.SENT)
+
+    per_minute = dict(sent.values_list("minute").annotate(n=Sum("count")).order_by())
+    hist = dict(sent.values_list("latency_bucket").annotate(n=Sum("count")).order_by())
+
+    # sent-per-minute chart, folded into at most `max_bars` bars
+    step = max(1, -(-minutes // max_bars))
+    series = []
+    for i in range(0, minutes, step):
+        start = since + timedelta(minutes=i)
+        n = sum(per_minute.get(start + timedelta(minutes=j), 0) for j in range(min(step, minutes - i)))
+        series.append({"minute": start, "sent": n})
+    peak = max((p["sent"] for p in series), default=0) or 1
+    for p in series:
+        p["pct"] = round(100 * p["sent"] / peak)
+
+    providers: dict[tuple, Counter] = {}
+    for ch, provider, ev, n in (
+        qs.filter(event__in=[OutboxStatus.SENT, OutboxStatus.FAILED])
+        .values_list("channel", "provider", "event").annotate(n=Sum("count")).order_by()
+    ):
+        providers.setdefault((ch, provider or "—"), Counter())[ev] += n
+    provider_rows = []
+    for (ch, provider), c in sorted(providers.items()):
+        attempts = c[OutboxStatus.SENT] + c[OutboxStatus.FAILED]
+        provider_rows.append({
+            "channel": ch, "provider": provider, "sent": c[OutboxStatus.SENT], "failed": c[OutboxStatus.FAILED],
+            "failure_rate": round(100 * c[OutboxStatus.FAILED] / attempts, 1) if attempts else 0,
+        })
+
+    # delivery outcomes: dlr_* and bounce/complaint events
+    templates: dict[tuple, Counter] = {}
+    for ch, slug, ev, n in (
+        qs.exclude(event__in=SEND_EVENTS)
+        .values_list("channel", "template_slug", "event").annotate(n=Sum("count")).order_by()
+    ):
+        templates.setdefault((ch, slug), Counter())[ev] += n
+    outcome_events = sorted({ev for c in templates.values() for ev in c})
+    template_rows = [
+        {"channel": ch, "template_slug": slug, "counts": [c.get(ev, 0) for ev in outcome_events]}
+        for (ch, slug), c in sorted(templates.items())
+    ]
+
+    total_sent = sum(per_minute.values())
+    return {
+        "minutes": minutes,
+        "queue_depth": queue_depth(),
+        "series": series,
+        "total_sent": total_sent,
+        "rate_per_minute": round(total_sent / minutes, 1) if minutes else 0,
+        "p50": bucket_label(_percentile(hist, 0.50)),
+        "p95": bucket_label(_percentile(hist, 0.95)),
+        "providers": provider_rows,
+        "outcome_events": outcome_events,
+        "templates": template_rows,
+    }
@@ -1,170 +1,573 @@
 from __future__ import annotations
+import logging
 import math
+import threading
 from datetime import timedelta
+from functools import partial
+from itertools import chain, groupby, islice
+from operator import itemgetter
 from django.conf import settings
-from django.db import transaction
+from django.db import connections, transaction
+from django.db.models import Q
 from django.utils import timezone
 
 
-from .comms_templating import render_string
-from .sms import send_sms
-from .emailing import send_email_smtp
-from ..models import SmsOutbox, OutboxStatus, EmailOutbox, MessageTemplate, CommsLog
+from ..phones import canonical_sms_to
+from .comms_metrics import record_outbox, track_depth
+from .contacts import broadcast_recipients
+from .comms_suppression import is_suppressed, normalize, suppressed
+from .comms_templating import compile_template, render_template
+from .sms_segments import render_sms
+from .rate_limit import daily_remaining, release_daily, reserve_daily
+from .sms import send_sms_batch, sms_providers
+from .emailing import build_email_message, send_email_batch
+from ..models import SmsOutbox, OutboxPriority, OutboxStatus, EmailOutbox, MessageTemplate, CommsLog
+
+logger = logging.getLogger(__name__)
+
+
+def _throttle_window():
+    return timezone.now() - timedelta(minutes=getattr(settings, "COMMS_THROTTLE_MINUTES", 10))
 
 
 def throttle_guard_sms(to: str, template_slug: str) -> bool:
-    window = timezone.now() - timedelta(minutes=getattr(settings, "COMMS_THROTTLE_MINUTES", 10))
     return SmsOutbox.objects.filter(
-        to=to, template__slug=template_slug, status=OutboxStatus.SENT, sent_at__gte=window
+        to=canonical_sms_to(to), template__slug=template_slug, status=OutboxStatus.SENT, sent_at__gte=_throttle_window()
     ).exists()
 
 def throttle_guard_email(to: str, template_slug: str) -> bool:
-    window = timezone.now() - timedelta(minutes=getattr(settings, "COMMS_THROTTLE_MINUTES", 10))
     return EmailOutbox.objects.filter(
-        to=to, template__slug=template_slug, status=OutboxStatus.SENT, sent_at__gte=window
+        to=to, template__slug=template_slug, status=OutboxStatus.SENT, sent_at__gte=_throttle_window()
     ).exists()
 
 
+def throttled_pairs(model, rows, since=None) -> set[tuple[str, int]]:
+    """
+    Batch version of the throttle guards: one grouped query returning the
+    (to, template_id) pairs of ``rows`` already SENT inside the window.
+    Callers test membership in memory instead of one exists() per row.
+    """
+    rows = list(rows)
+    if not rows:
+        return set()
+    since = since or _throttle_window()
+    return set(
+        model.objects.filter(
+            status=OutboxStatus.SENT,
+            sent_at__gte=since,
+            template_id__in={r.template_id for r in rows},
+            to__in={r.to for r in rows},
+        ).values_list("to", "template_id").distinct()
+    )
+
+
 
-def queue_sms(*, to, template_slug, context, created_by=None, provider=None, sender_id=None, scheduled_at=None):
+def queue_sms(*, to, template_slug, context, created_by=None, provider=None, sender_id=None, scheduled_at=None,
+              priority=OutboxPriority.NORMAL):
     tpl = MessageTemplate.objects.get(slug=template_slug, kind="sms", is_active=True)
+    to = canonical_sms_to(to)
+    blocked = _suppressible(priority) and is_suppressed("sms", to)
     row = SmsOutbox.objects.create(
-        to=str(to).strip(),
+        to=to,
         template=tpl,
         context=context or {},
         provider=provider or getattr(settings, "SMS_PROVIDER", "console"),
         sender_id=sender_id or getattr(settings, "SMS_SENDER_ID", ""),
-        status=OutboxStatus.QUEUED,
+        status=OutboxStatus.SUPPRESSED if blocked else OutboxStatus.QUEUED,
+        priority=priority,
         scheduled_at=scheduled_at or timezone.now(),   # <- never NULL
         created_by=created_by,
     )
+    track_depth("sms", after=[row.status])
     return row
 
 
 
 def queue_email(*, to: str, template_slug: str, context: dict,
                 from_email: str | None = None, reply_to: str | None = None,
-                created_by=None, scheduled_at=None) -> EmailOutbox:
+                created_by=None, scheduled_at=None, priority=OutboxPriority.NORMAL) -> EmailOutbox:
     """
     Enqueue an email and (optionally) kick a small batch sender immediately
-    after the DB transaction commits.
+    after the DB transaction commits. Suppressed recipients are recorded
+    with status "suppressed" and never sent. priority=OutboxPriority.HIGH
+    puts it in the high lane (claimed first, never throttled, never
+    suppressed: a login code must arrive even after a bounce).
     """
     tpl = MessageTemplate.objects.get(slug=template_slug, kind="email", is_active=True)
+    to = (to or "").strip()
+    blocked = _suppressible(priority) and is_suppressed("email", to)
 
     ob = EmailOutbox.objects.create(
-        to=(to or "").strip(),
+        to=to,
         template=tpl,
         context=context or {},
         from_email=from_email or "",
         reply_to=reply_to or "",
         created_by=created_by,
-        status=getattr(OutboxStatus, "QUEUED", "queued"),
+        status=OutboxStatus.SUPPRESSED if blocked else OutboxStatus.QUEUED,
+        priority=priority,
         scheduled_at=scheduled_at or timezone.now(),
     )
+    track_depth("email", after=[ob.status])
 
     # lightweight auto-send nudge (no external app)
-    if getattr(settings, "COMMS_AUTOSEND_EMAIL", False):
-        from .comms_outbox import process_email_batch  # safe local import
-
-        # run AFTER the outer transaction commits so we see the row
-        transaction.on_commit(lambda: process_email_batch(limit=20))
+    if not blocked and getattr(settings, "COMMS_AUTOSEND_EMAIL", False):
+        nudge_email_dispatch(lane="high" if priority >= OutboxPriority.HIGH else None)
 
     return ob
 
 
+_nudge_lock = threading.Lock()
+_nudge_lanes: set = set()  # lanes asked for since the drain thread last looked
+_nudge_thread: threading.Thread | None = None
+
+
+def nudge_email_dispatch(lane: str | None = None) -> None:
+    """
+    Send a small batch AFTER the outer transaction commits (so the rows are
+    visible) on a background thread, so the caller (login, contact form)
+    never waits for SMTP. At most one drain thread runs per process: nudges
+    arriving meanwhile (COMMS_AUTOSEND_EMAIL and EMAIL_AUTO_SEND may both fire
+    for one message) are folded into it. Rows it claimed when the process is
+    recycled are reclaimed once their lease expires (see _claim_batch); the
+    `process_outbox --lane high --loop` dispatcher is still the primary sender.
+    """
+    transaction.on_commit(partial(_start_nudge, lane))
+
+
+def _start_nudge(lane: str | None) -> None:
+    global _nudge_thread
+    with _nudge_lock:
+        _nudge_lanes.add(lane)
+        if _nudge_thread is not None and _nudge_thread.is_alive():
+            return
+        _nudge_thread = threading.Thread(target=_drain_nudges, daemon=True, name="comms-nudge")
+        _nudge_thread.start()
+
+
+def _drain_nudges() -> None:
+    global _nudge_thread
+    try:
+        while True:
+            with _nudge_lock:
+                if not _nudge_lanes:
+                    _nudge_thread = None
+                    return
+                # an unrestricted batch claims HIGH rows first anyway
+                lane = None if None in _nudge_lanes else "high"
+                _nudge_lanes.clear()
+            try:
+                process_email_batch(limit=20, lane=lane)
+            except Exception:
+                logger.exception("Background email nudge failed")
+    finally:
+        connections.close_all()
+
+
+def system_template(slug: str, *, kind: str, **defaults) -> MessageTemplate | None:
+    """
+    A MessageTemplate the code itself relies on (login codes, contact form
+    mails), created with `defaults` on first use; admins may reword it later.
+    Returns None (and logs it) when an admin deactivated the slug or gave it
+    another kind, so callers can say the message was not sent instead of failing.
+    """
+    tpl, _ = MessageTemplate.objects.get_or_create(slug=slug, defaults={"kind": kind, **defaults})
+    if not tpl.is_active or tpl.kind != kind:
+        logger.error("System template %r is %s; nothing queued.", slug,
+                     "inactive" if not tpl.is_active else f"of kind {tpl.kind!r}, not {kind!r}")
+        return None
+    return tpl
+
+
+def _suppressible(priority) -> bool:
+    # HIGH is transactional mail (login codes): the suppression list never blocks it
+    return priority < OutboxPriority.HIGH
+
+
+def _peek(rows):
+    """(has_rows, rows) without consuming the first item of an iterator."""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return False, rows
+    return True, chain([first], rows)
+
+
+def _bulk_insert(model, objs, batch_size: int = 500) -> int:
+    """Chunked bulk_create over any iterable, so huge runs never sit in memory at once."""
+    it = iter(objs)
+    total = 0
+    while True:
+        chunk = list(islice(it, batch_size))
+        if not chunk:
+            return total
+        model.objects.bulk_create(chunk, batch_size=batch_size)
+        track_depth("sms" if model is SmsOutbox else "email", after=[ob.status for ob in chunk])
+        total += len(chunk)
+
+
+def bulk_queue_sms(*, template_slug, rows, created_by=None, provider=None, sender_id=None,
+                   scheduled_at=None, priority=OutboxPriority.BULK, batch_size: int = 500) -> int:
+    """
+    Set-based queue_sms: `rows` yields (to, context) pairs. The template is
+    fetched once and rows are inserted with chunked bulk_create. Bulk lane by default.
+    """
+    has_rows, rows = _peek(rows)
+    if not has_rows:
+        return 0
+    tpl = MessageTemplate.objects.get(slug=template_slug, kind="sms", is_active=True)
+    provider = provider or getattr(settings, "SMS_PROVIDER", "console")
+    sender_id = sender_id or getattr(settings, "SMS_SENDER_ID", "")
+    scheduled_at = scheduled_at or timezone.now()
+    blocked = suppressed("sms") if _suppressible(priority) else frozenset()
+    return _bulk_insert(SmsOutbox, (
+        SmsOutbox(
+            to=to,
+            template=tpl,
+            context=context or {},
+            provider=provider,
+            sender_id=sender_id,
+            status=OutboxStatus.SUPPRESSED if to in blocked else OutboxStatus.QUEUED,
+            priority=priority,
+            scheduled_at=scheduled_at,
+            created_by=created_by,
+        )
+        for to, context in ((canonical_sms_to(to), context) for to, context in rows)
+    ), batch_size=batch_size)
+
+
+def bulk_queue_email(*, template_slug, rows, from_email: str | None = None, reply_to: str | None = None,
+                     created_by=None, scheduled_at=None, priority=OutboxPriority.BULK, batch_size: int = 500) -> int:
+    """
+    Set-based queue_email: `rows` yields (to, context) pairs. One template
+    lookup, chunked bulk_create, and at most one auto-send nudge per call.
+    Bulk lane by default.
+    """
+    has_rows, rows = _peek(rows)
+    if not has_rows:
+        return 0
+    tpl = MessageTemplate.objects.get(slug=template_slug, kind="email", is_active=True)
+    scheduled_at = scheduled_at or timezone.now()
+    blocked = suppressed("email") if _suppressible(priority) else frozenset()
+    queued = _bulk_insert(EmailOutbox, (
+        EmailOutbox(
+            to=to,
+            template=tpl,
+            context=context or {},
+            from_email=from_email or "",
+            reply_to=reply_to or "",
+            created_by=created_by,
+            status=OutboxStatus.SUPPRESSED if normalize("email", to) in blocked else OutboxStatus.QUEUED,
+            priority=priority,
+            scheduled_at=scheduled_at,
+        )
+        for to, context in (((to or "").strip(), context) for to, context in rows)
+    ), batch_size=batch_size)
+
+    if queued and getattr(settings, "COMMS_AUTOSEND_EMAIL", False):
+        nudge_email_dispatch()
+    return queued
+
+
+def _broadcast_context(row: dict, base: dict) -> dict:
+    full_name = f"{row['user__first_name'] or ''} {row['user__last_name'] or ''}".strip()
+    return {
+        **base,
+        "student_name": full_name or row["user__username"] or f"Roll {row['roll_number']}",
+        "roll": row["roll_number"],
+        "class_name": row["school_class__name"],
+        "section": row["section"],
+    }
+
+
+def _family_broadcast_context(rows: list[dict], base: dict) -> dict:
+    """One context for siblings sharing a contact: names joined, each child under `children`."""
+    children = [_broadcast_context(row, {}) for row in rows]
+    ctx = _broadcast_context(rows[0], base)
+    ctx["student_name"] = ", ".join(child["student_name"] for child in children)
+    ctx["children"] = children
+    ctx["child_count"] = len(children)
+    return ctx
+
+
+def broadcast(template, *, school_class=None, section=None, audience: str = "guardians", students=None,
+              context: dict | None = None, merge_siblings: bool | None = None, priority=OutboxPriority.BULK,
+              created_by=None, scheduled_at=None, batch_size: int = 500) -> dict:
+    """
+    Queue one MessageTemplate (instance or slug; its kind picks the channel)
+    for every reachable student of a class / section / StudentProfile queryset.
+    Recipients come from one join over StudentProfile (contacts.broadcast_recipients),
+    the template is compiled once (a syntax error fails before anything is
+    queued), SMS encoding/segments are filled in at enqueue, and rows go in
+    with chunked bulk_create. `context` is shared by every message (e.g. a
+    closure notice's date); per-student keys: student_name, roll, class_name, section.
+
+    Siblings sharing a contact get one message (merge_siblings, default
+    settings.COMMS_MERGE_SIBLINGS): the query sorts by recipient and
+    consecutive rows are merged; student_name lists every child and
+    `children` / `child_count` are added.
+
+    Returns {"students", "recipients", "queued", "suppressed", "segments"}.
+    """
+    if not isinstance(template, MessageTemplate):
+        template = MessageTemplate.objects.get(slug=template, is_active=True)
+    channel = template.kind
+    fields = ["body_text_template"] if channel == "sms" else ["subject_template", "body_text_template", "body_html_template"]
+    for field in fields:
+        compile_template(template, field)
+
+    if merge_siblings is None:
+        merge_siblings = getattr(settings, "COMMS_MERGE_SIBLINGS", True)
+    rows = broadcast_recipients(channel, school_class=school_class, section=section,
+                                audience=audience, students=students, by_recipient=merge_siblings)
+    base = dict(context or {})
+    scheduled_at = scheduled_at or timezone.now()
+    blocked = suppressed(channel) if _suppressible(priority) else frozenset()
+    stats = {"students": 0, "recipients": 0, "queued": 0, "suppressed": 0, "segments": 0}
+
+    def recipients():
+        """(to, context) per message, streaming the sorted rows."""
+        it = rows.iterator(chunk_size=batch_size)
+        if not merge_siblings:
+            for row in it:
+                stats["students"] += 1
+                yield row["recipient"], _broadcast_context(row, base)
+            return
+        for to, group in groupby(it, key=itemgetter("recipient")):
+            group = list(group)
+            stats["students"] += len(group)
+            yield to, (_broadcast_context(group[0], base) if len(group) == 1
+                       else _family_broadcast_context(group, base))
+
+    def sms_rows():
+        provider = getattr(settings, "SMS_PROVIDER", "console")
+        sender_id = getattr(settings, "SMS_SENDER_ID", "")
+        for to, ctx in recipients():
+            _body, encoding, segments = render_sms(template, ctx)
+            status = OutboxStatus.SUPPRESSED if to in blocked else OutboxStatus.QUEUED
+            stats["recipients"] += 1
+            if status == OutboxStatus.SUPPRESSED:
+                stats["suppressed"] += 1
+            else:
+                stats["segments"] += segments
+            yield SmsOutbox(
+                to=to, template=template, context=ctx, provider=provider, sender_id=sender_id,
+                status=status, priority=priority, encoding=encoding, segments=segments,
+                scheduled_at=scheduled_at, created_by=created_by,
+            )
+
+    def email_rows():
+        for to, ctx in recipients():
+            status = OutboxStatus.SUPPRESSED if normalize("email", to) in blocked else OutboxStatus.QUEUED
+            stats["recipients"] += 1
+            stats["suppressed"] += status == OutboxStatus.SUPPRESSED
+            yield EmailOutbox(
+                to=to, template=template, context=ctx,
+                status=status, priority=priority, scheduled_at=scheduled_at, created_by=created_by,
+            )
+
+    with transaction.atomic():
+        if channel == "sms":
+            _bulk_insert(SmsOutbox, sms_rows(), batch_size=batch_size)
+        else:
+            _bulk_insert(EmailOutbox, email_rows(), batch_size=batch_size)
+    stats["queued"] = stats["recipients"] - stats["suppressed"]
+
+    if channel == "email" and stats["queued"] and getattr(settings, "COMMS_AUTOSEND_EMAIL", False):
+        nudge_email_dispatch()
+    return stats
+
+
 def _backoff_delay(attempts: int) -> int:
     # 1, 2, 4, 8, 16, 32 mins up to max
     return min(32, 2 ** max(0, attempts - 1))
 
 
-def process_sms_batch(limit: int = 100) -> int:
-    now = timezone.now()
-    qs = SmsOutbox.objects.select_for_update(skip_locked=True).filter(
-        status__in=[OutboxStatus.QUEUED, OutboxStatus.FAILED],
-        scheduled_at__lte=timezone.now(),
-    ).order_by("scheduled_at")[:limit]
+def claim_lease_seconds() -> int:
+    """How long a claimed (SENDING) row belongs to its worker before others may reclaim it."""
+    return max(1, int(getattr(settings, "COMMS_CLAIM_LEASE_SECONDS", 600)))
+
+
+def _claim_batch(model, *, limit: int, ignore_throttle: bool = False, lane: str | None = None) -> list:
+    """
+    Lock up to `limit` due rows, highest priority first, mark suppressed
+    recipients SUPPRESSED (except HIGH rows), drop throttled (to, template) pairs using a single
+    grouped query and flip the rest to SENDING in one UPDATE. Only the
+    returned rows belong to this worker. lane="high" claims only HIGH rows,
+    which are never throttled (a resent login code must not wait); neither
+    are templates in COMMS_THROTTLE_EXEMPT_TEMPLATES.
 
-    count = 0
+    A claim is a lease stamped in claimed_at: SENDING rows whose lease is
+    older than COMMS_CLAIM_LEASE_SECONDS (default 600) were left by a worker
+    that died or failed before writing its results back, and are claimed again.
+    """
+    now = timezone.now()
+    channel = "sms" if model is SmsOutbox else "email"
+    blocked_to = suppressed(channel)
+    stale = now - timedelta(seconds=claim_lease_seconds())
+    due = model.objects.filter(
+        Q(status__in=[OutboxStatus.QUEUED, OutboxStatus.FAILED])
+        | Q(status=OutboxStatus.SENDING) & (Q(claimed_at__lt=stale) | Q(claimed_at__isnull=True)),
+        scheduled_at__lte=now,
+    )
+    if lane == "high":
+        due = due.filter(priority__gte=OutboxPriority.HIGH)
     with transaction.atomic():
-        for ob in qs:
-            # throttle per recipient+template
-            if throttle_guard_sms(ob.to, ob.template.slug):
+        rows = list(
+            due.select_for_update(skip_locked=True, of=("self",))
+            .select_related("template")
+            .order_by("-priority", "scheduled_at")[:limit]
+        )
+        skipped = [ob for ob in rows if _suppressible(ob.priority) and normalize(channel, ob.to) in blocked_to]
+        if skipped:
+            model.objects.filter(pk__in=[ob.pk for ob in skipped]).update(status=OutboxStatus.SUPPRESSED)
+            track_depth(channel, before=[ob.status for ob in skipped],
+                        after=[OutboxStatus.SUPPRESSED] * len(skipped))
+            for ob in skipped:
+                ob.status = OutboxStatus.SUPPRESSED
+            record_outbox(channel, skipped)
+            rows = [ob for ob in rows if ob.status != OutboxStatus.SUPPRESSED]
+        blocked = set() if ignore_throttle else throttled_pairs(model, rows)
+
+        # e.g. the site inbox gets a notification per contact-form message, however many
+        exempt = set(getattr(settings, "COMMS_THROTTLE_EXEMPT_TEMPLATES", ["contact_notification"]))
+
+        claimed = []
+        for ob in rows:
+            key = (ob.to, ob.template_id)
+            if ob.priority >= OutboxPriority.HIGH or ob.template.slug in exempt:
+                claimed.append(ob)
+                continue
+            if key in blocked:
                 continue
-            ob.status = OutboxStatus.SENDING
-            ob.save(update_fields=["status"])
+            if not ignore_throttle:
+                blocked.add(key)  # one message per recipient+template per batch
+            claimed.append(ob)
+
+        if claimed:
+            model.objects.filter(pk__in=[ob.pk for ob in claimed]).update(status=OutboxStatus.SENDING, claimed_at=now)
+            track_depth(channel, before=[ob.status for ob in claimed],
+                        after=[OutboxStatus.SENDING] * len(claimed))
+    for ob in claimed:
+        ob.status, ob.claimed_at = OutboxStatus.SENDING, now
+    return claimed
 
-    # process outside outer transaction to avoid long locks
-    for ob in SmsOutbox.objects.filter(status=OutboxStatus.SENDING).order_by("scheduled_at")[:limit]:
+
+# fields touched when a send attempt finishes (sent or failed)
+_RESULT_FIELDS = ["provider", "provider_ref", "status", "sent_at", "last_error", "attempts", "next_attempt_at", "scheduled_at"]
+
+
+def _mark_sent(ob, *, provider: str, ref: str) -> None:
+    ob.provider = provider
+    ob.provider_ref = (ref or "")[:120]
+    ob.status = OutboxStatus.SENT
+    ob.sent_at = timezone.now()
+    ob.last_error = ""
+
+
+def _mark_failed(ob, error: Exception) -> None:
+    ob.attempts += 1
+    delay = _backoff_delay(ob.attempts)
+    ob.next_attempt_at = timezone.now() + timedelta(minutes=delay)
+    ob.status = OutboxStatus.FAILED
+    ob.last_error = str(error)[:1000]
+    ob.scheduled_at = ob.next_attempt_at
+
+
+def _record_results(model, channel: str, rows: list, extra_fields=()) -> int:
+    """Write a finished batch back with one bulk_update + one bulk_create, then roll it up."""
+    if not rows:
+        return 0
+    model.objects.bulk_update(rows, _RESULT_FIELDS + list(extra_fields), batch_size=500)
+    track_depth(channel, before=[OutboxStatus.SENDING] * len(rows), after=[ob.status for ob in rows])
+    default_provider = "smtp" if channel == "email" else getattr(settings, "SMS_PROVIDER", "")
+    record_outbox(channel, rows, default_provider=default_provider)
+    CommsLog.objects.bulk_create(
+        [
+            CommsLog(
+                channel=channel,
+                recipient=ob.to,
+                template_slug=ob.template.slug,
+                status=ob.status,
+                detail=(ob.provider_ref if ob.status == OutboxStatus.SENT else ob.last_error),
+            )
+            for ob in rows
+        ],
+        batch_size=500,
+    )
+    return sum(1 for ob in rows if ob.status == OutboxStatus.SENT)
+
+
+def _sms_quota_room(limit: int) -> int:
+    """How many sends today's quotas still allow across the whole failover chain."""
+    room = 0
+    for provider in sms_providers():
+        left = daily_remaining(provider)
+        if left is None:
+            return limit
+        room += left
+    return min(limit, room)
+
+
+def process_sms_batch(limit: int = 100, lane: str | None = None) -> int:
+    # never claim more than the chain's remaining quota; send_sms reserves it
+    # per message on the provider that actually takes the send
+    allowed = _sms_quota_room(limit)
+    if not allowed:
+        return 0
+    claimed = _claim_batch(SmsOutbox, limit=allowed, lane=lane)
+
+    ready, payloads = [], []
+    for ob in claimed:
         try:
-            body = render_string(ob.template.body_text_template, ob.context)
-            provider, ref = send_sms(to=ob.to, sender_id=ob.sender_id, body=body)
-            ob.provider = provider
-            ob.provider_ref = ref
-            ob.status = OutboxStatus.SENT
-            ob.sent_at = timezone.now()
-            ob.last_error = ""
-            ob.save(update_fields=["provider", "provider_ref", "status", "sent_at", "last_error"])
-            CommsLog.objects.create(channel="sms", recipient=ob.to, template_slug=ob.template.slug, status="sent", detail=ref or "")
-            count += 1
+            body, ob.encoding, ob.segments = render_sms(ob.template, ob.context)
+            payloads.append({"to": ob.to, "sender_id": ob.sender_id, "body": body})
+            ready.append(ob)
         except Exception as e:
-            ob.attempts += 1
-            delay = _backoff_delay(ob.attempts)
-            ob.next_attempt_at = timezone.now() + timedelta(minutes=delay)
-            ob.status = OutboxStatus.FAILED
-            ob.last_error = str(e)[:1000]
-            ob.scheduled_at = ob.next_attempt_at
-            ob.save(update_fields=["attempts", "next_attempt_at", "status", "last_error", "scheduled_at"])
-            CommsLog.objects.create(channel="sms", recipient=ob.to, template_slug=ob.template.slug, status="failed", detail=ob.last_error)
-    return count
-
-def process_email_batch(limit: int = 100, ignore_throttle: bool = False) -> int:
-    now = timezone.now()
-    qs = EmailOutbox.objects.select_for_update(skip_locked=True).filter(
-        status__in=[OutboxStatus.QUEUED, OutboxStatus.FAILED],
-        scheduled_at__lte=now,
-    ).order_by("scheduled_at")[:limit]
+            _mark_failed(ob, e)
 
-    count = 0
-    with transaction.atomic():
-        for ob in qs:
-            # respect throttle unless explicitly ignored
-            if (not ignore_throttle) and throttle_guard_email(ob.to, ob.template.slug):
-                continue
-            ob.status = OutboxStatus.SENDING
-            ob.save(update_fields=["status"])
+    # concurrent sends over the pooled provider session (bounded by SMS_CONCURRENCY)
+    for ob, result in zip(ready, send_sms_batch(payloads)):
+        if isinstance(result, Exception):
+            _mark_failed(ob, result)
+        else:
+            provider, ref = result
+            _mark_sent(ob, provider=provider, ref=ref)
 
-    # process the ones moved to SENDING
-    for ob in EmailOutbox.objects.filter(status=OutboxStatus.SENDING).order_by("scheduled_at")[:limit]:
+    return _record_results(SmsOutbox, "sms", claimed, extra_fields=["encoding", "segments"])
+
+
+def process_email_batch(limit: int = 100, ignore_throttle: bool = False, lane: str | None = None) -> int:
+    allowed = reserve_daily("smtp", limit)
+    if not allowed:
+        return 0
+    claimed = _claim_batch(EmailOutbox, limit=allowed, ignore_throttle=ignore_throttle, lane=lane)
+    release_daily("smtp", allowed - len(claimed))
+
+    # render everything first; a broken template only fails its own row
+    ready, messages = [], []
+    for ob in claimed:
         try:
-            subject = render_string(ob.template.subject_template, ob.context)
-            body_text = render_string(ob.template.body_text_template, ob.context)
-            body_html = render_string(ob.template.body_html_template, ob.context) if ob.template.body_html_template else None
-            msg_id = send_email_smtp(
+            subject = render_template(ob.template, "subject_template", ob.context)
+            body_text = render_template(ob.template, "body_text_template", ob.context)
+            body_html = render_template(ob.template, "body_html_template", ob.context) or None
+            messages.append(build_email_message(
                 to=ob.to,
                 subject=subject,
                 body_text=body_text,
                 body_html=body_html,
                 from_email=(ob.from_email or None),
                 reply_to=(ob.reply_to or None),
-            )
-            ob.provider = "smtp"
-            ob.provider_ref = msg_id
-            ob.status = OutboxStatus.SENT
-            ob.sent_at = timezone.now()
-            ob.last_error = ""
-            ob.save(update_fields=["provider", "provider_ref", "status", "sent_at", "last_error"])
-            CommsLog.objects.create(channel="email", recipient=ob.to, template_slug=ob.template.slug, status="sent", detail=msg_id)
-            count += 1
+            ))
+            ready.append(ob)
         except Exception as e:
-            ob.attempts += 1
-            delay = _backoff_delay(ob.attempts)
-            ob.next_attempt_at = timezone.now() + timedelta(minutes=delay)
-            ob.status = OutboxStatus.FAILED
-            ob.last_error = str(e)[:1000]
-            ob.scheduled_at = ob.next_attempt_at
-            ob.save(update_fields=["attempts", "next_attempt_at", "status", "last_error", "scheduled_at"])
-            CommsLog.objects.create(channel="email", recipient=ob.to, template_slug=ob.template.slug, status="failed", detail=ob.last_error)
-    return count
-
+            _mark_failed(ob, e)
 
+    # one SMTP session for the whole claimed batch
+    for ob, msg, error in zip(ready, messages, send_email_batch(messages)):
+        if error is None:
+            _mark_sent(ob, provider="smtp", ref=msg.extra_headers["Message-ID"])
+        else:
+            _mark_failed(ob, error)
 
+    return _record_results(EmailOutbox, "email", claimed)
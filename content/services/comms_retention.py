@@ -0,0 +1,146 @@
+# content/services/comms_retention.py
+"""
+Retention for the insert-only comms tables.
+
+- CommsLog rows older than N days are rolled up into CommsDailyStat
+  (day × channel × template × status counts) and deleted.
+- Finished outbox rows (sent / failed / bounced / suppressed) and old
+  EmailBounce rows are appended to JSONL.gz archive files and deleted.
+- Per-minute metrics rollups (CommsMinuteStat) and webhook dedupe keys
+  (ProcessedGatewayEvent) past their age are deleted outright.
+
+Everything works in small primary-key chunks, each in its own short
+transaction, so the job never holds long locks on the live tables.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from content.models import (
+    CommsDailyStat, CommsLog, CommsMinuteStat, EmailBounce, EmailOutbox, OutboxStatus, ProcessedGatewayEvent,
+    SmsOutbox,
+)
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FINISHED_STATUSES = [OutboxStatus.SENT, OutboxStatus.FAILED, OutboxStatus.BOUNCED, OutboxStatus.SUPPRESSED]
+
+
+def archive_dir() -> str:
+    """
+    COMMS_ARCHIVE_DIR, else <BASE_DIR>/var/comms_archive (BASE_DIR defaulting to
+    the project root). Never under MEDIA_ROOT: the archives hold recipient
+    addresses and dues contexts, and /media/ is served to anyone.
+    """
+    configured = getattr(settings, "COMMS_ARCHIVE_DIR", None)
+    if configured:
+        return str(configured)
+    base = getattr(settings, "BASE_DIR", None) or _PROJECT_ROOT
+    return os.path.join(str(base), "var", "comms_archive")
+
+
+def _chunks(qs, chunk_size: int):
+    """Yield lists of primary keys, re-querying each time (rows are deleted as we go)."""
+    while True:
+        ids = list(qs.order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+
+
+def rollup_and_prune_log(*, older_than_days: int, chunk_size: int = 1000, dry_run: bool = False) -> int:
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    qs = CommsLog.objects.filter(when__lt=cutoff)
+    if dry_run:
+        return qs.count()
+
+    removed = 0
+    for ids in _chunks(qs, chunk_size):
+        with transaction.atomic():
+            grouped = (
+                CommsLog.objects.filter(pk__in=ids)
+                .annotate(day=TruncDate("when"))
+                .values("day", "channel", "template_slug", "status")
+                .annotate(n=Count("id"))
+                .order_by()
+            )
+            for g in grouped:
+                key = {k: g[k] for k in ("day", "channel", "template_slug", "status")}
+                if not CommsDailyStat.objects.filter(**key).update(count=F("count") + g["n"]):
+                    CommsDailyStat.objects.create(count=g["n"], **key)
+            removed += CommsLog.objects.filter(pk__in=ids).delete()[0]
+    return removed
+
+
+def archive_and_prune(model, *, date_field: str, older_than_days: int, statuses=None,
+                      chunk_size: int = 1000, dry_run: bool = False) -> int:
+    """Append matching rows of `model` to <archive_dir>/<table>-<stamp>.jsonl.gz, then delete them."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    qs = model.objects.filter(**{f"{date_field}__lt": cutoff})
+    if statuses:
+        qs = qs.filter(status__in=statuses)
+    if dry_run:
+        return qs.count()
+
+    removed = 0
+    path = None
+    fh = None
+    try:
+        for ids in _chunks(qs, chunk_size):
+            if fh is None:
+                os.makedirs(archive_dir(), exist_ok=True)
+                stamp = timezone.now().strftime("%Y%m%d-%H%M%S")
+                path = os.path.join(archive_dir(), f"{model._meta.db_table}-{stamp}.jsonl.gz")
+                fh = gzip.open(path, "at", encoding="utf-8")
+            rows = model.objects.filter(pk__in=ids).order_by("pk").values()
+            for row in rows:
+                fh.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n")
+            fh.flush()  # archived before the delete commits
+            with transaction.atomic():
+                removed += model.objects.filter(pk__in=ids).delete()[0]
+    finally:
+        if fh is not None:
+            fh.close()
+    return removed
+
+
+def prune_older(model, *, date_field: str, older_than_days: int, chunk_size: int = 1000,
+                dry_run: bool = False) -> int:
+    """Delete rows of `model` older than the cutoff (no archive), in primary-key chunks."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    qs = model.objects.filter(**{f"{date_field}__lt": cutoff})
+    if dry_run:
+        return qs.count()
+
+    removed = 0
+    for ids in _chunks(qs, chunk_size):
+        with transaction.atomic():
+            removed += model.objects.filter(pk__in=ids).delete()[0]
+    return removed
+
+
+def run_retention(*, log_days: int, outbox_days: int, bounce_days: int, minute_stat_days: int = 30,
+                  gateway_event_days: int = 90, chunk_size: int = 1000, dry_run: bool = False) -> dict:
+    """Returns {table label: rows removed (or that would be, with dry_run)}."""
+    return {
+        "CommsLog": rollup_and_prune_log(older_than_days=log_days, chunk_size=chunk_size, dry_run=dry_run),
+        "EmailOutbox": archive_and_prune(EmailOutbox, date_field="created_at", older_than_days=outbox_days,
+                                         statuses=FINISHED_STATUSES, chunk_size=chunk_size, dry_run=dry_run),
+        "SmsOutbox": archive_and_prune(SmsOutbox, date_field="created_at", older_than_days=outbox_days,
+                                       statuses=FINISHED_STATUSES, chunk_size=chunk_size, dry_run=dry_run),
+        "EmailBounce": archive_and_prune(EmailBounce, date_field="occurred_at", older_than_days=bounce_days,
+                                         chunk_size=chunk_size, dry_run=dry_run),
+        "CommsMinuteStat": prune_older(CommsMinuteStat, date_field="minute", older_than_days=minute_stat_days,
+                                       chunk_size=chunk_size, dry_run=dry_run),
+        "ProcessedGatewayEvent": prune_older(ProcessedGatewayEvent, date_field="created_at",
+                                             older_than_days=gateway_event_days, chunk_size=chunk_size,
+                                             dry_run=dry_run),
+    }
@@ -0,0 +1,109 @@
+# content/services/comms_suppression.py
+"""
+Suppression list: recipients we stop sending to.
+
+The CommsSuppression table is loaded into one frozenset per channel, kept in
+process memory. A version stamp in the cache says when it changed; every
+writer bumps the stamp and each process reloads on its next lookup. A
+membership test costs one cache.get plus an O(1) set lookup.
+"""
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from content.models import CommsLog, CommsSuppression
+from content.phones import canonical_sms_to
+
+VERSION_KEY = "comms:suppression:version"
+# CommsLog statuses written only by DLR ingestion (content.services.comms_events);
+# a send attempt that failed (timeout, open breaker, provider 5xx) logs "failed" and never counts
+DLR_FAILURE_STATUSES = ("undelivered", "dlr_failed")
+
+_lock = threading.Lock()
+_loaded = {"version": None, "email": frozenset(), "sms": frozenset()}
+
+
+def normalize(channel: str, address: str) -> str:
+    if channel == "sms":
+        return canonical_sms_to(address)
+    return (address or "").strip().lower()
+
+
+def bump_version() -> None:
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def _version() -> str:
+    version = cache.get(VERSION_KEY)
+    if version is None:  # cold cache: first process to look seeds a stamp
+        cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def suppressed(channel: str) -> frozenset:
+    """The current suppressed addresses for `channel`, reloaded only when the stamp moved."""
+    version = _version()
+    if _loaded["version"] != version:
+        with _lock:
+            if _loaded["version"] != version:
+                sets = {"email": set(), "sms": set()}
+                for ch, address in CommsSuppression.objects.values_list("channel", "address").iterator():
+                    sets.setdefault(ch, set()).add(address)
+                _loaded.update({ch: frozenset(v) for ch, v in sets.items()}, version=version)
+    return _loaded.get(channel, frozenset())
+
+
+def is_suppressed(channel: str, address: str) -> bool:
+    return normalize(channel, address) in suppressed(channel)
+
+
+def suppress(channel: str, addresses, *, reason: str = "manual") -> int:
+    """Add addresses (idempotent). Returns how many were new."""
+    wanted = {normalize(channel, a) for a in addresses} - {""}
+    if not wanted:
+        return 0
+    existing = set(
+        CommsSuppression.objects.filter(channel=channel, address__in=wanted).values_list("address", flat=True)
+    )
+    new = wanted - existing
+    if new:
+        CommsSuppression.objects.bulk_create(
+            [CommsSuppression(channel=channel, address=a, reason=reason[:120]) for a in sorted(new)],
+            batch_size=500, ignore_conflicts=True,
+        )
+        bump_version()
+    return len(new)
+
+
+def unsuppress(channel: str, addresses) -> int:
+    wanted = {normalize(channel, a) for a in addresses}
+    deleted = CommsSuppression.objects.filter(channel=channel, address__in=wanted).delete()[0]
+    if deleted:
+        bump_version()
+    return deleted
+
+
+def suppress_failing_numbers(numbers) -> int:
+    """
+    Suppress numbers whose delivery reports (not send attempts) failed at least
+    COMMS_SMS_SUPPRESS_AFTER_FAILURES times (default 3) within
+    COMMS_SMS_SUPPRESS_WINDOW_DAYS (default 30). One grouped query.
+    """
+    numbers = set(numbers)
+    if not numbers:
+        return 0
+    threshold = int(getattr(settings, "COMMS_SMS_SUPPRESS_AFTER_FAILURES", 3))
+    since = timezone.now() - timedelta(days=int(getattr(settings, "COMMS_SMS_SUPPRESS_WINDOW_DAYS", 30)))
+    failing = (
+        CommsLog.objects.filter(channel="sms", status__in=DLR_FAILURE_STATUSES,
+                                recipient__in=numbers, when__gte=since)
+        .values("recipient").annotate(n=Count("id")).filter(n__gte=threshold)
+        .values_list("recipient", flat=True)
+    )
+    return suppress("sms", failing, reason="dlr_failures")
@@ -1,8 +1,68 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
 from django.template import engines
 
 django_engine = engines["django"]
 
+# Compiled templates, shared by every render path in the process.
+#   MessageTemplate fields -> ("tpl", pk, updated_at, field)  (an edit bumps updated_at)
+#   ad-hoc strings         -> ("str", source)
+_compiled: "OrderedDict[tuple, object]" = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def _cache_size() -> int:
+    return int(getattr(settings, "COMMS_TEMPLATE_CACHE_SIZE", 256))
+
+
+def _get_or_compile(key: tuple, source: str):
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            return compiled
+
+    compiled = django_engine.from_string(source)  # parse outside the lock
+
+    with _compiled_lock:
+        _compiled[key] = compiled
+        _compiled.move_to_end(key)
+        while len(_compiled) > _cache_size():
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def clear_template_cache() -> None:
+    with _compiled_lock:
+        _compiled.clear()
+
+
+def compile_template(tpl, field: str):
+    """Compiled template for one field of a MessageTemplate (e.g. "subject_template"), or None if blank."""
+    source = getattr(tpl, field, "") or ""
+    if not source:
+        return None
+    if tpl.pk is None:  # unsaved: nothing stable to key on
+        return django_engine.from_string(source)
+    return _get_or_compile(("tpl", tpl.pk, tpl.updated_at, field), source)
+
+
+def render_template(tpl, field: str, context: dict) -> str:
+    compiled = compile_template(tpl, field)
+    return compiled.render(context or {}) if compiled else ""
+
+
+def render_many(tpl, field: str, contexts) -> list[str]:
+    """Render one MessageTemplate field against many contexts, compiling it once."""
+    compiled = compile_template(tpl, field)
+    if compiled is None:
+        return ["" for _ in contexts]
+    return [compiled.render(ctx or {}) for ctx in contexts]
+
+
 def render_string(template_str: str, context: dict) -> str:
     if not template_str:
         return ""
-    return django_engine.from_string(template_str).render(context)
+    return _get_or_compile(("str", template_str), template_str).render(context)
@@ -0,0 +1,68 @@
+# content/services/contacts.py
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce, Lower, NullIf, Trim
+
+from content.models import StudentProfile
+
+
+def student_sms_phones(*, user_ids=None, school_class=None, section=None) -> dict[int, str]:
+    """
+    {user_id: E.164 number} for students with a usable number (guardian's
+    first, then the student's own), in one query over StudentProfile's
+    stored E.164 columns. Filter by user ids and/or a class (+ section).
+    """
+    qs = StudentProfile.objects.filter(user__isnull=False).exclude(phone_e164="", guardian_phone_e164="")
+    if user_ids is not None:
+        qs = qs.filter(user_id__in=list(user_ids))
+    if school_class is not None:
+        qs = qs.filter(school_class=school_class)
+    if section:
+        qs = qs.filter(section=section)
+    return dict(
+        qs.annotate(sms_to=Coalesce(NullIf("guardian_phone_e164", Value("")), NullIf("phone_e164", Value(""))))
+        .values_list("user_id", "sms_to")
+        .order_by()
+    )
+
+
+def profiles_with_phone(phone: str):
+    """Profiles whose student or guardian number is `phone` (E.164) — both columns are indexed."""
+    return StudentProfile.objects.filter(Q(phone_e164=phone) | Q(guardian_phone_e164=phone))
+
+
+BROADCAST_AUDIENCES = ("guardians", "students")
+
+
+def broadcast_recipients(channel: str, *, school_class=None, section=None, audience: str = "guardians",
+                         students=None, by_recipient: bool = False):
+    """
+    One query (StudentProfile joined to user and class) yielding a dict per
+    reachable student: recipient, user_id, roll_number, section,
+    school_class__name and the user's name fields. SMS go to the guardian's
+    number first (audience="guardians") or only to the student's own
+    (audience="students"); email goes to the student account's address
+    (lower-cased). `students` narrows an existing StudentProfile queryset
+    instead of all. With `by_recipient`, rows are sorted by recipient so
+    siblings sharing a contact are consecutive.
+    """
+    if audience not in BROADCAST_AUDIENCES:
+        raise ValueError(f"Unknown audience {audience!r}")
+    qs = StudentProfile.objects.all() if students is None else students
+    if school_class is not None:
+        qs = qs.filter(school_class=school_class)
+    if section:
+        qs = qs.filter(section__iexact=section)
+    if channel == "sms" and audience == "students":
+        recipient = NullIf("phone_e164", Value(""))
+    elif channel == "sms":
+        recipient = Coalesce(NullIf("guardian_phone_e164", Value("")), NullIf("phone_e164", Value("")))
+    else:
+        recipient = NullIf(Lower(Trim("user__email")), Value(""))
+    ordering = ("school_class", "section", "roll_number")
+    return (
+        qs.annotate(recipient=recipient)
+        .filter(recipient__isnull=False)
+        .values("recipient", "user_id", "roll_number", "section", "school_class__name",
+                "user__username", "user__first_name", "user__last_name")
+        .order_by(*(("recipient",) + ordering if by_recipient else ordering))
+    )
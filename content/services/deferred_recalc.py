@@ -0,0 +1,48 @@
+# content/services/deferred_recalc.py
+"""
+Coalesced "recompute the parent" work for row-level signals.
+
+Saving 12 subject rows used to recompute the marksheet 12 times (24 with the
+duplicate receiver). Receivers now call mark_dirty(): the parent id goes into
+a per-transaction set and, on commit, ONE recompute covers every dirty
+parent at once. Outside a transaction (autocommit) the recompute runs
+immediately, as before.
+"""
+import threading
+
+from django.db import transaction
+
+_local = threading.local()
+
+
+def mark_dirty(key: str, pk, recompute, *, using=None) -> None:
+    """
+    Queue `pk` for `recompute(ids)`, which runs once per transaction for all
+    ids marked under the same `key`.
+
+    Every mark registers its own on_commit callback and they share one dirty
+    set: the first callback that survives to the commit drains the set, the
+    rest find it empty. A rolled-back savepoint only drops its own callbacks,
+    so nothing marked outside it is lost. Ids left behind by a transaction that
+    rolled back entirely are recomputed with the next commit; recomputing an
+    unchanged parent is harmless.
+    """
+    if pk is None:
+        return
+    conn = transaction.get_connection(using)
+    if not conn.in_atomic_block:
+        recompute({pk})
+        return
+
+    pending = getattr(_local, "pending", None)
+    if pending is None:
+        pending = _local.pending = {}
+    slot_key = (conn.alias, key)
+    pending.setdefault(slot_key, set()).add(pk)
+
+    def flush():
+        ids = pending.pop(slot_key, None)
+        if ids:
+            recompute(ids)
+
+    transaction.on_commit(flush, using=conn.alias)
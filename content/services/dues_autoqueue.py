@@ -1,77 +1,221 @@
 # content/services/dues_autoqueue.py
 from datetime import timedelta
 from decimal import Decimal
-from django.db.models import F
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Value
+from django.db.models.functions import Coalesce, Lower, NullIf, Trim
 from django.utils import timezone
 
 from content.models import TuitionInvoice, CommsLog
-from content.services.comms_outbox import queue_email
+from content.services.comms_outbox import bulk_queue_email
 
-def queue_overdue_dues_emails(*, template_slug: str = "dues_notice_email",
-                              throttle_minutes: int = 60) -> int:
-    """
-    Find invoices that are due and unpaid, and queue one email per invoice,
-    unless we recently emailed the same recipient with the same template.
-    Returns count of emails queued.
+_ROW_FIELDS = (
+    "id", "kind", "title", "period_year", "period_month", "due_date", "amount_due",
+    "student_id", "student__username", "student__first_name", "student__last_name", "student__email",
+)
+
+
+def merge_siblings_default() -> bool:
+    """One message per guardian contact listing every child (settings.COMMS_MERGE_SIBLINGS, default on)."""
+    return bool(getattr(settings, "COMMS_MERGE_SIBLINGS", True))
+
+
+def _recipient_expr(channel: str):
+    """The normalised contact of an invoice's student, in SQL: guardian's E.164 first for SMS."""
+    if channel == "sms":
+        return Coalesce(
+            NullIf("student__student_profile__guardian_phone_e164", Value("")),
+            NullIf("student__student_profile__phone_e164", Value("")),
+        )
+    return NullIf(Lower(Trim("student__email")), Value(""))
+
+
+def overdue_invoice_rows(*, due_by=None, limit=None, exclude_notified=None, recipient=None):
     """
-    now = timezone.now()
-    today = timezone.localdate()
+    One query for every unpaid invoice with what a notice needs: student
+    name/email, period and the amount still due (computed in SQL).
 
-    # Unpaid & due (monthly or custom)
+    due_by:           only invoices with a due_date on/before this date
+    exclude_notified: optional (template_slug, since) — anti-join away students
+                      whose email already got that template since `since`.
+    recipient:        "sms" / "email": add the normalised contact as `recipient`,
+                      drop rows without one and sort by it, so siblings sharing a
+                      guardian contact come out consecutively (see family_notices).
+    """
     qs = (
         TuitionInvoice.objects
-        .select_related("student")
         .filter(tuition_amount__gt=F("paid_amount"))
-        .filter(due_date__isnull=False, due_date__lte=today)
+        .annotate(amount_due=ExpressionWrapper(
+            F("tuition_amount") - F("paid_amount"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ))
         .order_by("-period_year", "-period_month", "-id")
     )
-
-    throttle_window = now - timedelta(minutes=throttle_minutes)
-    queued = 0
-
-    for inv in qs:
-        student = inv.student
-        to_email = (getattr(student, "email", "") or "").strip()
-        if not to_email:
-            continue
-
-        # Has a recent sent email for this recipient+template?
-        recently_sent = CommsLog.objects.filter(
-            channel="email",
-            status="sent",
-            recipient=to_email,
-            template_slug=template_slug,
-            when__gte=throttle_window,
-        ).exists()
-        if recently_sent:
-            continue
-
-        amount = inv.tuition_amount or Decimal("0")
-        paid   = inv.paid_amount or Decimal("0")
-        due    = amount - paid
-        if due <= 0:
-            continue
-
-        ctx = {
-            "student_name": (getattr(student, "get_full_name", lambda: "")() or student.username),
-            "amount_due": f"{due:.2f}",
-            "due_date": inv.due_date.isoformat() if inv.due_date else "—",
-            "period": (
-                f"{inv.period_year}-{int(inv.period_month):02d}"
-                if inv.kind == "monthly" and inv.period_year and inv.period_month
-                else (inv.title or "Invoice")
-            ),
-        }
-
-        queue_email(
-            to=to_email,
-            template_slug=template_slug,  # must exist in admin with Kind="email"
-            context=ctx,
-            # from_email / reply_to optional:
-            # from_email="Accounts <accounts@yourdomain.tld>",
-            # reply_to="accounts@yourdomain.tld",
+    fields = _ROW_FIELDS
+    if recipient:
+        qs = (
+            qs.annotate(recipient=_recipient_expr(recipient))
+            .filter(recipient__isnull=False)
+            .order_by("recipient", "student_id", "-period_year", "-period_month", "-id")
         )
-        queued += 1
+        fields += ("recipient",)
+    if due_by is not None:
+        qs = qs.filter(due_date__isnull=False, due_date__lte=due_by)
+    if exclude_notified:
+        template_slug, since = exclude_notified
+        qs = qs.filter(~Exists(
+            CommsLog.objects.filter(
+                channel="email",
+                status="sent",
+                template_slug=template_slug,
+                when__gte=since,
+                recipient=OuterRef("recipient" if recipient == "email" else "student__email"),
+            )
+        ))
+    qs = qs.values(*fields)
+    return qs[:limit] if limit else qs
+
+
+def dues_notice_context(row: dict) -> dict:
+    """Template context for one overdue_invoice_rows() row."""
+    full_name = f"{row['student__first_name'] or ''} {row['student__last_name'] or ''}".strip()
+    return {
+        "student_name": full_name or row["student__username"],
+        "amount_due": f"{row['amount_due']:.2f}",
+        "due_date": row["due_date"].isoformat() if row["due_date"] else "—",
+        "period": (
+            f"{row['period_year']}-{int(row['period_month']):02d}"
+            if row["kind"] == "monthly" and row["period_year"] and row["period_month"]
+            else (row["title"] or "Invoice")
+        ),
+    }
+
+
+def dues_digest_context(rows: list[dict]) -> dict:
+    """
+    One context for ALL of a student's overdue invoices. Keeps the per-invoice
+    keys (amount_due = total, period = joined labels, due_date = earliest) so
+    existing templates still read well; digest-aware templates can loop
+    `{% for item in items %}` and use `total_due` / `invoice_count`.
+    """
+    items = [dues_notice_context(row) for row in rows]
+    total = sum((row["amount_due"] for row in rows), Decimal("0"))
+    due_dates = sorted(row["due_date"] for row in rows if row["due_date"])
+    return {
+        "student_name": items[0]["student_name"],
+        "items": [{k: it[k] for k in ("period", "amount_due", "due_date")} for it in items],
+        "invoice_count": len(items),
+        "total_due": f"{total:.2f}",
+        "amount_due": f"{total:.2f}",
+        "period": ", ".join(it["period"] for it in items),
+        "due_date": due_dates[0].isoformat() if due_dates else "—",
+    }
+
+
+def family_dues_context(rows: list[dict]) -> dict:
+    """
+    One context for every overdue invoice of every child behind one guardian
+    contact (rows ordered by student). A single child reads exactly like the
+    digest; with siblings, student_name joins the names, each item carries its
+    student_name and `children` holds one digest per child.
+    """
+    children = [
+        dues_digest_context(list(group)) for _student_id, group in groupby(rows, key=itemgetter("student_id"))
+    ]
+    ctx = dues_digest_context(rows)
+    if len(children) > 1:
+        ctx["student_name"] = ", ".join(child["student_name"] for child in children)
+        ctx["items"] = [
+            {**item, "student_name": child["student_name"]} for child in children for item in child["items"]
+        ]
+    ctx["children"] = children
+    ctx["child_count"] = len(children)
+    return ctx
 
+
+def family_notices(rows):
+    """
+    Yield (to, context) once per guardian contact for overdue_invoice_rows(recipient=...)
+    rows. The query already sorted them by contact, so this only walks
+    consecutive runs; nothing is held beyond one family's invoices.
+    """
+    for to, group in groupby(rows, key=itemgetter("recipient")):
+        yield to, family_dues_context(list(group))
+
+
+def first_families(rows, limit=None) -> list[dict]:
+    """
+    The rows of the first `limit` guardian contacts of overdue_invoice_rows(recipient=...),
+    so a limit never splits a family. Pass an iterator to stop reading at the cut.
+    """
+    out = []
+    for n, (_to, group) in enumerate(groupby(rows, key=itemgetter("recipient"))):
+        if limit and n >= limit:
+            break
+        out.extend(group)
+    return out
+
+
+def dues_notices(rows, recipient, *, digest: bool):
+    """
+    Yield (to, context) for rows with a recipient — one per invoice, or in
+    digest mode one per (recipient, student) with every overdue invoice listed.
+    `recipient` maps a row to an address (or None to skip it).
+    """
+    if not digest:
+        for row in rows:
+            to = recipient(row)
+            if to:
+                yield to, dues_notice_context(row)
+        return
+
+    groups: dict[tuple, list[dict]] = {}
+    for row in rows:
+        to = recipient(row)
+        if to:
+            groups.setdefault((to, row["student_id"]), []).append(row)
+    for (to, _student_id), group in groups.items():
+        yield to, dues_digest_context(group)
+
+
+def _row_email(row) -> str:
+    return (row["student__email"] or "").strip()
+
+
+def queue_overdue_dues_emails(*, template_slug: str = "dues_notice_email",
+                              throttle_minutes: int = 60, digest: bool | None = None,
+                              merge_siblings: bool | None = None, stats: dict | None = None) -> int:
+    """
+    Find invoices that are due and unpaid, and queue one email per invoice
+    (or one digest per student when `digest` / settings.DUES_DIGEST is on, or
+    one per email address covering every child when `merge_siblings` /
+    settings.COMMS_MERGE_SIBLINGS is on; a merged notice is already a digest,
+    so `digest` changes nothing then), unless we recently emailed the same
+    recipient with the same template.
+    Returns count of emails queued; `stats`, if given, receives
+    invoices / messages / saved (vs. per-invoice mode).
+
+    Set-based: one query for the eligible rows (throttle applied as an
+    anti-join), one template lookup, chunked bulk_create for the outbox.
+    """
+    if digest is None:
+        digest = getattr(settings, "DUES_DIGEST", False)
+    if merge_siblings is None:
+        merge_siblings = merge_siblings_default()
+    now = timezone.now()
+    rows = list(overdue_invoice_rows(
+        due_by=timezone.localdate(),
+        exclude_notified=(template_slug, now - timedelta(minutes=throttle_minutes)),
+        recipient="email" if merge_siblings else None,
+    ))
+    queued = bulk_queue_email(
+        template_slug=template_slug,  # must exist in admin with Kind="email"
+        rows=family_notices(rows) if merge_siblings else dues_notices(rows, _row_email, digest=digest),
+    )
+    if stats is not None:
+        invoices = sum(1 for row in rows if _row_email(row))
+        stats.update(invoices=invoices, messages=queued, saved=invoices - queued)
     return queued
-    
\ No newline at end of file
@@ -1,8 +1,16 @@
 from __future__ import annotations
+import smtplib
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid
 
-def send_email_smtp(*, to: str, subject: str, body_text: str, body_html: str | None = None, from_email: str | None = None, reply_to: str | None = None) -> str:
+from .rate_limit import acquire
+
+# errors that mean "the session is gone" -> reconnect and retry the message once
+_RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def build_email_message(*, to: str, subject: str, body_text: str, body_html: str | None = None, from_email: str | None = None, reply_to: str | None = None, connection=None) -> EmailMultiAlternatives:
     from_email = from_email or settings.DEFAULT_FROM_EMAIL
     reply_to_list = [reply_to or settings.EMAIL_REPLY_TO] if (reply_to or getattr(settings, "EMAIL_REPLY_TO", None)) else None
     msg = EmailMultiAlternatives(
@@ -11,9 +19,57 @@ def send_email_smtp(*, to: str, subject: str, body_text: str, body_html: str | N
         from_email=from_email,
         to=[to],
         reply_to=reply_to_list,
+        connection=connection,
+        # set our own Message-Id so it can be stored as provider_ref
+        headers={"Message-ID": make_msgid()},
     )
     if body_html:
         msg.attach_alternative(body_html, "text/html")
-    msg_id = msg.send(fail_silently=False)
-    # Django's SMTP backend doesn't expose Message-Id directly; store int return
-    return str(msg_id)  # best-effort
+    return msg
+
+
+def send_email_smtp(*, to: str, subject: str, body_text: str, body_html: str | None = None, from_email: str | None = None, reply_to: str | None = None, connection=None) -> str:
+    msg = build_email_message(
+        to=to, subject=subject, body_text=body_text, body_html=body_html,
+        from_email=from_email, reply_to=reply_to, connection=connection,
+    )
+    acquire("smtp")
+    msg.send(fail_silently=False)
+    return msg.extra_headers["Message-ID"]
+
+
+def send_email_batch(messages: list[EmailMultiAlternatives], *, connection=None) -> list[Exception | None]:
+    """
+    Deliver many messages over ONE connection (one TCP/TLS handshake + login).
+    If the server drops the session mid-batch we reconnect and retry that
+    message once. Sends are paced by the "smtp" entry of COMMS_RATE_LIMITS.
+    Returns one entry per message: None on success, else the error.
+    """
+    results: list[Exception | None] = []
+    if not messages:
+        return results
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for msg in messages:
+            acquire("smtp")
+            try:
+                try:
+                    connection.send_messages([msg])
+                except _RECONNECT_ERRORS:
+                    connection.close()
+                    connection.open()
+                    connection.send_messages([msg])
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+    except Exception as e:
+        # could not connect at all: every message not yet attempted failed the same way
+        results.extend([e] * (len(messages) - len(results)))
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return results
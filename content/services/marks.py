@@ -0,0 +1,217 @@
+# content/services/marks.py
+"""
+Set-based marks entry for StudentMarksheet / StudentMarksheetItem.
+
+marks_grid()          class x subject matrix for one exam term (3 queries)
+apply_grid_changes()  a batch of edited cells in one transaction, with
+                      optimistic concurrency on StudentMarksheetItem.version
+recalc_marksheets()   totals for many marksheets from one grouped aggregate
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from content.models import StudentMarksheet, StudentMarksheetItem, Subject, _subject_grade_from_marks
+
+from .results import results_changed
+
+TOTAL_FIELDS = ["total_marks", "total_pct", "total_grade", "is_pass", "updated_at"]
+
+
+class MarksGridError(Exception):
+    """Invalid cells; `errors` is a list of {"marksheet", "subject", "error"}."""
+
+    def __init__(self, errors: list[dict]):
+        super().__init__(f"{len(errors)} invalid cell(s)")
+        self.errors = errors
+
+
+class MarksGridConflict(MarksGridError):
+    """Cells changed by someone else since they were read; `errors` carries the current values."""
+
+
+def recalc_marksheets(ids) -> int:
+    """
+    Recompute total / grade / pass of every marksheet in `ids` from ONE
+    grouped SUM over their items, then write them back with one bulk_update.
+    """
+    ids = set(ids)
+    if not ids:
+        return 0
+    sums = {
+        row["marksheet_id"]: row
+        for row in StudentMarksheetItem.objects.filter(marksheet_id__in=ids)
+        .values("marksheet_id")
+        .annotate(total=Sum("marks_obtained"), max_total=Sum("max_marks"))
+        .order_by()
+    }
+    now = timezone.now()
+    sheets = list(StudentMarksheet.objects.filter(pk__in=ids).select_related("term"))
+    for ms in sheets:
+        row = sums.get(ms.pk) or {}
+        ms.apply_totals(row.get("total") or Decimal("0"), row.get("max_total") or Decimal("0"))
+        ms.updated_at = now
+    StudentMarksheet.objects.bulk_update(sheets, TOTAL_FIELDS, batch_size=500)
+    for class_id, term_id in {(ms.school_class_id, ms.term_id) for ms in sheets if ms.is_published}:
+        results_changed(class_id, term_id)
+    return len(sheets)
+
+
+def _subjects(school_class):
+    return list(Subject.objects.filter(school_class=school_class, is_active=True).order_by("order", "name"))
+
+
+def _marksheets(school_class, term, section=None):
+    qs = StudentMarksheet.objects.filter(school_class=school_class, term=term)
+    if section:
+        qs = qs.filter(section__iexact=section)
+    return qs
+
+
+def marks_grid(school_class, term, *, section=None) -> dict:
+    """
+    {"subjects": [...], "rows": [{marksheet, student, roll, section, total, grade,
+     "cells": {subject_id: {"item", "marks", "max", "version"}}}]}.
+    One query each for subjects, marksheets and items.
+    """
+    subjects = _subjects(school_class)
+    sheets = list(
+        _marksheets(school_class, term, section)
+        .order_by("section", "roll_number", "student_full_name")
+        .values("id", "student_full_name", "roll_number", "section", "total_marks", "total_grade")
+    )
+    cells: dict[int, dict] = {}
+    for item in (
+        StudentMarksheetItem.objects.filter(marksheet_id__in=[s["id"] for s in sheets])
+        .values("id", "marksheet_id", "subject_id", "marks_obtained", "max_marks", "version")
+    ):
+        cells.setdefault(item["marksheet_id"], {})[item["subject_id"]] = {
+            "item": item["id"],
+            "marks": str(item["marks_obtained"]),
+            "max": str(item["max_marks"]),
+            "version": item["version"],
+        }
+    return {
+        "class": school_class.pk,
+        "term": term.pk,
+        "subjects": [{"id": s.pk, "name": s.name} for s in subjects],
+        "rows": [
+            {
+                "marksheet": s["id"],
+                "student": s["student_full_name"],
+                "roll": s["roll_number"],
+                "section": s["section"],
+                "total": str(s["total_marks"]),
+                "grade": s["total_grade"],
+                "cells": cells.get(s["id"], {}),
+            }
+            for s in sheets
+        ],
+    }
+
+
+def _decimal(value, field: str) -> Decimal:
+    try:
+        d = Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"{field} must be a number")
+    if not d.is_finite() or d < 0:
+        raise ValueError(f"{field} must be a non-negative number")
+    return d.quantize(Decimal("0.01"))
+
+
+def apply_grid_changes(school_class, term, cells: list[dict]) -> dict:
+    """
+    Apply edited cells: [{"marksheet", "subject", "marks", "max"?, "version"}].
+    `version` is the one the client read (null/0 for a cell with no item yet).
+    All or nothing: invalid cells raise MarksGridError, stale versions raise
+    MarksGridConflict, otherwise one bulk_update + one bulk_create and each
+    affected marksheet is recalculated exactly once.
+    Returns {"updated", "created", "marksheets", "cells": [new item ids / versions]}.
+    """
+    subject_order = {s.pk: s.order for s in _subjects(school_class)}
+    errors, wanted = [], {}
+    for cell in cells:
+        key = (cell.get("marksheet"), cell.get("subject"))
+        try:
+            key = (int(key[0]), int(key[1]))
+            if key[1] not in subject_order:
+                raise ValueError("subject is not taught in this class")
+            marks = _decimal(cell.get("marks"), "marks")
+            max_marks = _decimal(cell["max"], "max") if cell.get("max") not in (None, "") else None
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"marksheet": key[0], "subject": key[1], "error": str(e)})
+            continue
+        wanted[key] = (marks, max_marks, int(cell.get("version") or 0))
+
+    with transaction.atomic():
+        sheet_ids = set(
+            _marksheets(school_class, term).filter(pk__in={k[0] for k in wanted}).values_list("pk", flat=True)
+        )
+        items = {
+            (it.marksheet_id, it.subject_id): it
+            for it in StudentMarksheetItem.objects.select_for_update()
+            .filter(marksheet_id__in=sheet_ids, subject_id__in={k[1] for k in wanted})
+        }
+        conflicts, to_update, to_create = [], [], []
+        for (sheet_id, subject_id), (marks, max_marks, version) in wanted.items():
+            if sheet_id not in sheet_ids:
+                errors.append({"marksheet": sheet_id, "subject": subject_id,
+                               "error": "marksheet is not in this class and term"})
+                continue
+            item = items.get((sheet_id, subject_id))
+            if (item.version if item else 0) != version:
+                conflicts.append({
+                    "marksheet": sheet_id, "subject": subject_id, "error": "changed by someone else",
+                    "current": item and {"marks": str(item.marks_obtained), "max": str(item.max_marks),
+                                         "version": item.version},
+                })
+                continue
+            if item is None:
+                item = StudentMarksheetItem(marksheet_id=sheet_id, subject_id=subject_id,
+                                            order=subject_order[subject_id], version=1)
+                to_create.append(item)
+            else:
+                item.version += 1
+                to_update.append(item)
+            item.marks_obtained = marks
+            if max_marks is not None:
+                item.max_marks = max_marks
+            if item.marks_obtained > item.max_marks:
+                errors.append({"marksheet": sheet_id, "subject": subject_id, "error": "marks exceed max"})
+            item.grade_letter = _subject_grade_from_marks(item.marks_obtained, item.max_marks)
+
+        if errors:
+            raise MarksGridError(errors)
+        if conflicts:
+            raise MarksGridConflict(conflicts)
+
+        now = timezone.now()
+        for item in to_update:
+            item.updated_at = now
+        StudentMarksheetItem.objects.bulk_update(
+            to_update, ["marks_obtained", "max_marks", "grade_letter", "version", "updated_at"], batch_size=500
+        )
+        try:
+            with transaction.atomic():
+                StudentMarksheetItem.objects.bulk_create(to_create, batch_size=500)
+        except IntegrityError:  # another writer created one of these cells first
+            raise MarksGridConflict([
+                {"marksheet": it.marksheet_id, "subject": it.subject_id, "error": "changed by someone else",
+                 "current": None}
+                for it in to_create
+            ])
+        touched = {item.marksheet_id for item in to_update + to_create}
+        recalc_marksheets(touched)
+
+    return {
+        "updated": len(to_update),
+        "created": len(to_create),
+        "marksheets": len(touched),
+        "cells": [
+            {"marksheet": it.marksheet_id, "subject": it.subject_id, "item": it.pk, "version": it.version}
+            for it in to_update + to_create
+        ],
+    }
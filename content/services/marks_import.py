@@ -0,0 +1,348 @@
+# content/services/marks_import.py
+"""
+Streaming marks import from CSV / XLSX.
+
+The header row picks the layout:
+  long   roll, [section], [name], subject, marks, [max]       one row per subject mark
+  wide   roll, [section], [name], <subject>, <subject>, ...   one row per student
+
+The marksheets of the class + term, the class roster and the subject list are
+loaded once. The file is then read row by row and written in chunks, each
+chunk costing one lookup query, one bulk_update and one bulk_create. Memory
+is bounded by the class, not the file: besides one chunk of pending marks, the
+import holds the class's marksheet lookups and the ids of the marksheets it
+touched or created, which grow with the number of students. Bad rows / cells
+go to the error report and are skipped. At the end, the totals of every
+touched marksheet are recomputed once.
+
+target "content"      StudentMarksheet / StudentMarksheetItem  (class: AcademicClass, term: ExamTerm)
+target "reportcards"  reportcards Marksheet / MarkRow          (class: Grade, term: Term)
+"""
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from content.models import StudentMarksheet, StudentMarksheetItem, StudentProfile, Subject, _subject_grade_from_marks
+
+from .marks import recalc_marksheets
+
+ID_COLUMNS = {"roll", "section", "name"}
+_ALIASES = {
+    "roll no": "roll", "roll_no": "roll", "roll_number": "roll",
+    "student": "name", "student_name": "name", "student_full_name": "name",
+    "marks_obtained": "marks", "obtained": "marks",
+    "max_marks": "max", "out_of": "max",
+}
+
+
+class MarksImportError(Exception):
+    """The file as a whole cannot be imported (unreadable, no usable header...)."""
+
+
+# ---------------------------------------------------------------------------
+# Targets
+# ---------------------------------------------------------------------------
+class _ContentTarget:
+    sheet_model = StudentMarksheet
+    item_model = StudentMarksheetItem
+    class_field = "school_class"
+    name_field = "student_full_name"
+    item_fields = ["marks_obtained", "max_marks", "grade_letter", "version", "updated_at"]
+
+    def subjects(self, klass):
+        return Subject.objects.filter(school_class=klass, is_active=True).values_list("pk", "name", "order")
+
+    def roster(self, klass) -> dict:
+        """(section, roll) -> (student name, section) for every StudentProfile of the class."""
+        roster = {}
+        for section, roll, first, last, username in StudentProfile.objects.filter(school_class=klass).values_list(
+            "section", "roll_number", "user__first_name", "user__last_name", "user__username"
+        ):
+            roster[(_fold(section), str(roll))] = (f"{first or ''} {last or ''}".strip() or username or "", section or "")
+        return roster
+
+    def grade(self, marks, max_marks) -> str:
+        return _subject_grade_from_marks(marks, max_marks)
+
+    def touch(self, item, now) -> None:
+        item.version = (item.version or 0) + 1 if item.pk else 1
+        item.updated_at = now
+
+    def recalc(self, ids) -> int:
+        return recalc_marksheets(ids)
+
+
+class _ReportcardsTarget:
+    class_field = "grade"
+    name_field = "student_name"
+    item_fields = ["marks_obtained", "max_marks", "grade_letter"]
+
+    def __init__(self):
+        from reportcards.models import GradeSubject, Marksheet, MarkRow, _letter_and_gpa
+        from reportcards.signals import marks_changed
+
+        self.sheet_model, self.item_model, self.subject_model = Marksheet, MarkRow, GradeSubject
+        self._letter_and_gpa, self._recalc = _letter_and_gpa, marks_changed
+
+    def subjects(self, klass):
+        return self.subject_model.objects.filter(grade=klass, is_active=True).values_list("pk", "name", "order")
+
+    def roster(self, klass):
+        return None  # no student roster in reportcards: rows with a name create their marksheet
+
+    def grade(self, marks, max_marks) -> str:
+        pct = float(marks) * 100.0 / float(max_marks) if max_marks else 0.0
+        return self._letter_and_gpa(pct)[0]
+
+    def touch(self, item, now) -> None:
+        pass
+
+    def recalc(self, ids) -> int:
+        return self._recalc(ids)  # totals + merit positions + cached PDFs
+
+
+TARGETS = {"content": _ContentTarget, "reportcards": _ReportcardsTarget}
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # spreadsheets store roll 12 as 12.0
+    return str(value).strip()
+
+
+def read_rows(fileobj, filename: str = ""):
+    """Yield (line number, [cells]) from a CSV or XLSX file, header included."""
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise MarksImportError("XLSX import needs openpyxl (pip install openpyxl); or save the sheet as CSV.")
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            for n, row in enumerate(wb.active.iter_rows(values_only=True), start=1):
+                yield n, [_cell(v) for v in row]
+        finally:
+            wb.close()
+        return
+    text = fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    try:
+        for row in reader:
+            yield reader.line_num, [_cell(v) for v in row]
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise MarksImportError(f"Line {reader.line_num}: {e}")
+
+
+def _fold(value) -> str:
+    return (value or "").strip().casefold()
+
+
+def _decimal(value: str, field: str) -> Decimal:
+    try:
+        d = Decimal(value)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"{field} {value!r} is not a number")
+    if not d.is_finite() or d < 0:
+        raise ValueError(f"{field} must be a non-negative number")
+    return d.quantize(Decimal("0.01"))
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+def import_marks(rows, *, school_class, term, target: str = "content", chunk_size: int = 1000,
+                 dry_run: bool = False, created_by=None, max_errors: int = 1000, on_error=None) -> dict:
+    """
+    Import the (line, cells) rows from read_rows() into `school_class` / `term`.
+
+    One transaction for the whole file (rolled back with dry_run; side effects
+    outside the database, such as dropping cached PDFs, wait for the commit
+    and so never happen on a dry run). The return
+    value holds counts plus the first `max_errors` errors as
+    {"line", "roll", "subject", "error"}; `on_error(error)` sees every one of
+    them, e.g. to stream a full report to disk.
+    """
+    spec = TARGETS[target]()
+    chunk_size = max(1, int(chunk_size))
+    stats = {"rows": 0, "cells": 0, "updated": 0, "created": 0, "new_marksheets": 0, "marksheets": 0,
+             "error_count": 0, "errors": []}
+
+    def report(line, roll, subject, error):
+        err = {"line": line, "roll": roll, "subject": subject, "error": error}
+        stats["error_count"] += 1
+        if len(stats["errors"]) < max_errors:
+            stats["errors"].append(err)
+        if on_error:
+            on_error(err)
+
+    subjects = {_fold(name): (pk, order) for pk, name, order in spec.subjects(school_class)}
+    subjects_by_id = {pk: order for pk, order in subjects.values()}
+
+    # marksheets already there: (section, roll) -> id, plus roll / name lookups for rows without a section
+    sheets, by_roll, by_name = {}, {}, {}
+    for pk, section, roll, name in spec.sheet_model.objects.filter(
+        **{spec.class_field: school_class, "term": term}
+    ).values_list("pk", "section", "roll_number", spec.name_field):
+        key = (_fold(section), _cell(roll))
+        sheets[key] = pk
+        by_roll.setdefault(key[1], []).append(key)
+        by_name.setdefault(_fold(name), []).append(key)
+    roster = spec.roster(school_class)
+    roster_by_roll = {}
+    for key in roster or ():
+        roster_by_roll.setdefault(key[1], []).append(key)
+    new_sheets = {}  # key -> (name, section, roll) for marksheets this import creates
+
+    rows = iter(rows)
+    try:
+        _, header = next(rows)
+    except StopIteration:
+        raise MarksImportError("The file is empty.")
+    cols = [_ALIASES.get(_fold(c), _fold(c)) for c in header]
+    pos = {c: i for i, c in enumerate(cols) if c}
+    if "roll" not in pos and "name" not in pos:
+        raise MarksImportError("The header needs a roll (or name) column.")
+    if "subject" in pos:
+        if "marks" not in pos:
+            raise MarksImportError("A file with a subject column needs a marks column.")
+        wide = []
+    else:
+        wide = [(i, c) for i, c in enumerate(cols) if c in subjects]
+        unknown = [header[i] for i, c in enumerate(cols) if c and c not in ID_COLUMNS and c not in subjects]
+        for name in unknown:
+            report(1, "", name, "not an active subject of this class; column ignored")
+        if not wide:
+            raise MarksImportError("No subject columns in the header (and no subject / marks columns).")
+
+    def value(cells, col):
+        i = pos.get(col)
+        return cells[i] if i is not None and i < len(cells) else ""
+
+    def resolve(section, roll, name):
+        """The marksheet key for this row, registering a new marksheet if needed; raises ValueError."""
+        if not roll and not name:
+            raise ValueError("roll (or name) is required")
+        if roll:
+            key = (_fold(section), roll)
+            if key in sheets or key in new_sheets:
+                return key
+            if not section and len(by_roll.get(roll, [])) == 1:
+                return by_roll[roll][0]
+            if not section and len(by_roll.get(roll, [])) > 1:
+                raise ValueError(f"roll {roll} is in several sections; give the section")
+        else:
+            keys = by_name.get(_fold(name), [])
+            if len(keys) == 1:
+                return keys[0]
+            raise ValueError("no marksheet for this name; give the roll" if not keys else
+                             "several marksheets have this name; give the roll")
+        if roster is not None:
+            if key not in roster and not section and len(roster_by_roll.get(roll, [])) == 1:
+                key = roster_by_roll[roll][0]
+                if key in sheets or key in new_sheets:
+                    return key
+            if key not in roster:
+                raise ValueError(f"roll {roll} is not on the class roster")
+            name, section = name or roster[key][0], section or roster[key][1]
+        elif not name:
+            raise ValueError(f"no marksheet for roll {roll}; give the student's name to create one")
+        new_sheets[key] = (name, section, roll)
+        by_roll.setdefault(roll, []).append(key)
+        return key
+
+    touched = set()
+    pending = {}  # (sheet key, subject id) -> (line, roll, subject name, marks, max); later rows win
+
+    def flush():
+        if not pending:
+            return
+        now = timezone.now()
+        to_make = [k for k in {key for key, _ in pending} if k not in sheets]
+        if to_make:
+            objs = []
+            for k in to_make:
+                name, section, roll = new_sheets[k]
+                obj = spec.sheet_model(**{spec.class_field: school_class, spec.name_field: name},
+                                       term=term, section=section, roll_number=roll)
+                if created_by is not None and hasattr(obj, "created_by"):
+                    obj.created_by = created_by
+                objs.append(obj)
+            spec.sheet_model.objects.bulk_create(objs, batch_size=500)
+            for k, obj in zip(to_make, objs):
+                sheets[k] = obj.pk
+            stats["new_marksheets"] += len(objs)
+
+        ids = {sheets[key] for key, _ in pending}
+        existing = {
+            (it.marksheet_id, it.subject_id): it
+            for it in spec.item_model.objects.filter(
+                marksheet_id__in=ids, subject_id__in={subject for _, subject in pending}
+            )
+        }
+        to_update, to_create = [], []
+        for (key, subject_id), (line, roll, subject, marks, max_marks) in pending.items():
+            sheet_id = sheets[key]
+            item = existing.get((sheet_id, subject_id))
+            if item is None:
+                item = spec.item_model(marksheet_id=sheet_id, subject_id=subject_id, order=subjects_by_id[subject_id])
+            if max_marks is not None:
+                item.max_marks = max_marks
+            if marks > item.max_marks:
+                report(line, roll, subject, f"marks {marks} exceed max {item.max_marks}")
+                continue
+            item.marks_obtained = marks
+            item.grade_letter = spec.grade(marks, item.max_marks)
+            spec.touch(item, now)
+            (to_update if item.pk else to_create).append(item)
+            touched.add(sheet_id)
+        spec.item_model.objects.bulk_update(to_update, spec.item_fields, batch_size=500)
+        spec.item_model.objects.bulk_create(to_create, batch_size=500)
+        stats["updated"] += len(to_update)
+        stats["created"] += len(to_create)
+        pending.clear()
+
+    with transaction.atomic():
+        for line, cells in rows:
+            if not any(cells):
+                continue
+            stats["rows"] += 1
+            roll, section, name = value(cells, "roll"), value(cells, "section"), value(cells, "name")
+            try:
+                key = resolve(section, roll, name)
+            except ValueError as e:
+                report(line, roll, value(cells, "subject"), str(e))
+                continue
+
+            if wide:
+                row_cells = [(header[i], cells[i] if i < len(cells) else "", None) for i, _ in wide]
+            else:
+                row_cells = [(value(cells, "subject"), value(cells, "marks"), value(cells, "max"))]
+            for subject, marks, max_marks in row_cells:
+                if not marks:
+                    continue  # blank cell: nothing to import
+                try:
+                    if _fold(subject) not in subjects:
+                        raise ValueError("not an active subject of this class")
+                    entry = (line, roll, subject, _decimal(marks, "marks"),
+                             _decimal(max_marks, "max") if max_marks else None)
+                except ValueError as e:
+                    report(line, roll, subject, str(e))
+                    continue
+                pending[(key, subjects[_fold(subject)][0])] = entry
+                stats["cells"] += 1
+            if len(pending) >= chunk_size:
+                flush()
+        flush()
+
+        stats["marksheets"] = spec.recalc(touched)
+        if dry_run:
+            transaction.set_rollback(True)
+    return stats
@@ -0,0 +1,186 @@
+# content/services/marksheet_pdf.py
+"""
+Printable marksheet PDFs (reportcards.Marksheet), content-addressed on disk.
+
+A rendered PDF is stored as
+    <MARKSHEET_PDF_CACHE_DIR>/<marksheet id>/<key>.pdf
+with key = sha256(data version + template version):
+  data version      every value the template prints (student, totals, merit
+                    positions, each row), so a marks edit or a re-rank gives
+                    a new key and the old file is simply never asked for
+  template version  the template source, the print stylesheet and the
+                    WeasyPrint version (read once per process)
+The key doubles as the HTTP ETag. Writing a new version removes the older
+files of the same marksheet; marks edits, unpublishing and deletes remove
+them right away (invalidate(), called on commit from reportcards.signals).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.template.loader import get_template, render_to_string
+
+from reportcards.models import MarkRow, Marksheet
+
+from . import pdf_worker
+
+TEMPLATE = "results/marksheet_pdf.html"
+
+PDF_CSS = """
+    @page { size: A4; margin: 14mm 12mm; }
+    body { font-family: -apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,Arial,"Noto Sans","Helvetica Neue",sans-serif; }
+    table { width: 100%; border-collapse: collapse; }
+    th, td { border: 1px solid #ddd; padding: 6px 8px; font-size: 12px; }
+    th { background: #f6f8fa; }
+    h1,h2,h3 { margin: 0 0 6px 0; }
+    .muted { color: #6c757d; }
+    .sigline { height: 40px; border-bottom: 1px dashed #999; }
+    .foot { margin-top: 16px; display: flex; justify-content: space-between; gap: 16px; }
+"""
+
+SHEET_FIELDS = (
+    "pk", "student_name", "roll_number", "section", "grade_id", "term_id", "total_obtained", "total_out_of",
+    "percent", "grade_letter", "gpa", "class_position", "section_position",
+)
+ROW_FIELDS = ("pk", "subject_id", "max_marks", "marks_obtained", "grade_letter", "remark", "order")
+
+
+def cache_dir() -> str:
+    """
+    MARKSHEET_PDF_CACHE_DIR, else <BASE_DIR>/var/marksheet_pdf (or the system
+    temp dir). Never under MEDIA_ROOT: the files are only served through the
+    view, which checks that the marksheet is published.
+    """
+    configured = getattr(settings, "MARKSHEET_PDF_CACHE_DIR", None)
+    if configured:
+        return str(configured)
+    base = getattr(settings, "BASE_DIR", None)
+    if base:
+        return os.path.join(str(base), "var", "marksheet_pdf")
+    return os.path.join(tempfile.gettempdir(), "marksheet_pdf")
+
+
+def max_age() -> int:
+    return int(getattr(settings, "MARKSHEET_PDF_MAX_AGE", 300))
+
+
+def marksheets(published_only: bool = True):
+    """Marksheets with everything the template needs (grade, term, ordered rows + subjects)."""
+    qs = Marksheet.objects.select_related("grade", "term").prefetch_related(
+        Prefetch("rows", queryset=MarkRow.objects.select_related("subject").order_by("order", "id"))
+    )
+    return qs.filter(is_published=True) if published_only else qs
+
+
+# ---------------------------------------------------------------------------
+# Keys
+# ---------------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def template_version() -> str:
+    try:
+        source = get_template(TEMPLATE).template.source
+    except AttributeError:  # non-Django template backend
+        source = TEMPLATE
+    try:
+        import weasyprint
+        engine = weasyprint.__version__
+    except Exception:  # not installed / system libraries missing
+        engine = "-"
+    return hashlib.sha256("\0".join([source, PDF_CSS, engine]).encode()).hexdigest()
+
+
+def data_version(ms, rows) -> str:
+    parts = [repr(tuple(getattr(ms, f) for f in SHEET_FIELDS)), str(ms.grade), str(ms.term)]
+    parts += [repr(tuple(getattr(r, f) for f in ROW_FIELDS)) + r.subject.name for r in rows]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def cache_key(ms, rows) -> str:
+    return hashlib.sha256(f"{data_version(ms, rows)}:{template_version()}".encode()).hexdigest()[:40]
+
+
+def cache_path(pk, key) -> str:
+    return os.path.join(cache_dir(), str(pk), f"{key}.pdf")
+
+
+# ---------------------------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------------------------
+def render_html(ms, rows) -> str:
+    return render_to_string(TEMPLATE, {"ms": ms, "rows": rows})
+
+
+def render_pdf(html: str, base_url: str | None = None) -> bytes:
+    return pdf_worker.render((0, html, PDF_CSS, base_url))[1]
+
+
+def cached_pdf(ms, rows, *, key: str | None = None, base_url: str | None = None) -> str:
+    """
+    Path of the PDF for `ms`, rendering and storing it first if this version
+    is not on disk yet. Raises whatever WeasyPrint raises (ImportError if it
+    is not installed).
+    """
+    key = key or cache_key(ms, rows)
+    path = cache_path(ms.pk, key)
+    if os.path.exists(path):
+        return path
+
+    return store(ms.pk, key, render_pdf(render_html(ms, rows), base_url=base_url))
+
+
+def read_cached(pk, key: str) -> bytes | None:
+    """The stored PDF of this version, or None. Opening is the existence check:
+    a concurrent store() or invalidate() may remove the file at any moment."""
+    try:
+        with open(cache_path(pk, key), "rb") as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+def open_pdf(ms, rows, *, key: str | None = None, base_url: str | None = None):
+    """
+    A readable binary file of the PDF for `ms`: the cached file, or, when it
+    vanished between cached_pdf() finding it and the open (a newer version
+    stored, an edit invalidated it), a fresh render served from memory.
+    """
+    key = key or cache_key(ms, rows)
+    try:
+        return open(cached_pdf(ms, rows, key=key, base_url=base_url), "rb")
+    except FileNotFoundError:
+        return BytesIO(render_pdf(render_html(ms, rows), base_url=base_url))
+
+
+def store(pk, key: str, pdf: bytes) -> str:
+    """Write one rendered version and drop the older ones of the same marksheet."""
+    path = cache_path(pk, key)
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pdf)
+        os.replace(tmp, path)  # atomic: readers never see a half-written file
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    for name in os.listdir(folder):
+        if name != os.path.basename(path) and name.endswith(".pdf"):
+            try:
+                os.unlink(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def invalidate(ids) -> None:
+    """Drop every cached PDF of the marksheets in `ids`."""
+    root = cache_dir()
+    for pk in set(ids):
+        shutil.rmtree(os.path.join(root, str(pk)), ignore_errors=True)
@@ -0,0 +1,15 @@
+# content/services/pdf_worker.py
+"""
+HTML -> PDF inside a booklet worker process (content.services.booklet).
+
+Kept free of Django imports so it also runs under the "spawn" start method:
+workers receive finished HTML and never touch the database.
+"""
+
+
+def render(job):
+    """job = (index, html, css, base_url) -> (index, pdf bytes)"""
+    index, html, css, base_url = job
+    from weasyprint import CSS, HTML  # lazy import
+
+    return index, HTML(string=html, base_url=base_url).write_pdf(stylesheets=[CSS(string=css)])
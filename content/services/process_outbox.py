@@ -2,17 +2,17 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
-from django.template import Template, Context
 
 from content.models import SmsOutbox, CommsLog
+from content.services.sms_segments import render_sms
 from content.services.comms_outbox import process_email_batch  # must accept ignore_throttle
 
 
-def _render(tpl_str: str, ctx: dict) -> str:
+def _render(tpl, ctx: dict) -> str:
     try:
-        return Template(tpl_str or "").render(Context(ctx or {})).strip()
+        return render_sms(tpl, ctx)[0]
     except Exception:
-        return (tpl_str or "")
+        return (getattr(tpl, "body_text_template", "") or "")
 
 
 class Command(BaseCommand):
@@ -56,7 +56,7 @@ class Command(BaseCommand):
         qs = (
             SmsOutbox.objects
             .select_related("template")
-            .exclude(status__in=["sent", "failed"])
+            .exclude(status__in=["sent", "failed", "suppressed"])
             .order_by("id")[:limit]
         )
         self.stdout.write(f"[debug] sms candidates: {qs.count()}")
@@ -71,7 +71,7 @@ class Command(BaseCommand):
 
             ctx = row.context or {}
             tpl = row.template
-            body_text = _render(getattr(tpl, "body_text_template", "") or "", ctx)
+            body_text = _render(tpl, ctx)
 
             try:
                 with transaction.atomic():
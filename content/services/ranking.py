@@ -0,0 +1,92 @@
+# content/services/ranking.py
+"""
+Merit positions from SQL window functions, stored on the marksheet.
+
+One SELECT ranks every published marksheet of the requested (class, term)
+pairs twice: RANK() (or DENSE_RANK()) OVER (PARTITION BY class, term ...)
+and OVER (PARTITION BY class, term, section ...). Only rows whose position
+moved are written back, with one bulk_update. Unpublished marksheets lose
+their position.
+
+Order / tie-break rules come from RESULTS_RANK_ORDER, e.g.
+    {"content": ["-total_pct", "-total_marks"], "reportcards": ["-gpa", "-percent"]}
+Students equal on every key share a position. RESULTS_RANK_METHOD picks the
+numbering: "rank" (1, 1, 3, the usual merit list) or "dense" (1, 1, 2).
+"""
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import DenseRank, Lower, Rank
+
+from content.models import StudentMarksheet
+
+RANK_FUNCTIONS = {"rank": Rank, "dense": DenseRank}
+DEFAULT_ORDER = {
+    "content": ["-total_pct", "-total_marks"],
+    "reportcards": ["-gpa", "-percent", "-total_obtained"],
+}
+
+
+def _targets():
+    from reportcards.models import Marksheet
+
+    return {
+        "content": (StudentMarksheet, "school_class_id"),
+        "reportcards": (Marksheet, "grade_id"),
+    }
+
+
+def rank_order(target: str = "content") -> list[str]:
+    return list((getattr(settings, "RESULTS_RANK_ORDER", None) or {}).get(target) or DEFAULT_ORDER[target])
+
+
+def rank_method() -> str:
+    method = getattr(settings, "RESULTS_RANK_METHOD", "rank")
+    return method if method in RANK_FUNCTIONS else "rank"
+
+
+def order_expressions(target: str = "content") -> list:
+    return [F(key[1:]).desc() if key.startswith("-") else F(key).asc() for key in rank_order(target)]
+
+
+def positions(qs, *, target: str = "content") -> dict:
+    """pk -> (class_position, section_position) for the marksheets of `qs`, ranked among themselves."""
+    _, class_field = _targets()[target]
+    fn = RANK_FUNCTIONS[rank_method()]
+    order = order_expressions(target)
+    return {
+        row[0]: row[1:]
+        for row in qs.annotate(
+            cls_pos=Window(fn(), partition_by=[F(class_field), F("term_id")], order_by=order),
+            sec_pos=Window(fn(), partition_by=[F(class_field), F("term_id"), Lower("section")], order_by=order),
+        ).values_list("pk", "cls_pos", "sec_pos")
+    }
+
+
+def rank_marksheets(pairs=None, *, term=None, target: str = "content") -> int:
+    """
+    (Re)compute class_position / section_position for the marksheets of
+    `pairs` ((class_id, term_id) set) or of a whole `term`. Returns the number
+    of marksheets whose positions changed.
+    """
+    model, class_field = _targets()[target]
+    qs = model.objects.all()
+    if term is not None:
+        qs = qs.filter(term=term)
+    if pairs is not None:
+        pairs = set(pairs)
+        if not pairs:
+            return 0
+        qs = qs.filter(**{f"{class_field}__in": {c for c, _ in pairs}}, term_id__in={t for _, t in pairs})
+
+    ranked = positions(qs.filter(is_published=True), target=target)
+    changed = []
+    for pk, class_id, term_id, cls_pos, sec_pos in qs.values_list(
+        "pk", class_field, "term_id", "class_position", "section_position"
+    ).iterator():
+        if pairs is not None and (class_id, term_id) not in pairs:
+            continue
+        new = ranked.get(pk, (None, None))
+        if new != (cls_pos, sec_pos):
+            changed.append(model(pk=pk, class_position=new[0], section_position=new[1]))
+    model.objects.bulk_update(changed, ["class_position", "section_position"], batch_size=1000)
+    return len(changed)
@@ -0,0 +1,226 @@
+# content/services/rate_limit.py
+"""
+Per-provider rate limiting for outbound messaging, shared by every worker.
+
+Configure in settings (providers not listed are unlimited):
+
+    COMMS_RATE_LIMITS = {
+        "generic": {"per_second": 10, "burst": 20, "per_day": 50000},
+        "twilio":  {"per_second": 1},
+        "smtp":    {"per_second": 14, "per_day": 50000},
+    }
+
+acquire() blocks until the provider's token bucket has a token, so senders
+slow down to the allowed rate instead of failing and backing off.
+reserve_daily() hands out what is left of the daily quota: the email batch
+reserves for its whole claim, SMS reserves one send at a time on whichever
+provider of the failover chain takes it (daily_remaining() caps the claim).
+
+State lives in the Django cache, so every worker process shares it:
+  - Redis cache (Django's RedisCache or django-redis): an exact token bucket
+    as a Lua script, timed by the Redis server clock.
+  - Other shared caches (memcached, ...): fixed windows of `burst` tokens
+    every burst/per_second seconds, counted with atomic incr().
+  - COMMS_RATE_LIMIT_BACKEND = "local", a per-process cache (locmem/dummy),
+    or any cache error: an in-process token bucket.
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local n = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= n then
+  tokens = tokens - n
+else
+  wait = (n - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+def provider_limits(provider: str) -> dict | None:
+    cfg = (getattr(settings, "COMMS_RATE_LIMITS", None) or {}).get(provider)
+    if not cfg or not cfg.get("per_second"):
+        return cfg or None
+    rate = float(cfg["per_second"])
+    return {**cfg, "per_second": rate, "burst": max(1.0, float(cfg.get("burst") or rate))}
+
+
+# --------------------------- local fallback ----------------------------
+class TokenBucket:
+    """Thread-safe in-process token bucket."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n: int = 1) -> float:
+        """Take n tokens if available and return 0; else return seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+
+_local_buckets: dict[str, TokenBucket] = {}
+_local_daily: dict[str, int] = {}
+_local_lock = threading.Lock()
+
+
+def _local_bucket(provider: str, rate: float, burst: float) -> TokenBucket:
+    with _local_lock:
+        bucket = _local_buckets.get(provider)
+        if bucket is None or (bucket.rate, bucket.burst) != (rate, burst):
+            bucket = _local_buckets[provider] = TokenBucket(rate, burst)
+        return bucket
+
+
+# ---------------------------- shared state -----------------------------
+def _redis_client():
+    """Raw redis client behind the default cache, or None."""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    try:
+        if hasattr(backend, "_cache") and hasattr(backend._cache, "get_client"):  # django.core.cache.backends.redis
+            return backend._cache.get_client(None, write=True)
+        if hasattr(backend, "client") and hasattr(backend.client, "get_client"):  # django-redis
+            return backend.client.get_client(write=True)
+    except Exception:
+        logger.warning("rate limit: redis client unavailable", exc_info=True)
+    return None
+
+
+def _backend() -> str:
+    if getattr(settings, "COMMS_RATE_LIMIT_BACKEND", "cache") == "local":
+        return "local"
+    from django.core.cache.backends.dummy import DummyCache
+    from django.core.cache.backends.locmem import LocMemCache
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache)):
+        return "local"
+    return "redis" if _redis_client() is not None else "cache"
+
+
+def _take_redis(provider: str, rate: float, burst: float, n: int) -> float:
+    client = _redis_client()
+    key = cache.make_key(f"comms:rl:{provider}")
+    return float(client.eval(_TOKEN_BUCKET_LUA, 1, key, rate, burst, n))
+
+
+def _take_windowed(provider: str, rate: float, burst: float, n: int) -> float:
+    window = burst / rate
+    now = time.time()
+    index = math.floor(now / window)
+    key = f"comms:rl:{provider}:{index}"
+    cache.add(key, 0, timeout=max(2, math.ceil(window) + 1))
+    if cache.incr(key, n) <= burst:
+        return 0.0
+    return (index + 1) * window - now  # sleep into the next window
+
+
+def acquire(provider: str, n: int = 1) -> float:
+    """Block until `provider` allows n more messages. Returns seconds spent waiting."""
+    limits = provider_limits(provider)
+    if not limits or not limits.get("per_second"):
+        return 0.0
+    rate, burst = limits["per_second"], limits["burst"]
+    backend = _backend()
+    waited = 0.0
+    while True:
+        try:
+            if backend == "redis":
+                wait = _take_redis(provider, rate, burst, n)
+            elif backend == "cache":
+                wait = _take_windowed(provider, rate, burst, n)
+            else:
+                wait = _local_bucket(provider, rate, burst).take(n)
+        except Exception:
+            logger.warning("rate limit: shared state unavailable, limiting per process", exc_info=True)
+            backend = "local"
+            continue
+        if wait <= 0:
+            return waited
+        time.sleep(wait)
+        waited += wait
+
+
+def _daily_key(provider: str) -> str:
+    return f"comms:rl:{provider}:day:{timezone.localdate():%Y%m%d}"
+
+
+def reserve_daily(provider: str, want: int) -> int:
+    """Reserve up to `want` sends from today's quota; returns how many were granted."""
+    limits = provider_limits(provider)
+    if want <= 0 or not limits or not limits.get("per_day"):
+        return max(0, want)
+    per_day = int(limits["per_day"])
+    key = _daily_key(provider)
+    try:
+        if _backend() == "local":
+            raise LookupError
+        cache.add(key, 0, timeout=26 * 3600)
+        used = cache.incr(key, want)
+        over = max(0, min(want, used - per_day))
+        if over:
+            cache.decr(key, over)
+    except Exception:
+        with _local_lock:
+            used = _local_daily.get(key, 0) + want
+            over = max(0, min(want, used - per_day))
+            _local_daily[key] = used - over
+    return want - over
+
+
+def release_daily(provider: str, n: int) -> None:
+    """Hand back reserved-but-unused quota (e.g. fewer rows were due than reserved)."""
+    limits = provider_limits(provider)
+    if n <= 0 or not limits or not limits.get("per_day"):
+        return
+    key = _daily_key(provider)
+    try:
+        if _backend() == "local":
+            raise LookupError
+        cache.decr(key, n)
+    except Exception:
+        with _local_lock:
+            _local_daily[key] = max(0, _local_daily.get(key, 0) - n)
+
+
+def daily_remaining(provider: str) -> int | None:
+    """What is left of today's quota without reserving it; None when the provider has no daily cap."""
+    limits = provider_limits(provider)
+    if not limits or not limits.get("per_day"):
+        return None
+    key = _daily_key(provider)
+    try:
+        if _backend() == "local":
+            raise LookupError
+        used = int(cache.get(key) or 0)
+    except Exception:
+        with _local_lock:
+            used = _local_daily.get(key, 0)
+    return max(0, int(limits["per_day"]) - used)
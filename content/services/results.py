@@ -0,0 +1,204 @@
+# content/services/results.py
+"""
+Class result aggregation: ClassResultSummary / ClassResultSubjectAvg /
+ClassTopper computed from the published StudentMarksheets.
+
+Figures come from grouped SQL aggregates over every stale (class, term) pair
+at once, regardless of how many pairs there are:
+  one query   for the fingerprints (count + last update of published marksheets)
+  one query   each for class aggregates, enrolment, subject averages and
+              the top N (a ROW_NUMBER window in merit order)
+plus the stored merit positions (services.ranking) of the same pairs.
+Everything is written in one transaction. A pair whose fingerprint matches
+the stored ClassResultSummary.auto_source is skipped, so reruns only touch
+classes whose marksheets changed. Admin-entered remarks and topper photos
+are kept.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from content.models import (
+    PASS_PERCENT_CUTOFF, ClassResultSubjectAvg, ClassResultSummary, ClassTopper, StudentMarksheet,
+    StudentMarksheetItem, StudentProfile,
+)
+
+from .deferred_recalc import mark_dirty
+from .ranking import order_expressions, rank_marksheets
+
+
+def top_n_default() -> int:
+    return int(getattr(settings, "RESULTS_TOP_N", 3))
+
+
+def _d(value) -> Decimal:
+    return Decimal(str(round(float(value or 0), 2)))
+
+
+def _published(pairs=None, *, school_class=None, term=None):
+    qs = StudentMarksheet.objects.filter(is_published=True)
+    if school_class is not None:
+        qs = qs.filter(school_class=school_class)
+    if term is not None:
+        qs = qs.filter(term=term)
+    if pairs is not None:
+        qs = qs.filter(school_class_id__in={c for c, _ in pairs}, term_id__in={t for _, t in pairs})
+    return qs
+
+
+def fingerprints(pairs=None, *, school_class=None, term=None) -> dict:
+    """(class_id, term_id) -> "count:last-update" of its published marksheets."""
+    out = {}
+    for row in (
+        _published(pairs, school_class=school_class, term=term)
+        .values("school_class_id", "term_id")
+        .annotate(n=Count("id"), last=Max("updated_at"))
+        .order_by()
+    ):
+        key = (row["school_class_id"], row["term_id"])
+        if pairs is None or key in pairs:
+            out[key] = f"{row['n']}:{row['last'].isoformat()}"
+    return out
+
+
+def aggregate_results(pairs=None, *, school_class=None, term=None, force: bool = False, top_n: int | None = None) -> dict:
+    """
+    Recompute the result summaries of `pairs` (a set of (class_id, term_id)),
+    or of every class / term with published marksheets, optionally narrowed by
+    `school_class` / `term`, and re-rank their marksheets.
+    Returns {"pairs", "stale", "summaries_created", "toppers", "subject_avgs"}.
+    """
+    top_n = top_n_default() if top_n is None else max(0, int(top_n))
+    pairs = set(pairs) if pairs is not None else None
+    current = fingerprints(pairs, school_class=school_class, term=term)
+    wanted = current.keys() | (pairs or set())
+    existing = {
+        (s.klass_id, s.term_id): s
+        for s in ClassResultSummary.objects.filter(
+            klass_id__in={c for c, _ in wanted}, term_id__in={t for _, t in wanted}
+        )
+        if (s.klass_id, s.term_id) in wanted
+    }
+    for key, summary in existing.items():
+        if key not in current and summary.auto_source:
+            current[key] = "0"  # everything unpublished: empty the computed summary
+    stale = {k for k, fp in current.items() if force or k not in existing or existing[k].auto_source != fp}
+    stats = {"pairs": len(current), "stale": len(stale), "summaries_created": 0, "toppers": 0, "subject_avgs": 0}
+    if not stale:
+        return stats
+
+    sheets = _published(stale)
+    figures = {
+        (r["school_class_id"], r["term_id"]): r
+        for r in sheets.values("school_class_id", "term_id").annotate(
+            appeared=Count("id"),
+            passed=Count("id", filter=Q(total_pct__gte=PASS_PERCENT_CUTOFF)),
+            avg=Avg("total_pct"), high=Max("total_pct"), low=Min("total_pct"),
+        ).order_by()
+    }
+    enrolled = dict(
+        StudentProfile.objects.filter(school_class_id__in={c for c, _ in stale})
+        .values_list("school_class_id").annotate(n=Count("id")).order_by()
+    )
+    subject_rows = (
+        StudentMarksheetItem.objects.filter(marksheet__in=sheets)
+        .values("marksheet__school_class_id", "marksheet__term_id", "subject_id")
+        .annotate(avg=Avg("marks_obtained"), out_of=Max("max_marks"))
+        .order_by()
+    )
+    top_rows = []
+    if top_n:
+        top_rows = (
+            sheets.annotate(pos=Window(
+                RowNumber(),
+                partition_by=[F("school_class_id"), F("term_id")],
+                order_by=[*order_expressions("content"), F("roll_number").asc(), F("id").asc()],
+            ))
+            .filter(pos__lte=top_n)
+            .values("school_class_id", "term_id", "pos", "student_full_name", "roll_number", "total_pct", "total_grade")
+        )
+
+    now = timezone.now()
+    with transaction.atomic():
+        summaries = {}
+        for key in stale:
+            f = figures.get(key) or {"appeared": 0, "passed": 0, "avg": 0, "high": 0, "low": 0}
+            summary = existing.get(key) or ClassResultSummary(klass_id=key[0], term_id=key[1])
+            summary.total_students = max(enrolled.get(key[0], 0), f["appeared"])
+            summary.appeared = f["appeared"]
+            summary.passed = f["passed"]
+            summary.pass_rate_pct = _d(100.0 * f["passed"] / f["appeared"]) if f["appeared"] else Decimal("0")
+            summary.overall_avg_pct = _d(f["avg"])
+            summary.highest_pct = _d(f["high"])
+            summary.lowest_pct = _d(f["low"])
+            summary.auto_source = current[key]
+            summary.updated_at = now
+            if summary.pk is None:
+                summary.save()
+                stats["summaries_created"] += 1
+            summaries[key] = summary
+        ClassResultSummary.objects.bulk_update(
+            [s for k, s in summaries.items() if k in existing],
+            ["total_students", "appeared", "passed", "pass_rate_pct", "overall_avg_pct", "highest_pct",
+             "lowest_pct", "auto_source", "updated_at"],
+            batch_size=500,
+        )
+        ids = [s.pk for s in summaries.values()]
+        rank_marksheets(stale)
+
+        ClassResultSubjectAvg.objects.filter(summary_id__in=ids).delete()
+        avgs = [
+            ClassResultSubjectAvg(
+                summary=summaries[key], subject_id=r["subject_id"], avg_score=_d(r["avg"]),
+                out_of=int(round(float(r["out_of"] or 0))) or 100,
+            )
+            for r in subject_rows
+            if (key := (r["marksheet__school_class_id"], r["marksheet__term_id"])) in summaries
+        ]
+        ClassResultSubjectAvg.objects.bulk_create(avgs, batch_size=500)
+
+        # keep photos an admin attached to a topper who is still on the list
+        photos = {
+            (t.summary_id, t.roll_no or t.name): t.profile_image
+            for t in ClassTopper.objects.filter(summary_id__in=ids).exclude(profile_image="")
+            .exclude(profile_image__isnull=True).only("summary_id", "roll_no", "name", "profile_image")
+        }
+        ClassTopper.objects.filter(summary_id__in=ids).delete()
+        toppers = []
+        for r in top_rows:
+            summary = summaries.get((r["school_class_id"], r["term_id"]))
+            if summary is None:
+                continue
+            toppers.append(ClassTopper(
+                summary=summary, rank=r["pos"], name=r["student_full_name"][:120], roll_no=r["roll_number"][:40],
+                total_pct=_d(r["total_pct"]), grade=r["total_grade"][:8],
+                profile_image=photos.get((summary.pk, r["roll_number"] or r["student_full_name"])),
+            ))
+        ClassTopper.objects.bulk_create(toppers, batch_size=500)
+
+    stats["toppers"], stats["subject_avgs"] = len(toppers), len(avgs)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Hook
+# ---------------------------------------------------------------------------
+def auto_aggregate_enabled() -> bool:
+    return bool(getattr(settings, "RESULTS_AUTO_AGGREGATE", True))
+
+
+def results_changed(class_id, term_id, *, using=None) -> None:
+    """
+    Published marks of (class, term) changed: refresh its summary once, when
+    the transaction commits (coalesced with every other change in it).
+    """
+    if auto_aggregate_enabled() and class_id and term_id:
+        mark_dirty("content.class_results", (class_id, term_id), _refresh, using=using)
+
+
+def _refresh(pairs) -> None:
+    aggregate_results(set(pairs))
@@ -1,43 +1,180 @@
 from __future__ import annotations
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .circuit_breaker import CircuitBreaker
+from .rate_limit import acquire, release_daily, reserve_daily
 
 class SmsSendError(Exception):
-    pass
+    def __init__(self, message: str = "", *, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# one pooled HTTP session / API client per provider, per process
+_clients: dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+
+def _concurrency() -> int:
+    return max(1, int(getattr(settings, "SMS_CONCURRENCY", 8)))
+
+
+def _generic_session(name: str = "generic") -> requests.Session:
+    with _clients_lock:
+        session = _clients.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_concurrency())
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _clients[name] = session
+        return session
 
-def send_sms_generic(*, to: str, sender_id: str, body: str) -> str:
+
+def _twilio_client():
+    with _clients_lock:
+        client = _clients.get("twilio")
+        if client is None:
+            from twilio.rest import Client
+            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+            _clients["twilio"] = client
+        return client
+
+
+def send_sms_generic(*, to: str, sender_id: str, body: str,
+                     base_url: str | None = None, api_key: str | None = None, name: str = "generic") -> str:
     """
     Example generic HTTP gateway:
-    expects base URL and api_key in settings. Returns provider reference/id.
+    expects base URL and api_key in settings (or per gateway in SMS_GATEWAYS).
+    Returns provider reference/id.
     """
-    base = settings.SMS_GENERIC_BASE_URL
-    key  = settings.SMS_GENERIC_API_KEY
+    base = base_url or settings.SMS_GENERIC_BASE_URL
+    key  = api_key if api_key is not None else settings.SMS_GENERIC_API_KEY
     payload = {"to": to, "sender": sender_id, "message": body, "api_key": key}
-    resp = requests.post(base, json=payload, timeout=15)
+    resp = _generic_session(name).post(base, json=payload, timeout=getattr(settings, "SMS_HTTP_TIMEOUT", 15))
     if resp.status_code // 100 != 2:
-        raise SmsSendError(f"HTTP {resp.status_code}: {resp.text[:300]}")
+        # 4xx means this request is bad (e.g. invalid number): another gateway will not do better
+        retryable = resp.status_code >= 500 or resp.status_code == 429
+        raise SmsSendError(f"HTTP {resp.status_code}: {resp.text[:300]}", retryable=retryable)
     data = resp.json() if resp.headers.get("content-type","").startswith("application/json") else {}
     return str(data.get("message_id") or data.get("id") or "")
 
 # Optional: Twilio
 def send_sms_twilio(*, to: str, sender_id: str, body: str) -> str:
-    from twilio.rest import Client
-    client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-    msg = client.messages.create(
+    msg = _twilio_client().messages.create(
         to=to,
         from_=settings.TWILIO_FROM_NUMBER or sender_id,
         body=body
     )
     return msg.sid
 
-def send_sms(*, to: str, sender_id: str, body: str) -> tuple[str, str]:
+
+def sms_providers() -> list[str]:
+    """
+    The failover chain, in order. SMS_PROVIDERS lists provider names: "twilio",
+    "generic" (SMS_GENERIC_* settings) or a key of SMS_GATEWAYS, e.g.
+        SMS_GATEWAYS = {"backup": {"type": "generic", "base_url": "...", "api_key": "..."}}
+    Without SMS_PROVIDERS the chain is just SMS_PROVIDER.
+    """
+    gateways = getattr(settings, "SMS_GATEWAYS", {}) or {}
+    chain = getattr(settings, "SMS_PROVIDERS", None) or [settings.SMS_PROVIDER]
+    names = []
+    for name in chain:
+        if name not in gateways:
+            name = "twilio" if str(name).lower() == "twilio" else "generic"
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def sms_provider() -> str:
+    """The first provider in the chain (the one used while its circuit is closed)."""
+    return sms_providers()[0]
+
+
+def provider_breaker(provider: str) -> CircuitBreaker:
     """
-    Returns (provider, provider_ref)
+    Breaker for one provider: opens after SMS_BREAKER_FAILURES consecutive
+    failures (default 5), half-opens after SMS_BREAKER_COOLDOWN seconds (default 60).
     """
-    provider = settings.SMS_PROVIDER.lower()
+    return CircuitBreaker(
+        f"sms:{provider}",
+        failure_threshold=int(getattr(settings, "SMS_BREAKER_FAILURES", 5)),
+        cooldown=float(getattr(settings, "SMS_BREAKER_COOLDOWN", 60)),
+    )
+
+
+def _send_via(provider: str, *, to: str, sender_id: str, body: str) -> str:
+    gateway = (getattr(settings, "SMS_GATEWAYS", {}) or {}).get(provider)
+    if gateway is not None:
+        if gateway.get("type", "generic") == "twilio":
+            return send_sms_twilio(to=to, sender_id=sender_id, body=body)
+        return send_sms_generic(to=to, sender_id=sender_id, body=body, name=provider,
+                                base_url=gateway["base_url"], api_key=gateway.get("api_key", ""))
     if provider == "twilio":
-        ref = send_sms_twilio(to=to, sender_id=sender_id, body=body)
-        return "twilio", ref
-    else:
-        ref = send_sms_generic(to=to, sender_id=sender_id, body=body)
-        return "generic", ref
+        return send_sms_twilio(to=to, sender_id=sender_id, body=body)
+    return send_sms_generic(to=to, sender_id=sender_id, body=body)
+
+
+def send_sms(*, to: str, sender_id: str, body: str) -> tuple[str, str]:
+    """
+    Returns (provider, provider_ref). Walks the provider chain, skipping
+    providers whose circuit is open; a 5xx, 429, timeout or connection error
+    counts against that provider's breaker and moves on to the next one.
+    Each attempt takes one send from that provider's daily quota (a provider
+    whose quota is used up is skipped like an open circuit; a failed attempt
+    hands its send back) and waits for a token from its COMMS_RATE_LIMITS bucket.
+    """
+    errors = []
+    for provider in sms_providers():
+        breaker = provider_breaker(provider)
+        if not breaker.allow():
+            errors.append(f"{provider}: circuit open")
+            continue
+        if not reserve_daily(provider, 1):
+            errors.append(f"{provider}: daily quota used up")
+            continue
+        acquire(provider)
+        try:
+            ref = _send_via(provider, to=to, sender_id=sender_id, body=body)
+        except SmsSendError as e:
+            release_daily(provider, 1)
+            if not e.retryable:
+                breaker.record_success()  # the gateway answered; the request was at fault
+                raise
+            breaker.record_failure()
+            errors.append(f"{provider}: {e}")
+        except Exception as e:
+            release_daily(provider, 1)
+            breaker.record_failure()
+            errors.append(f"{provider}: {e}")
+        else:
+            breaker.record_success()
+            return provider, ref
+    raise SmsSendError("All SMS providers failed: " + "; ".join(errors))
+
+
+def send_sms_batch(messages: list[dict], *, concurrency: int | None = None) -> list[tuple[str, str] | Exception]:
+    """
+    Send many messages (dicts of send_sms kwargs) through a bounded thread pool
+    sharing the pooled provider session. SMS_CONCURRENCY caps in-flight requests.
+    Returns, in input order, (provider, provider_ref) or the raised exception.
+    """
+    def _one(kwargs):
+        try:
+            return send_sms(**kwargs)
+        except Exception as e:
+            return e
+
+    if not messages:
+        return []
+    workers = min(concurrency or _concurrency(), len(messages))
+    if workers == 1:
+        return [_one(m) for m in messages]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sms-send") as pool:
+        return list(pool.map(_one, messages))
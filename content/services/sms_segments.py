@@ -0,0 +1,108 @@
+# content/services/sms_segments.py
+"""
+SMS encoding and segment maths (3GPP TS 23.038), plus compact-variant choice.
+
+GSM-7: 160 chars in one segment, 153 per segment once concatenated; chars
+from the extension table (^{}[]~|\\€ and form feed) cost two.
+UCS-2: anything outside GSM-7 (e.g. Bangla) -> 70 / 67 UTF-16 code units.
+"""
+from django.conf import settings
+from django.db.models import Count
+
+from content.models import MessageTemplate, OutboxStatus, SmsOutbox
+
+from .comms_templating import render_template
+
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+GSM7 = "GSM-7"
+UCS2 = "UCS-2"
+_LIMITS = {GSM7: (160, 153), UCS2: (70, 67)}
+
+
+def sms_encoding(text: str) -> str:
+    return GSM7 if all(ch in GSM7_BASIC or ch in GSM7_EXTENDED for ch in text) else UCS2
+
+
+def sms_units(text: str, encoding: str) -> int:
+    if encoding == GSM7:
+        return sum(2 if ch in GSM7_EXTENDED else 1 for ch in text)
+    return len(text.encode("utf-16-le")) // 2  # astral chars (emoji) take two units
+
+
+def sms_segments(text: str) -> tuple[str, int]:
+    """(encoding, billed segment count) for one message body."""
+    text = text or ""
+    encoding = sms_encoding(text)
+    units = sms_units(text, encoding)
+    single, multi = _LIMITS[encoding]
+    if units <= single:
+        return encoding, 1 if units else 0
+    return encoding, -(-units // multi)
+
+
+def render_sms(tpl, context: dict) -> tuple[str, str, int]:
+    """
+    Render an SMS template to (body, encoding, segments). If the template has
+    a compact variant and it bills fewer segments for this context, use it.
+    """
+    body = render_template(tpl, "body_text_template", context).strip()
+    encoding, segments = sms_segments(body)
+    if getattr(tpl, "body_text_compact_template", ""):
+        compact = render_template(tpl, "body_text_compact_template", context).strip()
+        c_encoding, c_segments = sms_segments(compact)
+        if compact and c_segments < segments:
+            return compact, c_encoding, c_segments
+    return body, encoding, segments
+
+
+def segment_report(*, sample_size: int = 50) -> list[dict]:
+    """
+    Per active SMS template: how many rows are queued and what they will bill,
+    estimated by rendering the most recent `sample_size` queued rows (or, with
+    nothing queued, recent rows of any status), full vs. compact wording.
+    """
+    price = getattr(settings, "SMS_SEGMENT_PRICE", None)
+    queued = dict(
+        SmsOutbox.objects.filter(status=OutboxStatus.QUEUED)
+        .values_list("template_id").annotate(n=Count("*")).order_by()
+    )
+    report = []
+    for tpl in MessageTemplate.objects.filter(kind=MessageTemplate.KIND_SMS, is_active=True).order_by("slug"):
+        base = SmsOutbox.objects.filter(template=tpl)
+        contexts = list(
+            base.filter(status=OutboxStatus.QUEUED).order_by("-id").values_list("context", flat=True)[:sample_size]
+        )
+        if not contexts:
+            contexts = list(base.order_by("-id").values_list("context", flat=True)[:sample_size]) or [{}]
+
+        full_total = chosen_total = ucs2 = compact_used = 0
+        for ctx in contexts:
+            full = render_template(tpl, "body_text_template", ctx or {}).strip()
+            _, full_segments = sms_segments(full)
+            body, encoding, segments = render_sms(tpl, ctx or {})
+            full_total += full_segments
+            chosen_total += segments
+            ucs2 += encoding == UCS2
+            compact_used += body != full
+        n = len(contexts)
+        avg_full, avg_chosen = full_total / n, chosen_total / n
+        row = {
+            "template": tpl,
+            "queued": queued.get(tpl.pk, 0),
+            "sampled": n,
+            "ucs2_pct": round(100 * ucs2 / n),
+            "avg_segments_full": round(avg_full, 2),
+            "avg_segments": round(avg_chosen, 2),
+            "compact_pct": round(100 * compact_used / n),
+            "has_compact": bool(tpl.body_text_compact_template),
+        }
+        row["projected_segments"] = round(avg_chosen * row["queued"])
+        row["saved_segments"] = round((avg_full - avg_chosen) * row["queued"])
+        row["projected_cost"] = round(row["projected_segments"] * float(price), 2) if price is not None else None
+        report.append(row)
+    return report
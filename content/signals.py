@@ -12,15 +12,29 @@ from reportlab.pdfgen import canvas
 
 # ✅ new helper name
 from .billing import ensure_monthly_window_for_user
-from .models import StudentMarksheetItem, TuitionPayment, PaymentReceipt, StudentProfile
+from .models import StudentMarksheet, StudentMarksheetItem, TuitionPayment, PaymentReceipt, StudentProfile
+from .services.deferred_recalc import mark_dirty
+from .services.marks import recalc_marksheets
+from .services.results import results_changed
 
 
 # ---------- Marksheet totals ----------
 @receiver([post_save, post_delete], sender=StudentMarksheetItem)
-def recalc_marksheet_totals(sender, instance, **kwargs):
-    ms = instance.marksheet
-    ms.recalc_totals()
-    ms.save(update_fields=["total_marks", "total_grade", "updated_at"])
+def recalc_marksheet_totals(sender, instance, using=None, **kwargs):
+    # once per marksheet per transaction, on commit (see services.deferred_recalc)
+    mark_dirty("content.marksheet", instance.marksheet_id, recalc_marksheets, using=using)
+
+
+@receiver([post_save, post_delete], sender=StudentMarksheet)
+def refresh_class_results(sender, instance, using=None, **kwargs):
+    # any save (publishing and unpublishing included) or delete: the class summary /
+    # toppers refresh on commit, for the pair it left too if class or term changed
+    key = (instance.school_class_id, instance.term_id)
+    results_changed(*key, using=using)
+    old = getattr(instance, "_loaded_results_key", None)
+    if old and old != key:
+        results_changed(*old, using=using)
+    instance._loaded_results_key = key
 
 
 # ---------- Tuition payment → PDF receipt ----------
@@ -91,45 +105,25 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
-from .models import EmailOutbox, CommsLog
-from .services.comms_templating import render_string
-from .services.emailing import send_email_smtp
+from .models import EmailOutbox, OutboxPriority, OutboxStatus
+from .services.comms_outbox import nudge_email_dispatch
 
 @receiver(post_save, sender=EmailOutbox)
 def auto_send_email_outbox(sender, instance: EmailOutbox, created, **kwargs):
-    if not created:
-        return
-    if not getattr(settings, "EMAIL_AUTO_SEND", False):
+    # EMAIL_AUTO_SEND: a new queued row is handed to the dispatcher after commit,
+    # on a background thread; the save() that created it never waits for SMTP
+    if not created or not getattr(settings, "EMAIL_AUTO_SEND", False):
         return
-    if instance.status in ("sent","failed","sending"):
+    if instance.status != OutboxStatus.QUEUED:
         return
+    nudge_email_dispatch(lane="high" if instance.priority >= OutboxPriority.HIGH else None)
 
-    tpl = instance.template
-    subject   = render_string(tpl.subject_template or "", instance.context)
-    body_text = render_string(tpl.body_text_template or "", instance.context)
-    body_html = render_string(tpl.body_html_template or "", instance.context) if tpl.body_html_template else None
-
-    msg_id = send_email_smtp(
-        to=instance.to,
-        subject=subject,
-        body_text=body_text,
-        body_html=body_html,
-        from_email=(instance.from_email or None),
-        reply_to=(instance.reply_to or None),
-    )
 
-    instance.provider = "smtp"
-    instance.provider_ref = msg_id or ""
-    instance.status = "sent"
-    instance.sent_at = timezone.now()
-    instance.last_error = ""
-    instance.save(update_fields=["provider","provider_ref","status","sent_at","last_error"])
-
-    CommsLog.objects.create(
-        when=instance.sent_at,
-        channel="email",
-        recipient=instance.to,
-        template_slug=tpl.slug,
-        status="sent",
-        detail=msg_id or "",
-    )
+from .models import CommsSuppression
+from .services.comms_suppression import bump_version
+
+
+@receiver([post_save, post_delete], sender=CommsSuppression)
+def comms_suppression_changed(sender, instance, **kwargs):
+    # admin edits: make every process reload its in-memory set
+    bump_version()
@@ -0,0 +1,393 @@
+import datetime
+import io
+import os
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.forms import modelform_factory
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from content.client_ip import client_ip
+from content.models import (
+    AcademicClass, CommsSuppression, EmailOutbox, ExamTerm, MessageTemplate, OutboxPriority, OutboxStatus,
+    ProcessedGatewayEvent, SmsOutbox, StudentMarksheet, StudentMarksheetItem, Subject, TuitionInvoice,
+)
+from content.services import comms_events, comms_outbox, comms_retention, marksheet_pdf, rate_limit
+from content.services.comms_outbox import (
+    _claim_batch, bulk_queue_email, process_email_batch, queue_email, queue_sms,
+)
+from content.services.dues_autoqueue import queue_overdue_dues_emails
+
+
+RATE, BURST = 40, 4
+
+
+@override_settings(COMMS_RATE_LIMITS={"bench": {"per_second": RATE, "burst": BURST}})
+class RateLimitAcrossSendersTests(SimpleTestCase):
+    """Several concurrent senders together must stay within one provider's rate."""
+
+    senders, per_sender = 8, 10
+
+    def setUp(self):
+        rate_limit._local_buckets.clear()
+        cache.clear()
+
+    def _drive(self):
+        stamps, lock = [], threading.Lock()
+
+        def sender():
+            for _ in range(self.per_sender):
+                rate_limit.acquire("bench")
+                with lock:
+                    stamps.append(time.monotonic())
+
+        threads = [threading.Thread(target=sender) for _ in range(self.senders)]
+        t0 = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return t0, sorted(stamps)
+
+    def _assert_within_limit(self, t0, stamps):
+        total = self.senders * self.per_sender
+        self.assertEqual(len(stamps), total)
+        # after the initial burst, tokens arrive at RATE per second however many senders ask
+        self.assertGreaterEqual(stamps[-1] - t0, (total - 2 * BURST) / RATE)
+        # and no half-second holds more than its share plus a burst at each edge
+        window = 0.5
+        for i, start in enumerate(stamps):
+            in_window = sum(1 for s in stamps[i:] if s < start + window)
+            self.assertLessEqual(in_window, RATE * window + 2 * BURST)
+
+    def test_in_process_bucket(self):
+        with override_settings(COMMS_RATE_LIMIT_BACKEND="local"):
+            self._assert_within_limit(*self._drive())
+
+    def test_shared_cache_windows(self):
+        # fixed windows counted with cache.incr(), as on memcached
+        with mock.patch.object(rate_limit, "_backend", return_value="cache"):
+            self._assert_within_limit(*self._drive())
+
+
+@override_settings(COMMS_AUTOSEND_EMAIL=False, EMAIL_AUTO_SEND=False, COMMS_RATE_LIMITS={})
+class HighLaneTests(TestCase):
+    """A login code queued behind a full bulk run still goes out first."""
+
+    bulk = 300
+
+    def setUp(self):
+        MessageTemplate.objects.create(slug="dues", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Dues", body_text_template="Tuition is due.")
+        MessageTemplate.objects.create(slug="code", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Code", body_text_template="{{ code }}")
+        bulk_queue_email(template_slug="dues", rows=((f"guardian{i}@example.com", {}) for i in range(self.bulk)))
+        self.code = queue_email(to="staff@example.com", template_slug="code", context={"code": "123456"},
+                                priority=OutboxPriority.HIGH)
+
+    def test_high_lane_sends_only_the_code(self):
+        self.assertEqual(process_email_batch(limit=100, lane="high"), 1)
+
+        self.assertEqual([m.to for m in mail.outbox], [["staff@example.com"]])
+        self.code.refresh_from_db()
+        self.assertEqual(self.code.status, OutboxStatus.SENT)
+        target = float(getattr(settings, "COMMS_HIGH_LANE_TARGET_SECONDS", 5))
+        self.assertLess((self.code.sent_at - self.code.created_at).total_seconds(), target)
+        self.assertEqual(EmailOutbox.objects.filter(priority=OutboxPriority.BULK, status=OutboxStatus.QUEUED).count(),
+                         self.bulk)
+
+    def test_mixed_batch_claims_the_code_first(self):
+        process_email_batch(limit=10)
+
+        self.assertEqual(len(mail.outbox), 10)
+        self.assertEqual(mail.outbox[0].to, ["staff@example.com"])
+
+
+class ClientIpTests(SimpleTestCase):
+    def _request(self, xff=None):
+        extra = {"HTTP_X_FORWARDED_FOR": xff} if xff is not None else {}
+        return RequestFactory().get("/", REMOTE_ADDR="10.0.0.2", **extra)
+
+    def test_forwarded_for_ignored_without_trusted_proxies(self):
+        self.assertEqual(client_ip(self._request("1.2.3.4")), "10.0.0.2")
+
+    @override_settings(TRUSTED_PROXY_COUNT=1)
+    def test_last_hop_added_by_the_proxy(self):
+        self.assertEqual(client_ip(self._request("1.2.3.4, 203.0.113.7")), "203.0.113.7")
+        self.assertEqual(client_ip(self._request("203.0.113.7")), "203.0.113.7")
+        self.assertEqual(client_ip(self._request()), "10.0.0.2")
+        self.assertEqual(client_ip(self._request("1.2.3.4, not-an-ip")), "10.0.0.2")
+
+    @override_settings(TRUSTED_PROXY_COUNT=2)
+    def test_two_proxies(self):
+        self.assertEqual(client_ip(self._request("1.2.3.4, 203.0.113.7, 10.0.0.9")), "203.0.113.7")
+
+
+class DeferredRecalcTests(TestCase):
+    """Saving a marksheet's subject rows recomputes its totals once, on commit."""
+
+    subjects = 12
+
+    def setUp(self):
+        klass = AcademicClass.objects.create(name="Test Class", section="M", year=1900)
+        term = ExamTerm.objects.create(name="Final", year=1900)
+        self.subject_rows = Subject.objects.bulk_create(
+            [Subject(school_class=klass, name=f"Subject {i + 1}", order=i + 1) for i in range(self.subjects)]
+        )
+        self.ms = StudentMarksheet.objects.create(school_class=klass, term=term, student_full_name="Student",
+                                                  is_published=False)
+
+    def _add(self, i):
+        StudentMarksheetItem.objects.create(marksheet=self.ms, subject=self.subject_rows[i], marks_obtained=40 + i,
+                                            order=i + 1)
+
+    def test_one_recompute_for_twelve_rows(self):
+        # 12 INSERTs, then on commit one grouped SUM, one SELECT and one bulk UPDATE
+        with self.assertNumQueries(self.subjects + 3):
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertNumQueries(self.subjects):
+                    for i in range(self.subjects):
+                        self._add(i)
+        self.ms.refresh_from_db()
+        self.assertEqual(self.ms.total_marks, sum(40 + i for i in range(self.subjects)))
+
+    def test_rolled_back_savepoint_does_not_lose_later_marks(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self._add(0)
+                    raise ValueError
+            except ValueError:
+                pass
+            self._add(1)
+        self.ms.refresh_from_db()
+        self.assertEqual(self.ms.total_marks, 41)
+
+
+class ClassResultsRefreshTests(TestCase):
+    def setUp(self):
+        self.klass = AcademicClass.objects.create(name="Test Class", section="M", year=1900)
+        self.other = AcademicClass.objects.create(name="Other Class", section="M", year=1900)
+        self.term = ExamTerm.objects.create(name="Final", year=1900)
+        self.ms = StudentMarksheet.objects.create(school_class=self.klass, term=self.term, student_full_name="Student")
+
+    def test_unpublishing_refreshes(self):
+        ms = StudentMarksheet.objects.get(pk=self.ms.pk)
+        ms.is_published = False
+        with mock.patch("content.signals.results_changed") as changed:
+            ms.save()
+        changed.assert_called_once_with(self.klass.pk, self.term.pk, using="default")
+
+    def test_moving_refreshes_both_classes(self):
+        ms = StudentMarksheet.objects.get(pk=self.ms.pk)
+        ms.school_class = self.other
+        with mock.patch("content.signals.results_changed") as changed:
+            ms.save()
+            ms.save()
+        self.assertEqual(changed.call_args_list, [
+            mock.call(self.other.pk, self.term.pk, using="default"),
+            mock.call(self.klass.pk, self.term.pk, using="default"),
+            mock.call(self.other.pk, self.term.pk, using="default"),
+        ])
+
+
+class ArchiveDirTests(SimpleTestCase):
+    def _outside_media(self, path):
+        media = os.path.realpath(settings.MEDIA_ROOT)
+        return os.path.commonpath([os.path.realpath(path), media]) != media
+
+    @override_settings(COMMS_ARCHIVE_DIR=None)
+    def test_default_is_not_served_from_media(self):
+        self.assertTrue(self._outside_media(comms_retention.archive_dir()))
+
+    @override_settings(COMMS_ARCHIVE_DIR=None, BASE_DIR="/srv/school", MEDIA_ROOT="/srv/school/media")
+    def test_default_under_base_dir(self):
+        self.assertEqual(comms_retention.archive_dir(), os.path.join("/srv/school", "var", "comms_archive"))
+        self.assertTrue(self._outside_media(comms_retention.archive_dir()))
+
+
+@override_settings(COMMS_AUTOSEND_EMAIL=False, EMAIL_AUTO_SEND=False, COMMS_RATE_LIMITS={},
+                   COMMS_CLAIM_LEASE_SECONDS=600)
+class ClaimLeaseTests(TestCase):
+    """Rows claimed by a worker that never wrote its results back are sent by the next one."""
+
+    def setUp(self):
+        MessageTemplate.objects.create(slug="notice", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Notice", body_text_template="Hello")
+        self.ob = queue_email(to="guardian@example.com", template_slug="notice", context={})
+        self.assertEqual(len(_claim_batch(EmailOutbox, limit=10)), 1)  # ...and the worker dies here
+
+    def test_live_lease_is_left_alone(self):
+        self.assertEqual(process_email_batch(limit=10), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_stale_lease_is_reclaimed(self):
+        EmailOutbox.objects.filter(pk=self.ob.pk).update(claimed_at=timezone.now() - timedelta(seconds=601))
+        self.assertEqual(process_email_batch(limit=10), 1)
+        self.ob.refresh_from_db()
+        self.assertEqual(self.ob.status, OutboxStatus.SENT)
+
+
+@override_settings(COMMS_AUTOSEND_EMAIL=True, EMAIL_AUTO_SEND=True)
+class EmailNudgeTests(TestCase):
+    def test_one_drain_thread_for_many_nudges(self):
+        MessageTemplate.objects.create(slug="code", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Code", body_text_template="{{ code }}")
+        release, calls = threading.Event(), []
+
+        def batch(limit, lane=None):
+            calls.append(sum(1 for t in threading.enumerate() if t.name == "comms-nudge"))
+            release.wait(5)
+
+        with mock.patch.object(comms_outbox, "process_email_batch", side_effect=batch):
+            # both settings nudge every message: 10 nudges for 5 login codes
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(5):
+                    queue_email(to=f"staff{i}@example.com", template_slug="code", context={"code": "1"},
+                                priority=OutboxPriority.HIGH)
+            drain = comms_outbox._nudge_thread
+            release.set()
+            drain.join(5)
+
+        self.assertIn(len(calls), (1, 2))  # the first nudge, plus the rest folded into one more pass
+        self.assertEqual(set(calls), {1})
+        self.assertIsNone(comms_outbox._nudge_thread)
+
+
+@override_settings(DUES_DIGEST=True, COMMS_MERGE_SIBLINGS=True, COMMS_AUTOSEND_EMAIL=False, EMAIL_AUTO_SEND=False)
+class DuesDigestWithMergedSiblingsTests(TestCase):
+    """DUES_DIGEST=True (user-031) keeps working now that siblings are merged by default."""
+
+    def setUp(self):
+        MessageTemplate.objects.create(slug="dues_notice_email", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Dues", body_text_template="{{ total_due }}")
+        users = get_user_model().objects
+        for username, email in (("kid1", "family@example.com"), ("kid2", "family@example.com"),
+                                ("only", "single@example.com")):
+            student = users.create(username=username, email=email)
+            for month in (1, 2):
+                TuitionInvoice.objects.create(student=student, kind="monthly", period_year=2020, period_month=month,
+                                              tuition_amount=1000, due_date=datetime.date(2020, month, 10))
+
+    def test_command_merges(self):
+        call_command("queue_dues_notices", "--send-email", stdout=io.StringIO())
+        self.assertEqual(sorted(EmailOutbox.objects.values_list("to", flat=True)),
+                         ["family@example.com", "single@example.com"])
+
+    def test_autoqueue_agrees_with_the_command(self):
+        self.assertEqual(queue_overdue_dues_emails(), 2)
+
+    def test_explicit_digest_needs_per_student(self):
+        with self.assertRaises(CommandError):
+            call_command("queue_dues_notices", "--send-email", "--digest", stdout=io.StringIO())
+        call_command("queue_dues_notices", "--send-email", "--digest", "--per-student", stdout=io.StringIO())
+        self.assertEqual(EmailOutbox.objects.count(), 3)
+
+
+@override_settings(COMMS_AUTOSEND_EMAIL=False, EMAIL_AUTO_SEND=False, SMS_DEFAULT_COUNTRY_CODE="880")
+class ManualSuppressionTests(TestCase):
+    """A suppression typed into the admin blocks sends to however the address is spelled."""
+
+    form_class = modelform_factory(CommsSuppression, fields=("channel", "address", "reason"))
+
+    def setUp(self):
+        cache.clear()
+        MessageTemplate.objects.create(slug="notice", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Notice", body_text_template="Hello")
+        MessageTemplate.objects.create(slug="notice-sms", kind=MessageTemplate.KIND_SMS, body_text_template="Hello")
+
+    def _enter(self, channel, address):
+        form = self.form_class({"channel": channel, "address": address, "reason": "manual"})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form.save()
+
+    def test_typed_email_blocks_send(self):
+        self.assertEqual(self._enter("email", " Foo@X.com ").address, "foo@x.com")
+        ob = queue_email(to="foo@x.com", template_slug="notice", context={})
+        self.assertEqual(ob.status, OutboxStatus.SUPPRESSED)
+
+    def test_typed_phone_blocks_send(self):
+        self.assertEqual(self._enter("sms", "01712-345678").address, "+8801712345678")
+        ob = queue_sms(to="+880 1712 345678", template_slug="notice-sms", context={})
+        self.assertEqual(ob.status, OutboxStatus.SUPPRESSED)
+
+    def test_unusable_addresses_rejected(self):
+        for channel, address in (("sms", "call the office"), ("email", "not-an-email")):
+            form = self.form_class({"channel": channel, "address": address, "reason": "manual"})
+            self.assertFalse(form.is_valid())
+            self.assertIn("address", form.errors)
+
+
+@override_settings(COMMS_AUTOSEND_EMAIL=False, EMAIL_AUTO_SEND=False)
+class GatewayEventTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        MessageTemplate.objects.create(slug="notice", kind=MessageTemplate.KIND_EMAIL,
+                                       subject_template="Notice", body_text_template="Hello")
+        MessageTemplate.objects.create(slug="notice-sms", kind=MessageTemplate.KIND_SMS, body_text_template="Hello")
+        self.ob = queue_email(to="guardian@example.com", template_slug="notice", context={})
+
+    def test_event_claimed_by_a_concurrent_delivery_is_not_applied(self):
+        event = {"email": "guardian@example.com", "event": "bounce", "sg_event_id": "ev-1"}
+        # the other delivery inserted the key after this one looked for it
+        ProcessedGatewayEvent.objects.create(provider="email-bounce", event_id="email-bounce:ev-1")
+        seen_nothing = mock.Mock(**{"values_list.return_value": []})
+        with mock.patch.object(ProcessedGatewayEvent.objects, "filter", return_value=seen_nothing):
+            result = comms_events.ingest_email_bounces([event])
+        self.assertEqual(result["applied"], 0)
+        self.ob.refresh_from_db()
+        self.assertEqual(self.ob.status, OutboxStatus.QUEUED)
+
+    def test_non_string_values(self):
+        result = comms_events.ingest_email_bounces([{"email": "guardian@example.com", "event": "bounce",
+                                                     "reason": 550}])
+        self.assertEqual(result["applied"], 1)
+        self.ob.refresh_from_db()
+        self.assertEqual(self.ob.last_error, "550")
+
+        sms = queue_sms(to="+8801712345678", template_slug="notice-sms", context={})
+        SmsOutbox.objects.filter(pk=sms.pk).update(status=OutboxStatus.SENT, provider_ref="123")
+        result = comms_events.ingest_sms_dlrs({"message_id": 123, "status": "failed", "error": 42})
+        self.assertEqual(result["applied"], 1)
+        sms.refresh_from_db()
+        self.assertEqual((sms.status, sms.last_error), (OutboxStatus.FAILED, "42"))
+
+
+class VanishedPdfTests(SimpleTestCase):
+    """A cached marksheet PDF removed by a concurrent store()/invalidate()."""
+
+    def test_read_cached_treats_missing_file_as_miss(self):
+        with mock.patch.object(marksheet_pdf, "cache_path", return_value="/nonexistent/x.pdf"):
+            self.assertIsNone(marksheet_pdf.read_cached(1, "k"))
+
+    def test_open_pdf_renders_again(self):
+        ms = mock.Mock(pk=1)
+        with mock.patch.object(marksheet_pdf, "cached_pdf", return_value="/nonexistent/x.pdf"), \
+                mock.patch.object(marksheet_pdf, "render_html", return_value="<p>"), \
+                mock.patch.object(marksheet_pdf, "render_pdf", return_value=b"%PDF-fresh") as render:
+            fh = marksheet_pdf.open_pdf(ms, [], key="k")
+        self.assertEqual(fh.read(), b"%PDF-fresh")
+        render.assert_called_once()
+
+
+class MarksChangedPdfTests(TestCase):
+    def test_cached_pdfs_dropped_only_on_commit(self):
+        from reportcards.signals import marks_changed
+
+        with mock.patch.object(marksheet_pdf, "invalidate") as invalidate:
+            with self.captureOnCommitCallbacks() as callbacks:
+                marks_changed({41, 42})
+            invalidate.assert_not_called()  # a dry run / rollback would stop here
+            for callback in callbacks:
+                callback()
+        invalidate.assert_called_once()
+        self.assertEqual(sorted(invalidate.call_args.args[0]), [41, 42])
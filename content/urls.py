@@ -25,6 +25,10 @@ from .views import (
     my_invoices, invoice_pay,
     invoice_bulk_checkout_all, invoice_bulk_checkout_selected, invoice_bulk_checkout, download_latest_receipt,
     email_bounce_webhook, sms_dlr_webhook, notify_demo,
+    email_bounce_batch_webhook, sms_dlr_batch_webhook,
+
+    # Marks entry grid
+    marks_grid_api,
 )
 
 # These views live in ui.views but we expose them under the `content:` namespace
@@ -70,6 +74,7 @@ urlpatterns = [
     path(f"{P}/manage/slides/create/", manage_slide_create, name="manage_slide_create"),
     path(f"{P}/manage/notices/create/", manage_notice_create, name="manage_notice_create"),
     path(f"{P}/manage/timeline/create/", manage_timeline_create, name="manage_timeline_create"),
+    path(f"{P}/manage/marks/grid/<int:class_id>/<int:term_id>/", marks_grid_api, name="marks_grid_api"),
 
     # ---------- Exam Corner (UI) ----------
     path("exam-routines/", exam_routines_page, name="exam_routines_page"),
@@ -105,6 +110,8 @@ urlpatterns = [
     path("checkout/selected/", invoice_bulk_checkout_selected, name="invoice-bulk-checkout-selected"),
     path("webhooks/email/bounce/", email_bounce_webhook, name="email-bounce-webhook"),
     path("webhooks/sms/dlr/", sms_dlr_webhook, name="sms-dlr-webhook"),
+    path("webhooks/email/bounce/batch/", email_bounce_batch_webhook, name="email-bounce-batch-webhook"),
+    path("webhooks/sms/dlr/batch/", sms_dlr_batch_webhook, name="sms-dlr-batch-webhook"),
     path("comms/notify-demo/", notify_demo, name="comms-notify-demo"),
 ]
 
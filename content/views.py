@@ -45,8 +45,10 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.http import require_POST
 from django.http import HttpResponse
 from content.services.comms_outbox import queue_sms, queue_email
+from content.services.comms_events import ingest_email_bounces, ingest_sms_dlrs
+from content.services.marks import MarksGridConflict, MarksGridError, apply_grid_changes, marks_grid
 from .billing import ensure_monthly_window_for_user, compute_dues_summary, allocate_payment_across_invoices
-from .decorators import teacher_or_admin_required
+from .decorators import signed_webhook, teacher_or_admin_required
 from .forms import AdmissionApplicationForm
 from .models import (
     Banner,
@@ -60,7 +62,8 @@ from .models import (
     TuitionPayment,
     IncomeCategory,
     AcademicClass,
-    StudentProfile, PaymentReceipt, SmsOutbox, OutboxStatus, CommsLog, EmailOutbox, EmailBounce,
+    ExamTerm,
+    StudentProfile, PaymentReceipt,
 )
 from .services.receipts import generate_payment_receipt
 
@@ -283,6 +286,38 @@ def manage_timeline_create(request):
     return JsonResponse({"created": {"id": e.id}}, status=201)
 
 
+# --------------------------------------------------------------------------------------
+# Marks entry grid (teacher/admin)
+# --------------------------------------------------------------------------------------
+@teacher_or_admin_required
+@require_http_methods(["GET", "PATCH"])
+def marks_grid_api(request, class_id: int, term_id: int):
+    """
+    GET   -> class x subject matrix of marks for one exam term (?section= optional).
+    PATCH -> {"cells": [{"marksheet", "subject", "marks", "max"?, "version"}]}:
+             applied all-or-nothing; 400 with per-cell errors, 409 with the
+             current values when a cell's version is stale.
+    """
+    klass = get_object_or_404(AcademicClass, pk=class_id)
+    term = get_object_or_404(ExamTerm, pk=term_id)
+    if request.method == "GET":
+        return JsonResponse(marks_grid(klass, term, section=(request.GET.get("section") or "").strip() or None))
+
+    try:
+        cells = json.loads(request.body or b"{}").get("cells")
+    except (ValueError, AttributeError):
+        return _json_bad("Body must be a JSON object")
+    if not isinstance(cells, list) or not all(isinstance(c, dict) for c in cells):
+        return _json_bad("'cells' must be a list of objects")
+    try:
+        result = apply_grid_changes(klass, term, cells)
+    except MarksGridConflict as e:
+        return JsonResponse({"ok": False, "error": "conflict", "cells": e.errors}, status=409)
+    except MarksGridError as e:
+        return JsonResponse({"ok": False, "error": "invalid", "cells": e.errors}, status=400)
+    return _json_ok(**result)
+
+
 # --------------------------------------------------------------------------------------
 # Admissions flow
 # --------------------------------------------------------------------------------------
@@ -1388,6 +1423,7 @@ def invoice_bulk_checkout_selected(request):
 
 @csrf_exempt
 @require_POST
+@signed_webhook("email")
 def email_bounce_webhook(request):
     """
     Connect your email provider (e.g., SendGrid/SES/Twilio SendGrid) to POST here.
@@ -1398,26 +1434,29 @@ def email_bounce_webhook(request):
     except Exception:
         payload = {}
 
-    email = payload.get("email") or payload.get("recipient") or ""
-    reason = payload.get("reason") or payload.get("error") or ""
-    event = payload.get("event") or "bounce"
+    ingest_email_bounces(payload if isinstance(payload, dict) else {})
+    return JsonResponse({"ok": True})
 
-    EmailBounce.objects.create(email=email, event=event, reason=reason, raw=payload)
 
-    # best-effort mark latest outbox row as bounced
-    if email:
-        eo = EmailOutbox.objects.filter(to=email).order_by("-id").first()
-        if eo:
-            eo.status = OutboxStatus.BOUNCED
-            eo.last_error = reason[:1000]
-            eo.save(update_fields=["status", "last_error"])
-            CommsLog.objects.create(channel="email", recipient=email, template_slug=eo.template.slug, status="bounced", detail=reason[:200])
+@csrf_exempt
+@require_POST
+@signed_webhook("email")
+def email_bounce_batch_webhook(request):
+    """
+    Same as email_bounce_webhook, but the body is a JSON array of events
+    (or {"events": [...]}), as SendGrid/SES deliver them in bursts.
+    """
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
 
-    return JsonResponse({"ok": True})
+    return JsonResponse({"ok": True, **ingest_email_bounces(payload)})
 
 
 @csrf_exempt
 @require_POST
+@signed_webhook("sms")
 def sms_dlr_webhook(request):
     """
     Delivery reports from SMS gateway.
@@ -1428,21 +1467,23 @@ def sms_dlr_webhook(request):
     except Exception:
         payload = {}
 
-    ref = payload.get("message_id") or payload.get("id") or ""
-    status = (payload.get("status") or "").lower()
+    ingest_sms_dlrs(payload if isinstance(payload, dict) else {})
+    return JsonResponse({"ok": True})
 
-    if ref:
-        ob = SmsOutbox.objects.filter(provider_ref=ref).order_by("-id").first()
-        if ob and status in {"delivered","undelivered","failed"}:
-            if status == "delivered":
-                ob.status = OutboxStatus.SENT
-            else:
-                ob.status = OutboxStatus.FAILED
-                ob.last_error = (payload.get("error") or status)[:1000]
-            ob.save(update_fields=["status", "last_error"])
-            CommsLog.objects.create(channel="sms", recipient=ob.to, template_slug=ob.template.slug, status=status, detail=str(payload)[:300])
 
-    return JsonResponse({"ok": True})
+@csrf_exempt
+@require_POST
+@signed_webhook("sms")
+def sms_dlr_batch_webhook(request):
+    """
+    Batch delivery reports: a JSON array of DLR events (or {"events": [...]}).
+    """
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return JsonResponse({"ok": False, "error": "invalid JSON"}, status=400)
+
+    return JsonResponse({"ok": True, **ingest_sms_dlrs(payload)})
 
 
 
@@ -1,9 +1,10 @@
 from django import forms
 from django.contrib import admin, messages
 from django.db.models import Max
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse
 
+from content.services.booklet import BookletError, build_booklet
 from .models import Grade, GradeSubject, Term, Marksheet, MarkRow
 
 # ---------- Base admin ----------
@@ -168,28 +169,42 @@ def reseed_rows(modeladmin, request, queryset):
     messages.success(request, f"Created {total} missing rows across selected marksheets.")
 
 
+@admin.action(description="Print selected as one PDF booklet (ordered by roll)")
+def print_booklet(modeladmin, request, queryset):
+    try:
+        pdf, stats = build_booklet(queryset, target="reportcards", base_url=request.build_absolute_uri("/"))
+    except BookletError as e:
+        messages.error(request, str(e))
+        return None
+    resp = HttpResponse(pdf, content_type="application/pdf")
+    resp["Content-Disposition"] = f'attachment; filename="marksheets_booklet_{stats["sheets"]}.pdf"'
+    return resp
+
+
 @admin.register(Marksheet)
 class MarksheetAdmin(StaffDeleteAdmin):
-    actions = [reseed_rows, "delete_selected"]
+    actions = [reseed_rows, print_booklet, "delete_selected"]
     form = MarksheetAdminForm
     inlines = [MarkRowInline]
 
     list_display  = (
         "student_name", "roll_number", "grade", "term",
         "total_obtained", "total_out_of", "percent", "gpa",
-        "grade_letter", "updated_at",
+        "grade_letter", "class_position", "section_position", "updated_at",
     )
     list_filter   = ("grade", "term", "is_published")
     search_fields = ("student_name", "roll_number")
     autocomplete_fields = ("grade", "term")
-    readonly_fields = ("total_obtained", "total_out_of", "percent", "gpa", "grade_letter", "created_at", "updated_at")
+    readonly_fields = ("total_obtained", "total_out_of", "percent", "gpa", "grade_letter",
+                       "class_position", "section_position", "created_at", "updated_at")
 
     fieldsets = (
         ("Student & Context", {
             "fields": ("student_name", ("roll_number", "section"), "grade", "term", "is_published")
         }),
         ("Notes", {"fields": ("notes",)}),
-        ("Totals (auto)", {"fields": ("total_obtained", "total_out_of", "percent", "gpa", "grade_letter")}),
+        ("Totals (auto)", {"fields": ("total_obtained", "total_out_of", "percent", "gpa", "grade_letter",
+                                      ("class_position", "section_position"))}),
         ("Audit", {"fields": ("created_at", "updated_at")}),
     )
 
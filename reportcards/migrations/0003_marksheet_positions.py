@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("reportcards", "0002_alter_grade_year_alter_term_year"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="marksheet",
+            name="class_position",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="marksheet",
+            name="section_position",
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="marksheet",
+            index=models.Index(
+                fields=["term", "grade", "class_position"],
+                name="reportcards_term_id_12b993_idx",
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from decimal import Decimal
 from django.db import models
+from django.db.models import Sum
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
@@ -95,9 +96,15 @@ class Marksheet(models.Model):
     updated_at   = models.DateTimeField(auto_now=True)
     is_published = models.BooleanField(default=True)
 
+    # Merit positions among the published marksheets of the same grade + term
+    # (content.services.ranking); NULL until ranked / while unpublished.
+    class_position   = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    section_position = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     class Meta:
         unique_together = (("grade", "term", "student_name", "roll_number"),)
         ordering = ("-updated_at", "student_name")
+        indexes = [models.Index(fields=["term", "grade", "class_position"])]
 
     def __str__(self):
         return f"{self.student_name} — {self.grade} — {self.term}"
@@ -106,6 +113,10 @@ class Marksheet(models.Model):
         rows = list(self.rows.all())
         obtained = sum((r.marks_obtained or 0) for r in rows)
         out_of   = sum((r.max_marks or 0) for r in rows)
+        return self.apply_totals(obtained, out_of)
+
+    def apply_totals(self, obtained, out_of):
+        """Set totals / percent / letter / GPA from already-summed marks."""
         pct      = (float(obtained) / float(out_of) * 100.0) if out_of else 0.0
         letter, gpa = _letter_and_gpa(pct)
 
@@ -156,16 +167,30 @@ class MarkRow(models.Model):
                 raise ValidationError("Subject must belong to the same Grade as the Marksheet.")
 
 
-# -----------------------------
-# Keep totals in sync automatically
-# -----------------------------
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
-
-@receiver([post_save, post_delete], sender=MarkRow)
-def _recalc_parent(sender, instance, **kwargs):
-    ms = instance.marksheet
-    ms.recalc_totals()
-    ms.save(update_fields=[
-        "total_obtained", "total_out_of", "percent", "grade_letter", "gpa", "updated_at"
-    ])
+TOTAL_FIELDS = ["total_obtained", "total_out_of", "percent", "grade_letter", "gpa", "updated_at"]
+
+
+def recalc_marksheets(ids) -> int:
+    """
+    Recompute the totals of every marksheet in `ids` from ONE grouped SUM over
+    their rows and write them back with one bulk_update.
+    (Called on commit by reportcards.signals for the rows a transaction touched.)
+    """
+    ids = set(ids)
+    if not ids:
+        return 0
+    sums = {
+        row["marksheet_id"]: row
+        for row in MarkRow.objects.filter(marksheet_id__in=ids)
+        .values("marksheet_id")
+        .annotate(obtained=Sum("marks_obtained"), out_of=Sum("max_marks"))
+        .order_by()
+    }
+    now = timezone.now()
+    sheets = list(Marksheet.objects.filter(pk__in=ids))
+    for ms in sheets:
+        row = sums.get(ms.pk) or {}
+        ms.apply_totals(row.get("obtained") or Decimal("0"), row.get("out_of") or Decimal("0"))
+        ms.updated_at = now
+    Marksheet.objects.bulk_update(sheets, TOTAL_FIELDS, batch_size=500)
+    return len(sheets)
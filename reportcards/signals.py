@@ -1,14 +1,44 @@
 # reportcards/signals.py
+from functools import partial
+
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from reportcards.models import MarkRow
+from content.services import marksheet_pdf
+from content.services.deferred_recalc import mark_dirty
+from content.services.ranking import rank_marksheets
+from reportcards.models import Marksheet, MarkRow, recalc_marksheets
+
+
+def marks_changed(ids) -> int:
+    """Rows of these marksheets changed: totals, merit positions, cached PDFs."""
+    count = recalc_marksheets(ids)
+    pairs = set(Marksheet.objects.filter(pk__in=ids).values_list("grade_id", "term_id").distinct())
+    rank_marksheets(pairs, target="reportcards")
+    # files are not rolled back: drop the cached PDFs only once the new marks are committed
+    transaction.on_commit(partial(marksheet_pdf.invalidate, list(ids)))
+    return count
+
+
+def _rank(pairs):
+    rank_marksheets(pairs, target="reportcards")
 
 
 @receiver([post_save, post_delete], sender=MarkRow)
-def _recalc_parent(sender, instance, **kwargs):
-    ms = instance.marksheet
-    ms.recalc_totals()
-    ms.save(update_fields=[
-        "total_obtained", "total_out_of", "percent", "grade_letter", "gpa", "updated_at"
-    ])
+def _recalc_parent(sender, instance, using=None, **kwargs):
+    # once per marksheet per transaction, on commit (see content.services.deferred_recalc)
+    mark_dirty("reportcards.marksheet", instance.marksheet_id, marks_changed, using=using)
+
+
+@receiver([post_save, post_delete], sender=Marksheet)
+def _rerank(sender, instance, using=None, **kwargs):
+    # merit positions of the grade + term move when a marksheet is published, edited or removed
+    mark_dirty("reportcards.ranks", (instance.grade_id, instance.term_id), _rank, using=using)
+
+
+@receiver([post_save, post_delete], sender=Marksheet)
+def _drop_pdfs(sender, instance, using=None, **kwargs):
+    # removed or unpublished: no rendered copy of it stays in the PDF cache
+    if kwargs.get("signal") is post_delete or not instance.is_published:
+        transaction.on_commit(partial(marksheet_pdf.invalidate, [instance.pk]), using=using)
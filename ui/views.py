@@ -7,27 +7,31 @@ from django.apps import apps
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.core.mail import EmailMessage, send_mail
+from django.core.cache import cache
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import transaction
 from django.db.models import Q, Prefetch, Count, Case, When, IntegerField
-from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, Http404
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, Http404, FileResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.dateparse import parse_date
 from django.utils.html import strip_tags
 from django.views.decorators.cache import cache_page
 from django.views.decorators.http import require_http_methods, require_GET
 from content.models import StudentMarksheet, StudentMarksheetItem
 
+from content.client_ip import client_ip
 from content.forms import ContactForm
+from content.services import marksheet_pdf as marksheet_pdfs
+from content.services.comms_outbox import queue_email, system_template
 from content.models import (
     Banner, Notice, TimelineEvent, GalleryItem, AboutSection,
     AcademicCalendarItem, Course, FunctionHighlight, CollegeFestival, ContactInfo, FooterSettings, GalleryPost,
     ClassResultSummary, ClassTopper, ExamTerm, AcademicClass, ClassResultSubjectAvg, AttendanceSession, Member,
-    ExamRoutine, BusRoute, StudentMarksheet
+    ExamRoutine, BusRoute, StudentMarksheet, MessageTemplate
 )
-from reportcards.models import MarkRow, Marksheet, Grade
+from reportcards.models import Marksheet, Grade
 
 
 # -------------------------------------------------------------------
@@ -186,16 +190,80 @@ def home(request):
     }
     return render(request, "index.html", context)
 
+CONTACT_NOTIFY_TEMPLATE = "contact_notification"
+CONTACT_ACK_TEMPLATE = "contact_ack"
+
+
+def _contact_throttled(request) -> bool:
+    """
+    Per-IP fixed window in the shared cache: at most CONTACT_THROTTLE_MAX
+    submissions (default 5) per CONTACT_THROTTLE_WINDOW seconds (default 3600).
+    """
+    limit = int(getattr(settings, "CONTACT_THROTTLE_MAX", 5))
+    window = int(getattr(settings, "CONTACT_THROTTLE_WINDOW", 3600))
+    key = f"contact:ip:{client_ip(request) or '-'}"
+    cache.add(key, 0, timeout=window)
+    try:
+        return cache.incr(key) > limit
+    except ValueError:  # expired between add() and incr()
+        cache.set(key, 1, timeout=window)
+        return False
+
+
+def _queue_contact_emails(msg) -> None:
+    """Admin notification + auto-acknowledgement, as outbox rows (sent by the dispatcher)."""
+    site_inbox = getattr(settings, "DEFAULT_CONTACT_EMAIL", None) or getattr(settings, "DEFAULT_FROM_EMAIL", None)
+    context = {
+        "name": msg.name,
+        "email": msg.email,
+        "phone": msg.phone or "-",
+        "subject": msg.subject,
+        "message": msg.message,
+        "sent": f"{msg.created_at:%Y-%m-%d %H:%M}",
+        "site_name": getattr(settings, "SITE_NAME", "Our College"),
+    }
+    if site_inbox:
+        tpl = system_template(
+            CONTACT_NOTIFY_TEMPLATE, kind=MessageTemplate.KIND_EMAIL,
+            subject_template="{% autoescape off %}[Website] New Contact: {{ subject }}{% endautoescape %}",
+            body_text_template=(
+                "{% autoescape off %}New contact message received:\n\n"
+                "Name: {{ name }}\nEmail: {{ email }}\nPhone: {{ phone }}\nSent: {{ sent }}\n\n"
+                "Message:\n{{ message }}\n{% endautoescape %}"
+            ),
+        )
+        if tpl is not None:
+            queue_email(to=site_inbox, template_slug=tpl.slug, context=context, reply_to=msg.email)
+    if msg.email:
+        tpl = system_template(
+            CONTACT_ACK_TEMPLATE, kind=MessageTemplate.KIND_EMAIL,
+            subject_template="Thanks for contacting us",
+            body_text_template=(
+                "{% autoescape off %}Hi {{ name }},\n\n"
+                "Thanks for reaching out. We received your message:\n\n"
+                "Subject: {{ subject }}\nMessage:\n{{ message }}\n\n"
+                "We'll get back to you soon.\n\nBest regards,\n{{ site_name }}{% endautoescape %}"
+            ),
+        )
+        if tpl is not None:
+            queue_email(to=msg.email, template_slug=tpl.slug, context=context)
+
+
 def contact_submit(request):
     """
-    Saves the contact message and sends:
+    Saves the contact message and, in the same transaction, queues:
       1) Notification email to site inbox (DEFAULT_CONTACT_EMAIL or DEFAULT_FROM_EMAIL)
       2) Auto-acknowledgement email to the sender
-    Then redirects back to #contact with a flash message.
+    in the email outbox, so the response never waits for SMTP. Submissions
+    are throttled per client IP. Then redirects back to #contact with a flash message.
     """
     if request.method != "POST":
         return redirect(reverse("home") + "#contact")
 
+    if _contact_throttled(request):
+        messages.error(request, "Too many messages from your network. Please try again later.")
+        return redirect(reverse("home") + "#contact")
+
     form = ContactForm(request.POST)
     if not form.is_valid():
         messages.error(request, "Please fix the errors below.")
@@ -205,64 +273,11 @@ def contact_submit(request):
             "contact_form": form,
         })
 
-    msg = form.save()  # ContactMessage row
-
-    # Email addresses
-    site_inbox = getattr(settings, "DEFAULT_CONTACT_EMAIL", None) or getattr(settings, "DEFAULT_FROM_EMAIL", None)
-    from_addr  = getattr(settings, "DEFAULT_FROM_EMAIL", getattr(settings, "EMAIL_HOST_USER", None))
-
-    # Admin notification
-    admin_ok = False
-    if site_inbox and from_addr:
-        subject_admin = f"[Website] New Contact: {msg.subject}"
-        body_admin = (
-            f"New contact message received:\n\n"
-            f"Name: {msg.name}\n"
-            f"Email: {msg.email}\n"
-            f"Phone: {msg.phone or '-'}\n"
-            f"Sent: {msg.created_at:%Y-%m-%d %H:%M}\n\n"
-            f"Message:\n{msg.message}\n"
-        )
-        try:
-            email_admin = EmailMessage(
-                subject_admin, body_admin, from_addr, [site_inbox],
-                headers={"Reply-To": msg.email}
-            )
-            email_admin.send(fail_silently=False)
-            admin_ok = True
-        except Exception:
-            admin_ok = False
-
-    # Auto-acknowledgement to the sender
-    user_ok = False
-    if from_addr and msg.email:
-        subject_user = "Thanks for contacting us"
-        body_user = (
-            f"Hi {msg.name},\n\n"
-            f"Thanks for reaching out. We received your message:\n\n"
-            f"Subject: {msg.subject}\n"
-            f"Message:\n{msg.message}\n\n"
-            f"We'll get back to you soon.\n\n"
-            f"Best regards,\n"
-            f"{getattr(settings, 'SITE_NAME', 'Our College')}"
-        )
-        try:
-            send_mail(
-                subject_user,
-                body_user,
-                from_addr,
-                [msg.email],  # send to user
-                fail_silently=False,
-            )
-            user_ok = True
-        except Exception:
-            user_ok = False
-
-    if admin_ok:
-        messages.success(request, "Thanks! Your message has been sent.")
-    else:
-        messages.warning(request, "Message saved. Email delivery appears unavailable right now.")
+    with transaction.atomic():
+        msg = form.save()  # ContactMessage row
+        _queue_contact_emails(msg)
 
+    messages.success(request, "Thanks! Your message has been sent.")
     return redirect(reverse("home") + "#contact")
 
 @cache_page(60 * 5)
@@ -370,18 +385,28 @@ def results_detail(request, summary_id: int):
             Prefetch("toppers", queryset=summary_toppers_qs()),
             Prefetch(
                 "subject_avgs",
-                queryset=ClassResultSubjectAvg.objects.select_related("subject").order_by("subject__code"),
+                queryset=ClassResultSubjectAvg.objects.select_related("subject").order_by("subject__order", "subject__name"),
             ),
         ),
         pk=summary_id,
     )
 
+    # stored merit positions (content.services.ranking), read straight off the (term, class, position) index
+    merit = (
+        StudentMarksheet.objects
+        .filter(school_class=summary.klass, term=summary.term, is_published=True, class_position__isnull=False)
+        .order_by("class_position", "section", "roll_number")
+        .values("student_full_name", "roll_number", "section", "class_position", "section_position",
+                "total_pct", "total_grade")
+    )
+
     ctx = {
         "summary": summary,
         "klass": summary.klass,
         "term": summary.term,
         "toppers": summary.toppers.all(),           # already ordered by prefetch
         "subject_avgs": summary.subject_avgs.all(), # already ordered by prefetch
+        "merit": merit,
     }
     return render(request, "results/results_detail.html", ctx)
 
@@ -965,37 +990,22 @@ def marksheet_detail(request, pk: int):
 
 @require_GET
 def marksheet_pdf(request, pk: int):
-    ms = (Marksheet.objects
-          .filter(is_published=True, pk=pk)
-          .select_related("grade", "term")
-          .prefetch_related(
-              Prefetch("rows",
-                       queryset=MarkRow.objects.select_related("subject").order_by("order", "id"))
-          )
-          .first())
+    ms = marksheet_pdfs.marksheets().filter(pk=pk).first()
     if not ms:
         raise Http404("Marksheet not found")
+    rows = list(ms.rows.all())
 
-    html = render_to_string("results/marksheet_pdf.html", {"ms": ms})
-
-    try:
-        from weasyprint import HTML, CSS
-        pdf = HTML(string=html, base_url=request.build_absolute_uri("/")).write_pdf(
-            stylesheets=[CSS(string="""
-                @page { size: A4; margin: 14mm 12mm; }
-                body { font-family: -apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,Arial,"Noto Sans","Helvetica Neue",sans-serif; }
-                table { width: 100%; border-collapse: collapse; }
-                th, td { border: 1px solid #ddd; padding: 6px 8px; font-size: 12px; }
-                th { background: #f6f8fa; }
-                h1,h2,h3 { margin: 0 0 6px 0; }
-                .muted { color: #6c757d; }
-                .sigline { height: 40px; border-bottom: 1px dashed #999; }
-                .foot { margin-top: 16px; display: flex; justify-content: space-between; gap: 16px; }
-            """)]
-        )
-        resp = HttpResponse(pdf, content_type="application/pdf")
+    # content-addressed: the ETag changes whenever marks, positions or the template do
+    key = marksheet_pdfs.cache_key(ms, rows)
+    etag = f'"{key}"'
+    resp = get_conditional_response(request, etag=etag)
+    if resp is None:
+        try:
+            pdf = marksheet_pdfs.open_pdf(ms, rows, key=key, base_url=request.build_absolute_uri("/"))
+        except Exception:
+            return HttpResponse(marksheet_pdfs.render_html(ms, rows))
         safe_name = strip_tags(f"{ms.student_name}_{ms.grade}_{ms.term}").replace(" ", "_")
-        resp["Content-Disposition"] = f'inline; filename="{safe_name}.pdf"'
-        return resp
-    except Exception:
-        return HttpResponse(html)
\ No newline at end of file
+        resp = FileResponse(pdf, content_type="application/pdf", filename=f"{safe_name}.pdf")
+    resp["ETag"] = etag
+    patch_cache_control(resp, public=True, max_age=marksheet_pdfs.max_age())
+    return resp
\ No newline at end of file